@@ -0,0 +1,99 @@
+# Time vs batch size for POST /inventory/bulk: the old per-item ilike lookup
+# against the set-based upsert in services/inventory_service.py.
+#
+#   python -m backend.benchmarks.bench_bulk_upsert [--catalog 5000] [--sizes 10,50,200,1000]
+import argparse
+import os
+import random
+import tempfile
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from .. import database, models
+from ..services.inventory_service import upsert_products
+from ..services.product_index import product_index
+
+
+def legacy_bulk(db, products):
+    # Copy of the pre-upsert endpoint body
+    processed = []
+    for product in products:
+        existing = db.query(database.Product).filter(database.Product.name.ilike(product.name)).first()
+        if existing:
+            existing.stock += product.stock
+            if product.price > 0:
+                existing.price = product.price
+            processed.append(existing)
+        else:
+            db_product = database.Product(**product.dict())
+            db.add(db_product)
+            processed.append(db_product)
+    db.commit()
+    for p in processed:
+        db.refresh(p)
+    return processed
+
+
+def set_based_bulk(db, products):
+    result = upsert_products(db, products)
+    db.commit()
+    return result
+
+
+def make_session(path: str, catalog_size: int):
+    engine = create_engine(f"sqlite:///{path}")
+    database.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    db = Session()
+    db.add(database.DataVersion(id=1, version=0))
+    db.add_all([
+        database.Product(name=f"Catalog Item {i}", category="Bench", price=10.0, stock=100, max_stock=200)
+        for i in range(catalog_size)
+    ])
+    db.commit()
+    return engine, db
+
+
+def make_batch(size: int, catalog_size: int):
+    # Half existing products (different case), half new ones
+    batch = []
+    for i in range(size):
+        if i % 2 == 0:
+            name = f"catalog item {random.randrange(catalog_size)}"
+        else:
+            name = f"New Supplier Item {random.randrange(10 ** 9)}"
+        batch.append(models.ProductCreate(name=name, category="Uncategorized", price=12.5, stock=5))
+    return batch
+
+
+def run(catalog_size: int, sizes: list, repeats: int):
+    print(f"catalog={catalog_size} products, best of {repeats}")
+    print(f"{'batch':>6} {'legacy ms':>10} {'set-based ms':>13} {'speedup':>8}")
+    for size in sizes:
+        timings = {}
+        for label, fn in (("legacy", legacy_bulk), ("set", set_based_bulk)):
+            best = None
+            for _ in range(repeats):
+                with tempfile.TemporaryDirectory() as tmp:
+                    engine, db = make_session(os.path.join(tmp, "bench.db"), catalog_size)
+                    # Fresh DB each run; the fuzzy index is warm in a running server
+                    product_index.rebuild(db)
+                    random.seed(size)
+                    batch = make_batch(size, catalog_size)
+                    started = time.perf_counter()
+                    fn(db, batch)
+                    elapsed = time.perf_counter() - started
+                    db.close()
+                    engine.dispose()
+                best = elapsed if best is None else min(best, elapsed)
+            timings[label] = best * 1000
+        print(f"{size:>6} {timings['legacy']:>10.1f} {timings['set']:>13.1f} {timings['legacy'] / timings['set']:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--catalog", type=int, default=5000)
+    parser.add_argument("--sizes", default="10,50,200,1000")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    run(args.catalog, [int(s) for s in args.sizes.split(",")], args.repeats)
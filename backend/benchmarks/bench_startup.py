@@ -0,0 +1,82 @@
+# Cold-start time of one worker (import + lifespan startup until it can serve),
+# on a fresh database and on an existing one, plus a multi-worker start on one
+# fresh database to check that seeding happens exactly once.
+#
+#   python -m backend.benchmarks.bench_startup [--runs 5] [--workers 4]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Runs in a child process so every start really is cold
+CHILD = """
+import asyncio, json, time
+started = time.perf_counter()
+from backend.main import app, startup_timings
+
+async def main():
+    async with app.router.lifespan_context(app):
+        ready = time.perf_counter()
+    return ready
+
+ready = asyncio.run(main())
+print(json.dumps({**startup_timings, "ready_ms": round((ready - started) * 1000, 1)}))
+"""
+
+
+def start_worker(workdir: str) -> subprocess.Popen:
+    env = dict(os.environ, PYTHONPATH=ROOT, TTS_PREWARM="0", MANDI_REFRESH_SECONDS="0", CLIENTS_PRELOAD="0")
+    return subprocess.Popen([sys.executable, "-W", "ignore", "-c", CHILD], cwd=workdir, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+
+def result(process: subprocess.Popen) -> dict:
+    output, _ = process.communicate()
+    lines = output.strip().splitlines()
+    if process.returncode != 0 or not lines:
+        sys.exit(f"Worker failed:\n{output}")
+    return json.loads(lines[-1])
+
+
+def report(label: str, runs: list):
+    print(f"{label:<14} " + "  ".join(
+        f"{key} {statistics.median(r[key] for r in runs):>7.1f}" for key in ("import_ms", "init_ms", "ready_ms")))
+
+
+def product_count(workdir: str) -> int:
+    import sqlite3
+    with sqlite3.connect(os.path.join(workdir, "kirana.db")) as conn:
+        return conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+
+def run(runs: int, workers: int):
+    print(f"Median of {runs} runs (ms)")
+    fresh = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as workdir:
+            fresh.append(result(start_worker(workdir)))
+    report("fresh db", fresh)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        result(start_worker(workdir))
+        existing = [result(start_worker(workdir)) for _ in range(runs)]
+    report("existing db", existing)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        processes = [start_worker(workdir) for _ in range(workers)]
+        together = [result(p) for p in processes]
+        report(f"{workers} workers", together)
+        print(f"Products after concurrent start: {product_count(workdir)} (expect one seed)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    run(args.runs, args.workers)
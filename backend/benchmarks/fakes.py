@@ -0,0 +1,168 @@
+# Deterministic offline stand-ins for Gemini, edge-tts and the data.gov.in mandi
+# API, so benchmarks exercise our own code paths without network or API quota.
+# Latencies are fixed (plus optional seeded jitter) so runs are comparable.
+import asyncio
+import json
+import random
+import re
+from datetime import date
+from types import SimpleNamespace
+import httpx
+
+_WORD_RE = re.compile(r"[a-z]{3,}")
+
+
+class Latency:
+    def __init__(self, seconds: float, jitter: float = 0.0, seed: int = 0):
+        self.seconds = seconds
+        self.jitter = jitter
+        self._random = random.Random(seed)
+
+    async def wait(self):
+        delay = self.seconds + (self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def _response(text: str, prompt_chars: int = 0):
+    usage = SimpleNamespace(prompt_token_count=prompt_chars // 4, candidates_token_count=len(text) // 4)
+    return SimpleNamespace(text=text, usage_metadata=usage)
+
+
+def _catalog(prompt: str) -> dict:
+    # The "Catalog" CSV the prompt builder puts in front of the question: lowercase name -> id
+    if "id,name,aliases,price,stock\n" not in prompt:
+        return {}
+    block = prompt.split("id,name,aliases,price,stock\n", 1)[1].split("\n\n", 1)[0]
+    products = {}
+    for line in block.splitlines():
+        product_id, _, rest = line.partition(",")
+        if product_id.isdigit():
+            products[rest.split(",", 1)[0].strip('"').lower()] = int(product_id)
+    return products
+
+
+def _sql_for(message: str, catalog: dict = None) -> str:
+    # Same question -> same SQL, so the chat cache and local renderer behave as in production.
+    # Products found in the prompt's catalog are targeted by id because this fake is
+    # scripted to do so; whether Gemini follows the catalog rule has not been measured.
+    lowered = message.lower()
+    if "total" in lowered or "revenue" in lowered:
+        return "SELECT SUM(units) AS units_sold, SUM(revenue) AS revenue FROM sales_daily WHERE day >= date('now', '-7 day')"
+    if "top" in lowered or "best" in lowered:
+        return ("SELECT p.name AS name, SUM(d.units) AS units_sold FROM sales_daily d JOIN products p ON p.id = d.product_id "
+                "GROUP BY d.product_id ORDER BY units_sold DESC LIMIT 5")
+    if "low" in lowered:
+        return "SELECT name, stock FROM products WHERE stock < 10 ORDER BY stock LIMIT 20"
+    words = [w for w in _WORD_RE.findall(lowered) if w not in {"how", "much", "what", "the", "price", "stock"}]
+    word = words[-1] if words else "rice"
+    ids = [product_id for name, product_id in (catalog or {}).items() if any(w in name.split() for w in words)][:10]
+    if ids:
+        return f"SELECT name, stock FROM products WHERE id IN ({', '.join(map(str, ids))})"
+    return f"SELECT name, stock FROM products WHERE name LIKE '%{word}%' LIMIT 10"
+
+
+class _FakeStream:
+    def __init__(self, text: str, latency: Latency):
+        self._pieces = [p + " " for p in text.split(" ")]
+        self._latency = latency
+        self.usage_metadata = SimpleNamespace(prompt_token_count=0, candidates_token_count=len(text) // 4)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for i in range(0, len(self._pieces), 4):
+            await asyncio.sleep(self._latency.seconds / 10)
+            yield SimpleNamespace(text="".join(self._pieces[i:i + 4]))
+
+
+def _chat_reply(contents: list, stream: bool):
+    # Chat calls carry the whole conversation; the last user turn is either the
+    # SQL prompt or (after a model turn with the SQL) the answer prompt
+    prompt = contents[-1]["parts"][0]
+    if "User Question:" not in prompt:
+        # The question is on the "User:" line (a history summary may come first)
+        message = next((line[5:] for line in prompt.split("\n") if line.startswith("User:")), prompt).strip()
+        if message.lower().startswith(("hi", "hello", "thanks")):
+            return _response(json.dumps({"type": "answer", "content": "Hello! How can I help?"}), len(prompt))
+        return _response(json.dumps({"type": "sql", "content": _sql_for(message, _catalog(prompt))}), len(prompt))
+    answer = "Here is what I found. Stock levels look fine for most items. Let me know if you need anything else."
+    if stream:
+        return answer
+    return _response(json.dumps({"type": "answer", "content": answer}), len(prompt))
+
+
+class FakeGenerativeModel:
+    # Covers the calls made by chat_service, live_chat (transcription) and vision
+    def __init__(self, latency: Latency, transcript: str = "how much sugar left"):
+        self._latency = latency
+        self._transcript = transcript
+
+    async def generate_content_async(self, parts, stream: bool = False, **kwargs):
+        await self._latency.wait()
+        if parts and isinstance(parts[-1], dict) and "role" in parts[-1]:
+            reply = _chat_reply(parts, stream)
+            return _FakeStream(reply, self._latency) if stream else reply
+        prompt = next((p for p in parts if isinstance(p, str)), "")
+        if "transcribe" in prompt:
+            return _response(self._transcript, len(prompt))
+        if "bill" in prompt:
+            return _response(json.dumps([
+                {"name": "Sugar", "quantity": 10, "price": 38},
+                {"name": "Toor Dal", "quantity": 5, "price": 110},
+            ]), len(prompt))
+        return _response(json.dumps([{"name": "Maggi Noodles", "shelf": "E1"}]), len(prompt))
+
+
+class FakeCommunicate:
+    # edge_tts.Communicate: a few MP3-sized chunks after a first-byte delay
+    latency = Latency(0.05)
+    chunk = b"\xff\xf3" + b"\x00" * 4094
+
+    def __init__(self, text: str, voice: str, **kwargs):
+        self._chunks = max(1, len(text) // 40)
+
+    async def stream(self):
+        await self.latency.wait()
+        for _ in range(self._chunks):
+            yield {"type": "audio", "data": self.chunk}
+
+
+def mandi_transport(latency_seconds: float = 0.05, records: int = 2000) -> httpx.MockTransport:
+    commodities = ["Onion", "Potato", "Tomato", "Rice", "Wheat", "Banana", "Apple", "Sugar", "Turmeric", "Coconut"]
+    states = ["Telangana", "Karnataka", "Maharashtra", "Andhra Pradesh", "Tamil Nadu"]
+    today = date.today().strftime("%d/%m/%Y")
+    rows = [
+        {
+            "state": states[i % len(states)], "district": f"District {i % 40}", "market": f"Market {i % 200}",
+            "commodity": commodities[i % len(commodities)], "variety": "Other", "grade": "FAQ",
+            "arrival_date": today, "min_price": str(1000 + i % 500), "max_price": str(2000 + i % 500),
+            "modal_price": str(1500 + i % 500),
+        }
+        for i in range(records)
+    ]
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency_seconds)
+        offset = int(request.url.params.get("offset", 0))
+        limit = int(request.url.params.get("limit", 10))
+        return httpx.Response(200, json={"records": rows[offset:offset + limit]})
+
+    return httpx.MockTransport(handler)
+
+
+def install(llm_latency: float = 0.3, tts_latency: float = 0.05, mandi_latency: float = 0.05, jitter: float = 0.0):
+    # Models go through the client registry; tts_service imports edge_tts lazily
+    import edge_tts
+    from ..services import clients, mandi_service
+
+    model = FakeGenerativeModel(Latency(llm_latency, jitter))
+    clients.api_key = "benchmark"
+    for name in ("chat", "transcription", "vision"):
+        clients.set_model(name, model)
+
+    FakeCommunicate.latency = Latency(tts_latency, jitter)
+    edge_tts.Communicate = FakeCommunicate
+
+    mandi_service.client = httpx.AsyncClient(transport=mandi_transport(mandi_latency))
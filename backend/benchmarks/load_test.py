@@ -0,0 +1,370 @@
+# Mixed-workload load test for the whole API with Gemini, edge-tts and the mandi
+# upstream replaced by the fakes in benchmarks/fakes.py. Requests go through
+# httpx's ASGI transport, so the numbers cover routing, validation, DB and our
+# services but not network or uvicorn overhead.
+#
+#   python -m backend.benchmarks.load_test [--products 5000] [--sales 1000000]
+#       [--duration 30] [--concurrency 16] [--mix chat=30,sales=20,...]
+#       [--save-baseline backend/benchmarks/baselines/local.json]
+#       [--compare backend/benchmarks/baselines/local.json --tolerance 0.2]
+#
+# The seeded database lives in --workdir (reused across runs when the sizes
+# match) so the real kirana.db is never touched. --compare exits non-zero when
+# an endpoint's p95 regressed by more than --tolerance against the baseline.
+#
+# baselines/local.json is the reference run at the default sizes (5000
+# products, 1M sales; seeding takes about a minute the first time). Latencies
+# depend on the machine: re-record it with --save-baseline after hardware
+# changes, and on shared hosts use a longer --duration or a wider --tolerance,
+# since 20 s runs vary by more than 20% at p95 there.
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import wave
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+DEFAULT_MIX = {
+    "chat_fast": 20, "chat_llm": 10, "chat_cached": 10, "sales_list": 10, "sales_analytics": 10,
+    "sale_create": 10, "inventory_list": 10, "mandi_prices": 10, "live_chat": 5, "vision_ocr": 5,
+}
+
+BASE_PRODUCTS = ["Sona Masoori Rice", "Toor Dal", "Sugar", "Tata Salt", "Maggi Noodles", "Milk (500ml)",
+                 "Curd", "Good Day Biscuits", "Potato (1kg)", "Onion (1kg)", "Coke (750ml)", "Tea Powder (250g)"]
+BRANDS = ["Aashirvaad", "Fortune", "Tata", "Patanjali", "Amul", "Britannia", "Haldiram", "MDH", "Everest", "Parle"]
+ITEMS = ["Basmati Rice", "Moong Dal", "Chana Dal", "Groundnut Oil", "Ghee", "Paneer", "Cookies", "Namkeen",
+         "Garam Masala", "Jeera", "Rava", "Poha", "Besan", "Jaggery", "Honey", "Soap", "Detergent", "Toothpaste"]
+SIZES = ["100g", "250g", "500g", "1kg", "5kg", "200ml", "500ml", "1L"]
+
+
+def seed(products: int, sales: int):
+    # Core executemany inserts; ORM objects would dominate the seeding time
+    from sqlalchemy import insert, func, select
+    from .. import database
+    from ..services.rollups import rebuild_rollups
+
+    # Sizes are recorded next to the database: sale_create adds rows during a
+    # run, so counting the tables would not recognise a reusable seed
+    marker = "seed.json"
+    wanted = {"products": products, "sales": sales}
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if json.load(f) == wanted:
+                print(f"Reusing seeded database: {products} products, {sales} sales")
+                return
+        sys.exit("Work directory was seeded with different sizes; use a fresh --workdir")
+
+    database.init_db()
+    db = database.SessionLocal()
+    try:
+        if db.execute(select(func.count()).select_from(database.Product.__table__)).scalar():
+            sys.exit("Work directory already holds a database; use a fresh --workdir")
+
+        rng = random.Random(42)
+        print(f"Seeding {products} products and {sales} sales...")
+        started = time.perf_counter()
+        names = list(BASE_PRODUCTS)
+        while len(names) < products:
+            names.append(f"{rng.choice(BRANDS)} {rng.choice(ITEMS)} {rng.choice(SIZES)} #{len(names)}")
+        rows = [
+            {"name": name, "category": rng.choice(["Grains", "Pulses", "Snacks", "Dairy", "Spices", "Essentials"]),
+             "price": round(rng.uniform(10, 500), 2), "stock": rng.randint(1000, 100000), "max_stock": 100000}
+            for name in names[:products]
+        ]
+        db.execute(insert(database.Product.__table__), rows)
+        prices = [r["price"] for r in rows]
+
+        now = datetime.utcnow()
+        batch = []
+        for i in range(sales):
+            product_id = int(rng.paretovariate(1.2)) % products + 1
+            quantity = rng.randint(1, 5)
+            batch.append({
+                "product_id": product_id, "quantity": quantity,
+                "total_amount": round(prices[product_id - 1] * quantity, 2),
+                "timestamp": now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600)),
+            })
+            if len(batch) == 50000:
+                db.execute(insert(database.Sale.__table__), batch)
+                batch = []
+        if batch:
+            db.execute(insert(database.Sale.__table__), batch)
+        rebuild_rollups(db)
+        db.commit()
+        with open(marker, "w") as f:
+            json.dump(wanted, f)
+        print(f"Seeded in {time.perf_counter() - started:.1f}s")
+    finally:
+        db.close()
+
+
+def sample_wav() -> bytes:
+    rate = 16000
+    frames = bytearray()
+    for i in range(rate):
+        value = int(8000 * math.sin(2 * math.pi * 300 * i / rate)) if rate // 4 < i < 3 * rate // 4 else 0
+        frames += value.to_bytes(2, "little", signed=True)
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(bytes(frames))
+    return out.getvalue()
+
+
+def sample_jpeg(seed_value: int) -> bytes:
+    from PIL import Image, ImageDraw
+    rng = random.Random(seed_value)
+    image = Image.new("RGB", (2400, 1800), "white")
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rng.randint(0, 2200), rng.randint(0, 1600)
+        draw.rectangle([x, y, x + rng.randint(20, 400), y + rng.randint(20, 200)], fill=(rng.randint(0, 255),) * 3)
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+class Workload:
+    def __init__(self, products: int):
+        self.products = products
+        self.wav = sample_wav()
+        # A handful of distinct bills: repeats exercise the perceptual cache like re-uploads do
+        self.jpegs = [sample_jpeg(i) for i in range(8)]
+        self.counter = 0
+
+    async def chat_fast(self, client, rng):
+        item = rng.choice(["sugar", "rice", "dal", "salt", "maggi", "milk", "curd", "tea"])
+        return await client.post("/chat/", json={"message": f"how much {item} left", "language": "en"})
+
+    async def chat_llm(self, client, rng):
+        # Unique text: always misses the cache and goes through the (fake) model
+        self.counter += 1
+        word = rng.choice(["ghee", "paneer", "jeera", "poha", "besan", "honey", "soap"])
+        return await client.post("/chat/", json={"message": f"which {word} items do we have #{self.counter}"})
+
+    async def chat_cached(self, client, rng):
+        message = rng.choice(["show low stock items", "top selling products", "total revenue this week"])
+        return await client.post("/chat/", json={"message": message})
+
+    async def sales_list(self, client, rng):
+        return await client.get("/sales/", params={"limit": 50})
+
+    async def sales_analytics(self, client, rng):
+        path = rng.choice(["/sales/analytics/top", "/sales/analytics/daily", "/sales/analytics/categories"])
+        return await client.get(path)
+
+    async def sale_create(self, client, rng):
+        return await client.post("/sales/", json={"product_id": rng.randint(1, self.products), "quantity": 1})
+
+    async def inventory_list(self, client, rng):
+        return await client.get("/inventory/")
+
+    async def mandi_prices(self, client, rng):
+        return await client.get("/mandi/prices", params={"limit": 20, "commodity": rng.choice(["Onion", "Rice", "Potato"])})
+
+    async def live_chat(self, client, rng):
+        return await client.post("/live/chat", files={"file": ("voice.wav", self.wav, "audio/wav")})
+
+    async def vision_ocr(self, client, rng):
+        return await client.post("/vision/ocr", files={"file": ("bill.jpg", rng.choice(self.jpegs), "image/jpeg")})
+
+
+def percentile(samples: list, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+async def drive(app, workload: Workload, mix: dict, duration: float, concurrency: int, seed_value: int):
+    import httpx
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    deadline = time.perf_counter() + duration
+
+    async def worker(index: int):
+        rng = random.Random(seed_value + index)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                started = time.perf_counter()
+                try:
+                    response = await getattr(workload, name)(client, rng)
+                    failed = response.status_code >= 400
+                except Exception as e:
+                    print(f"{name} raised: {e}")
+                    failed = True
+                latencies[name].append(time.perf_counter() - started)
+                if failed:
+                    errors[name] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for name in names:
+        samples = latencies[name]
+        results[name] = {
+            "requests": len(samples),
+            "errors": errors[name],
+            "rps": round(len(samples) / elapsed, 2),
+            "p50_ms": round(percentile(samples, 50) * 1000, 2),
+            "p95_ms": round(percentile(samples, 95) * 1000, 2),
+            "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        }
+    total = sum(len(s) for s in latencies.values())
+    results["_total"] = {
+        "requests": total,
+        "errors": sum(errors.values()),
+        "rps": round(total / elapsed, 2),
+        "p50_ms": round(percentile([x for s in latencies.values() for x in s], 50) * 1000, 2),
+        "p95_ms": round(percentile([x for s in latencies.values() for x in s], 95) * 1000, 2),
+        "p99_ms": round(percentile([x for s in latencies.values() for x in s], 99) * 1000, 2),
+    }
+    return results
+
+
+def print_results(results: dict, baseline: dict = None):
+    header = f"{'endpoint':<16} {'reqs':>7} {'err':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    if baseline:
+        header += f" {'p95 vs base':>12}"
+    print(header)
+    for name, r in results.items():
+        line = (f"{name:<16} {r['requests']:>7} {r['errors']:>5} {r['rps']:>8.1f} "
+                f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f}")
+        base = (baseline or {}).get(name)
+        if base and base["p95_ms"]:
+            line += f" {(r['p95_ms'] / base['p95_ms'] - 1) * 100:>+11.0f}%"
+        print(line)
+
+
+_CHAT_SQL_SERIES = {
+    "kirana_sql_statements_per_turn_sum": "statements",
+    "kirana_sql_statements_per_turn_count": "turns",
+    'kirana_events_total{event="sql_like_scan"}': "like_scans",
+    'kirana_events_total{event="sql_id_lookup"}': "id_lookups",
+}
+
+
+def chat_sql_summary() -> str:
+    # Statements and scans behind the chat turns that went to SQL, from /metrics.
+    # The SQL comes from the fake model's script, so these show the query cost of
+    # that script, not how often the real model uses ids instead of LIKE
+    from ..services.metrics import registry
+    values = {"statements": 0.0, "turns": 0.0, "like_scans": 0.0, "id_lookups": 0.0}
+    for line in registry.render().splitlines():
+        name, _, value = line.rpartition(" ")
+        if name in _CHAT_SQL_SERIES:
+            values[_CHAT_SQL_SERIES[name]] = float(value)
+    turns = values["turns"]
+    if not turns:
+        return "Chat SQL: no turns"
+    return (f"Chat SQL (scripted fake model): {int(turns)} turns, {values['statements'] / turns:.2f} statements/turn, "
+            f"{values['like_scans'] / turns:.2f} LIKE scans/turn, {values['id_lookups'] / turns:.2f} id lookups/turn")
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    found = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if not current or not base["p95_ms"]:
+            continue
+        if current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            found.append(f"{name}: p95 {base['p95_ms']:.1f} -> {current['p95_ms']:.1f} ms")
+        if current["errors"] > base["errors"]:
+            found.append(f"{name}: errors {base['errors']} -> {current['errors']}")
+    return found
+
+
+def parse_mix(text: str) -> dict:
+    if not text:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in DEFAULT_MIX:
+            sys.exit(f"Unknown workload '{name}'. Choose from: {', '.join(DEFAULT_MIX)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--sales", type=int, default=1000000)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", default="")
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--tts-latency", type=float, default=0.05)
+    parser.add_argument("--mandi-latency", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "kirana_bench"))
+    parser.add_argument("--save-baseline")
+    parser.add_argument("--compare")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    # The app's SQLite path is relative to the working directory
+    os.makedirs(args.workdir, exist_ok=True)
+    baseline_path = os.path.abspath(args.save_baseline) if args.save_baseline else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    os.chdir(args.workdir)
+    os.environ.setdefault("TTS_CACHE_DIR", os.path.join(args.workdir, "tts_cache"))
+    os.environ.setdefault("TTS_PREWARM", "0")
+    os.environ.setdefault("MANDI_REFRESH_SECONDS", "0")
+    # The fake model has no quota; measure the app, not our own rate limit
+    os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", "0")
+
+    seed(args.products, args.sales)
+    from ..main import app
+    from . import fakes
+    fakes.install(args.llm_latency, args.tts_latency, args.mandi_latency)
+
+    mix = parse_mix(args.mix)
+    config = {k: v for k, v in vars(args).items() if k not in ("save_baseline", "compare", "workdir")}
+    config["mix"] = mix
+    print(f"Running {args.duration:.0f}s at concurrency {args.concurrency}: {mix}")
+    results = asyncio.run(drive(app, Workload(args.products), mix, args.duration, args.concurrency, args.seed))
+
+    baseline = None
+    if compare_path:
+        with open(compare_path) as f:
+            saved = json.load(f)
+        baseline = saved["results"]
+        differs = sorted(k for k in config if k != "tolerance" and saved["config"].get(k) != config[k])
+        if differs:
+            print(f"Warning: baseline was recorded with different {', '.join(differs)}")
+    print_results(results, baseline)
+    print(chat_sql_summary())
+
+    if baseline_path:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump({"created": datetime.utcnow().isoformat(), "config": config, "results": results}, f, indent=2)
+        print(f"Baseline saved to {baseline_path}")
+
+    if baseline:
+        found = regressions(results, baseline, args.tolerance)
+        if found:
+            print("Regressions:\n  " + "\n  ".join(found))
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,104 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, Date, DateTime, ForeignKey, Index, UniqueConstraint, func
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.exc import IntegrityError, OperationalError
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
+import os
+import time
+import asyncio
 
-DATABASE_URL = "sqlite:///./kirana.db"
+# DATABASE_URL selects the database (default: the local SQLite file). Routes use
+# the async engine (aiosqlite, or asyncpg for Postgres); startup, background
+# threads and benchmarks use the sync engine on the same database.
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./kirana.db")
+
+# Connection pool per engine; recycle and pre-ping only apply to server databases
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+
+# Drivers used when DATABASE_URL names none. The Postgres pair is in
+# requirements.txt; MySQL needs `pip install aiomysql pymysql`.
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg", "mysql": "aiomysql"}
+SYNC_DRIVERS = {"sqlite": "pysqlite", "postgresql": "psycopg", "mysql": "pymysql"}
+
+def _engine_urls(url: str):
+    # Render and Heroku hand out postgres://, which SQLAlchemy no longer accepts
+    url = make_url(url.replace("postgres://", "postgresql://", 1))
+    backend = url.get_backend_name()
+    driver = url.get_driver_name()
+    explicit = "+" in url.drivername
+    if explicit and driver in ASYNC_DRIVERS.values():
+        async_driver, sync_driver = driver, SYNC_DRIVERS.get(backend)
+    else:
+        # Pinned rather than left to SQLAlchemy, whose default changed (psycopg2 -> psycopg)
+        async_driver = ASYNC_DRIVERS.get(backend, driver)
+        sync_driver = driver if explicit else SYNC_DRIVERS.get(backend)
+    sync_url = url.set(drivername=f"{backend}+{sync_driver}" if sync_driver else backend)
+    return sync_url, url.set(drivername=f"{backend}+{async_driver}")
+
+def _engine_options(url) -> dict:
+    options = {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW}
+    if url.get_backend_name() == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            return {"connect_args": {"check_same_thread": False}}
+        options["connect_args"] = {"check_same_thread": False}
+    else:
+        options.update(pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=True)
+    return options
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL: readers and the single writer no longer block each other
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # Durable at checkpoints rather than every commit; safe against corruption in WAL mode
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    # Wait for the write lock instead of failing with "database is locked"
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_BYTES}")
+    cursor.close()
+
+def _sqlite_read_only(dbapi_connection, connection_record):
+    _sqlite_pragmas(dbapi_connection, connection_record)
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+def _read_only_options(url) -> dict:
+    options = _engine_options(url)
+    if url.get_backend_name() == "postgresql":
+        options["connect_args"] = {"server_settings": {"default_transaction_read_only": "on"}}
+    return options
+
+SYNC_DATABASE_URL, ASYNC_DATABASE_URL = _engine_urls(DATABASE_URL)
+
+engine = create_engine(SYNC_DATABASE_URL, **_engine_options(SYNC_DATABASE_URL))
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options(ASYNC_DATABASE_URL))
+if SYNC_DATABASE_URL.get_backend_name() == "sqlite":
+    event.listen(engine, "connect", _sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas)
+
+# Model-generated reads (services/sql_engine.py) run on connections that refuse
+# writes, whatever the statement turns out to do. An in-memory SQLite database
+# cannot be opened twice, so there the main engine is shared.
+if SYNC_DATABASE_URL.get_backend_name() == "sqlite" and SYNC_DATABASE_URL.database in (None, "", ":memory:"):
+    read_only_engine = async_engine
+else:
+    read_only_engine = create_async_engine(ASYNC_DATABASE_URL, **_read_only_options(ASYNC_DATABASE_URL))
+    if SYNC_DATABASE_URL.get_backend_name() == "sqlite":
+        event.listen(read_only_engine.sync_engine, "connect", _sqlite_read_only)
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: routes return ORM objects after commit, and reloading
+# expired attributes outside the session's greenlet is not allowed
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+ReadOnlySessionLocal = async_sessionmaker(read_only_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 class Product(Base):
@@ -24,6 +116,11 @@ class Product(Base):
 
     sales = relationship("Sale", back_populates="product")
 
+    __table_args__ = (
+        # Case-insensitive name lookups (bulk import resolves names with lower(name) IN (...))
+        Index("ix_products_name_lower", func.lower(name)),
+    )
+
 class Sale(Base):
     __tablename__ = "sales"
 
@@ -31,16 +128,137 @@ class Sale(Base):
     product_id = Column(Integer, ForeignKey("products.id"))
     quantity = Column(Integer)
     total_amount = Column(Float)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
 
     product = relationship("Product", back_populates="sales")
 
-def init_db():
-    Base.metadata.create_all(bind=engine)
+    __table_args__ = (
+        # Per-product history and date-range filters on GET /sales
+        Index("ix_sales_product_id_timestamp", "product_id", "timestamp"),
+    )
+
+class SalesDaily(Base):
+    # Per product per day totals, maintained incrementally on every sale write
+    # (services/rollups.py) so analytics cost O(days) instead of O(sales)
+    __tablename__ = "sales_daily"
+
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    units = Column(Integer, default=0, nullable=False)
+    revenue = Column(Float, default=0, nullable=False)
+
+    __table_args__ = (
+        Index("ix_sales_daily_day", "day"),
+    )
+
+class DataVersion(Base):
+    # Single-row counter bumped in the same transaction as every data write.
+    # Response caches key on it, so it lives in the DB to be shared across workers.
+    __tablename__ = "data_version"
 
-def get_db_connection():
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+
+class AppFlag(Base):
+    # One-off startup steps (e.g. seeding) claimed by inserting a row: with several
+    # workers starting at once, only the one whose insert succeeds does the work
+    __tablename__ = "app_flags"
+
+    name = Column(String, primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class MandiPrice(Base):
+    # Local mirror of the data.gov.in mandi price feed, refreshed in the background
+    # (services/mandi_service.py) so /mandi/prices never waits on the upstream API.
+    # Missing text fields are stored as "" so the natural key below stays unique.
+    __tablename__ = "mandi_prices"
+
+    id = Column(Integer, primary_key=True)
+    state = Column(String, nullable=False, default="")
+    district = Column(String, nullable=False, default="")
+    market = Column(String, nullable=False, default="")
+    commodity = Column(String, nullable=False, default="")
+    variety = Column(String, nullable=False, default="")
+    grade = Column(String, nullable=False, default="")
+    arrival_date = Column(Date, nullable=False)
+    min_price = Column(Float) # Rs per quintal
+    max_price = Column(Float)
+    modal_price = Column(Float)
+    fetched_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("state", "district", "market", "commodity", "variety", "grade", "arrival_date",
+                         name="uq_mandi_prices_record"),
+        # Filters are case-insensitive, so index the lowered values
+        Index("ix_mandi_prices_commodity_lower", func.lower(commodity), arrival_date),
+        Index("ix_mandi_prices_state_lower", func.lower(state)),
+        Index("ix_mandi_prices_market_lower", func.lower(market)),
+        Index("ix_mandi_prices_arrival_date", arrival_date),
+    )
+
+def ensure_indexes():
+    # create_all skips tables that already exist, so indexes added after a
+    # table was first created have to be created explicitly
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+def _create_schema():
+    Base.metadata.create_all(bind=engine)
+    ensure_indexes()
     db = SessionLocal()
     try:
-        yield db
+        # 1 = data version, 2 = catalog version (see services/data_version.py)
+        for counter in (1, 2):
+            if not db.query(DataVersion).filter(DataVersion.id == counter).first():
+                db.add(DataVersion(id=counter, version=0))
+        db.commit()
     finally:
         db.close()
+
+def init_db(attempts: int = 5):
+    # Workers starting together can race between create_all's existence check and
+    # CREATE TABLE, or on the counter rows; the loser retries and finds them in place
+    for attempt in range(attempts):
+        try:
+            _create_schema()
+            return
+        except (OperationalError, IntegrityError) as e:
+            if attempt == attempts - 1:
+                raise
+            print(f"init_db raced with another worker ({type(e).__name__}); retrying")
+            time.sleep(0.2 * (attempt + 1))
+
+def claim_flag(db, name: str) -> bool:
+    # True if this caller set the flag; the row stays locked until db commits,
+    # so concurrent claimers wait and then see it already exists
+    db.add(AppFlag(name=name))
+    try:
+        db.flush()
+        return True
+    except IntegrityError:
+        db.rollback()
+        return False
+
+# SQLite has a single writer. Without a gate, concurrent write transactions in one
+# worker each hold a pooled connection and spin in the busy handler while the
+# holder waits for the event loop to run its next statement; queueing them on an
+# asyncio lock instead keeps lock hold times short. Server databases skip it.
+_write_lock = None
+
+async def run_write(db, fn, *args, **kwargs):
+    # run_sync for code that writes and commits; fn(sync_session, *args, **kwargs)
+    global _write_lock
+    if ASYNC_DATABASE_URL.get_backend_name() != "sqlite":
+        return await db.run_sync(fn, *args, **kwargs)
+    if _write_lock is None:
+        _write_lock = asyncio.Lock()
+    async with _write_lock:
+        return await db.run_sync(fn, *args, **kwargs)
+
+async def get_db():
+    # Request-scoped session for every router. Code written against the sync
+    # Session API (services/*) runs through `await db.run_sync(fn, ...)`.
+    async with AsyncSessionLocal() as db:
+        yield db
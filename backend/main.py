@@ -1,15 +1,64 @@
-from fastapi import FastAPI
+import time
+IMPORT_STARTED = time.perf_counter()
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from .database import init_db
 from .seed_data import seed_default_data
+from .services.rollups import backfill_rollups
+from .services.tts_service import prewarm, TTS_PREWARM
+from .services.mandi_service import run_refresher, MANDI_REFRESH_SECONDS
+from .services.session_store import run_sweeper as session_store_sweeper
+from .services import mandi_service, clients
+from .services.metrics import registry, http_requests, http_duration
 from .routes import inventory, sales, chat, mandi, vision, live_chat, tts
 
+IMPORTED = time.perf_counter()
 
-app = FastAPI(title="Kirana Shop Talk to Data")
+# Cold-start breakdown for this worker, exported at /metrics
+startup_timings = {"import_ms": round((IMPORTED - IMPORT_STARTED) * 1000, 1)}
 
-# Initialize DB and Seed Data
-init_db()
-seed_default_data()
+
+def init_database():
+    # Every worker runs this; init_db retries schema races and the seed is claimed once per database
+    init_db()
+    seed_default_data()
+    backfill_rollups()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    await asyncio.to_thread(init_database)
+    startup_timings["init_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    print(f"Startup: imports {startup_timings['import_ms']:.0f} ms, database init {startup_timings['init_ms']:.0f} ms")
+
+    # Background work: none of it delays accepting requests
+    tasks = []
+    if clients.CLIENTS_PRELOAD:
+        tasks.append(asyncio.create_task(asyncio.to_thread(clients.preload)))
+    if TTS_PREWARM:
+        # Fill the TTS cache with common replies
+        app.state.tts_prewarm = asyncio.create_task(prewarm())
+        tasks.append(app.state.tts_prewarm)
+    if MANDI_REFRESH_SECONDS > 0:
+        # Keeps the local mandi price mirror fresh; 0 disables the periodic refresh
+        app.state.mandi_refresher = asyncio.create_task(run_refresher())
+        tasks.append(app.state.mandi_refresher)
+    # Expires idle chat sessions
+    tasks.append(asyncio.create_task(session_store_sweeper()))
+    yield
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if mandi_service.client is not None:
+        await mandi_service.client.aclose()
+
+
+app = FastAPI(title="Kirana Shop Talk to Data", lifespan=lifespan)
 
 # CORS
 app.add_middleware(
@@ -18,8 +67,25 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Response headers the web client reads (voice replies, chat sessions, sales paging)
+    expose_headers=["X-Text-Response", "X-Language", "X-Response-Mode", "X-Session-Id", "X-Next-Cursor"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Route template, not the raw path, so /inventory/{product_id} is one series
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        http_duration.observe(time.perf_counter() - started, method=request.method, route=path)
+        http_requests.inc(method=request.method, route=path, status=status)
+
 # Include routers
 app.include_router(inventory.router)
 app.include_router(sales.router)
@@ -32,6 +98,17 @@ app.include_router(tts.router)
 
 
 
+@registry.collector
+def startup_metrics():
+    timings = {**startup_timings, **clients.timings}
+    for phase, ms in timings.items():
+        yield ("kirana_startup_seconds", "gauge", "Cold-start time of this worker by phase",
+               {"phase": phase[:-3]}, round(ms / 1000, 4))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 def read_root():
     return {"message": "Kirana Shop API is running"}
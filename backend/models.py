@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime
 
 class ProductBase(BaseModel):
     name: str
@@ -21,6 +21,33 @@ class Product(ProductBase):
     class Config:
         from_attributes = True
 
+class ProductMatch(BaseModel):
+    query: str
+    product_id: Optional[int] = None
+    product_name: Optional[str] = None
+    score: float = 0.0
+    confident: bool = False
+
+class BillItem(BaseModel):
+    name: str
+    quantity: int = 0
+    price: float = 0
+
+class BillPage(BaseModel):
+    page: int
+    filename: Optional[str] = None
+    items: List[BillItem] = []
+    error: Optional[str] = None
+    cached: bool = False # Items reused from an earlier read of the same image
+
+class BillBatchResponse(BaseModel):
+    pages: List[BillPage]
+    items: List[BillItem] # Line items merged across pages
+    applied: bool = False
+    products: List[Product] = [] # Inventory rows after apply
+    notice: Optional[str] = None # Why apply was skipped
+    elapsed_ms: float
+
 class SaleCreate(BaseModel):
     product_id: int
     quantity: int
@@ -38,15 +65,67 @@ class Sale(BaseModel):
 class SaleResponse(Sale):
     product_name: Optional[str] = None
 
+class CheckoutItem(BaseModel):
+    product_id: int
+    quantity: int
+
+class CheckoutRequest(BaseModel):
+    items: List[CheckoutItem]
+    allow_partial: bool = False # Commit the lines that succeed even if others fail
+
+class CheckoutLine(BaseModel):
+    product_id: int
+    quantity: int
+    status: str # "ok", "insufficient_stock", "not_found" or "invalid_quantity"
+    product_name: Optional[str] = None
+    sale_id: Optional[int] = None
+    total_amount: float = 0
+    remaining_stock: Optional[int] = None
+
+class CheckoutResponse(BaseModel):
+    committed: bool
+    total_amount: float
+    lines: List[CheckoutLine]
+
+class ProductSalesSummary(BaseModel):
+    product_id: int
+    product_name: Optional[str] = None
+    category: Optional[str] = None
+    units: int
+    revenue: float
+
+class CategorySalesSummary(BaseModel):
+    category: Optional[str] = None
+    units: int
+    revenue: float
+
+class DailySalesSummary(BaseModel):
+    day: date
+    units: int
+    revenue: float
+
+class SalesWindowSummary(BaseModel):
+    start: date
+    end: date
+    units: int
+    revenue: float
+    products_sold: int
+    previous_units: int
+    previous_revenue: float
+
 class ChatMessage(BaseModel):
     role: str
     content: str
 
 class ChatRequest(BaseModel):
     message: str
-    history: Optional[List[ChatMessage]] = []
+    history: Optional[List[ChatMessage]] = [] # only needed without a session_id (seeds a new session)
     language: Optional[str] = "en"
+    session_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
     response: str
     sql_query: Optional[str] = None
+    path: Optional[str] = None # "fast" (no LLM), "llm_local_render" (SQL from LLM, reply rendered locally) or "llm"
+    session_id: Optional[str] = None # send back with the next message instead of the history
+    prompt_tokens: Optional[int] = None # estimated tokens sent to Gemini for this message (0 when answered without it)
@@ -1,32 +1,54 @@
 import os
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from .. import database, models
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models
+from ..database import get_db
 from ..services.chat_service import process_chat_message
+from ..services.response_cache import chat_cache
+from ..services.session_store import session_store
+from ..services.llm_gateway import gateway, LlmUnavailable
 from dotenv import load_dotenv
 
 load_dotenv()
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.post("/", response_model=models.ChatResponse)
-async def chat(request: models.ChatRequest, db: Session = Depends(get_db)):
+async def chat(request: models.ChatRequest, db: AsyncSession = Depends(get_db)):
     try:
         # Convert Pydantic models to dicts for the service
-        history = [msg.dict() for msg in request.history]
-        
-        result = await process_chat_message(request.message, db, history, request.language)
+        history = [msg.dict() for msg in request.history or []]
+
+        # The session holds the conversation; history is only used to seed a new one
+        session = await session_store.get_or_create_async(request.session_id, request.language, history)
+        result = await process_chat_message(request.message, db, session.history, request.language, session=session)
         return result
         
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="The assistant took too long to respond. Please try again.")
+    except LlmUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         import traceback
         traceback.print_exc()
         print(f"Error in chat endpoint: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
+
+@router.get("/cache/stats")
+def chat_cache_stats():
+    return chat_cache.stats()
+
+@router.get("/sessions/stats")
+def chat_session_stats():
+    return session_store.stats()
+
+@router.get("/llm/stats")
+def llm_gateway_stats():
+    return gateway.stats()
+
+@router.delete("/sessions/{session_id}")
+def end_chat_session(session_id: str):
+    if not session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"deleted": session_id}
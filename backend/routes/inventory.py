@@ -1,89 +1,130 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select, update, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
 from .. import database, models
+from ..database import get_db, run_write
+from ..services.data_version import bump_data_version, bump_catalog_version
+from ..services.inventory_service import upsert_products
+from ..services.product_index import product_index
 
 router = APIRouter(prefix="/inventory", tags=["inventory"])
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.get("/", response_model=List[models.Product])
-def read_products(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    products = db.query(database.Product).offset(skip).limit(limit).all()
-    return products
+async def read_products(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(database.Product).offset(skip).limit(limit))
+    return result.scalars().all()
+
+# Write paths share the sync services (data version, index, upsert), so their
+# bodies run against the sync Session via run_write (run_sync behind the write gate)
 
 @router.post("/", response_model=models.Product)
-def create_product(product: models.ProductCreate, db: Session = Depends(get_db)):
+async def create_product(product: models.ProductCreate, db: AsyncSession = Depends(get_db)):
+    return await run_write(db, _create_product, product)
+
+def _create_product(db: Session, product: models.ProductCreate):
     db_product = database.Product(**product.dict())
     db.add(db_product)
+    bump_data_version(db)
+    catalog_version = bump_catalog_version(db)
     db.commit()
     db.refresh(db_product)
+    product_index.upsert(db_product.id, db_product.name)
+    product_index.advance(catalog_version)
     return db_product
 
 @router.post("/bulk", response_model=List[models.Product])
-def create_products_bulk(products: List[models.ProductCreate], db: Session = Depends(get_db)):
-    processed_products = []
-    for product in products:
-        # Check if product exists by name (case-insensitive)
-        existing_product = db.query(database.Product).filter(
-            database.Product.name.ilike(product.name)
-        ).first()
+async def create_products_bulk(products: List[models.ProductCreate], db: AsyncSession = Depends(get_db)):
+    # Duplicate names in the payload are merged; one result per distinct product
+    return await run_write(db, _create_products_bulk, products)
 
-        if existing_product:
-            # Update stock
-            existing_product.stock += product.stock
-            # Update price if provided and non-zero (assuming bill might have updated prices)
-            if product.price > 0:
-                existing_product.price = product.price
-            processed_products.append(existing_product)
-        else:
-            # Create new product
-            db_product = database.Product(**product.dict())
-            db.add(db_product)
-            processed_products.append(db_product)
-    
+def _create_products_bulk(db: Session, products: List[models.ProductCreate]):
+    processed_products = upsert_products(db, products)
     db.commit()
-    for p in processed_products:
-        db.refresh(p)
     return processed_products
 
 @router.put("/{product_id}", response_model=models.Product)
-def update_product(product_id: int, product: models.ProductCreate, db: Session = Depends(get_db)):
+async def update_product(product_id: int, product: models.ProductCreate, db: AsyncSession = Depends(get_db)):
+    return await run_write(db, _update_product, product_id, product)
+
+def _update_product(db: Session, product_id: int, product: models.ProductCreate):
     db_product = db.query(database.Product).filter(database.Product.id == product_id).first()
     if not db_product:
         raise HTTPException(status_code=404, detail="Product not found")
     
+    renamed = db_product.name != product.name
     for key, value in product.dict().items():
         setattr(db_product, key, value)
     
+    bump_data_version(db)
+    catalog_version = bump_catalog_version(db) if renamed else None
     db.commit()
     db.refresh(db_product)
+    if renamed:
+        product_index.upsert(db_product.id, db_product.name)
+        product_index.advance(catalog_version)
     return db_product
 
     db.delete(db_product)
     db.commit()
     return {"message": "Product deleted"}
 
+@router.post("/match", response_model=List[models.ProductMatch])
+async def match_products(names: List[str], db: AsyncSession = Depends(get_db)):
+    # Preview how OCR/shelf names resolve before applying them
+    await db.run_sync(product_index.sync)
+    results = []
+    for name in names:
+        match = product_index.best_match(name)
+        results.append(models.ProductMatch(
+            query=name,
+            product_id=match.product_id if match else None,
+            product_name=match.name if match else None,
+            score=match.score if match else 0.0,
+            confident=match.confident if match else False
+        ))
+    return results
+
 @router.post("/shelf/bulk")
-def update_shelf_locations_bulk(items: List[dict], db: Session = Depends(get_db)):
-    updated_count = 0
+async def update_shelf_locations_bulk(items: List[dict], db: AsyncSession = Depends(get_db)):
+    await db.run_sync(product_index.sync)
+    shelves = {}
+    matched = []
+    flagged = []
     for item in items:
         name = item.get("name")
         shelf = item.get("shelf")
         if name and shelf:
-            # Find product by name (case-insensitive)
-            db_product = db.query(database.Product).filter(
-                database.Product.name.ilike(f"%{name}%") # Fuzzy match might be better, but simple contains for now
-            ).first()
-            
-            if db_product:
-                db_product.shelf_position = shelf
-                updated_count += 1
-    
+            match = product_index.best_match(name)
+            result = {
+                "name": name,
+                "shelf": shelf,
+                "product_id": match.product_id if match else None,
+                "product_name": match.name if match else None,
+                "score": match.score if match else 0.0,
+            }
+            # Low-confidence or ambiguous matches are reported, not applied
+            if match and match.confident:
+                shelves[match.product_id] = shelf
+                matched.append(result)
+            else:
+                flagged.append(result)
+
+    if shelves:
+        await run_write(db, _update_shelves, shelves)
+    return {
+        "message": f"Updated shelf locations for {len(shelves)} products",
+        "matched": matched,
+        "flagged": flagged
+    }
+
+def _update_shelves(db: Session, shelves: dict):
+    db.execute(
+        update(database.Product.__table__)
+        .where(database.Product.__table__.c.id == bindparam("b_id"))
+        .values(shelf_position=bindparam("b_shelf")),
+        [{"b_id": product_id, "b_shelf": shelf} for product_id, shelf in shelves.items()]
+    )
+    bump_data_version(db)
     db.commit()
-    return {"message": f"Updated shelf locations for {updated_count} products"}
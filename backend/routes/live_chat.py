@@ -1,31 +1,70 @@
 import os
-import io
+import time
+import asyncio
+import json
 import base64
-import google.generativeai as genai
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Form
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-import edge_tts
-from gtts import gTTS
+from collections import deque
+from typing import Optional
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Form, WebSocket, WebSocketDisconnect
+from sqlalchemy.ext.asyncio import AsyncSession
 from .. import database, models
+from ..database import get_db
 from ..services.chat_service import process_chat_message
-from dotenv import load_dotenv
+from ..services.concurrency import run_blocking
+from ..services.audio_preprocess import preprocess_audio, AudioTooLarge, AUDIO_MAX_BYTES
+from ..services.metrics import span, count, observe_stage
+from ..services.llm_gateway import gateway, LlmUnavailable
+from ..services.tts_service import synthesize_stream, synthesize_pipelined
+from ..services.session_store import session_store
+from ..services import clients
+router = APIRouter(prefix="/live", tags=["live"])
 
-from pathlib import Path
-env_path = Path(__file__).parent.parent / '.env'
-load_dotenv(dotenv_path=env_path)
+# Stream the final answer sentence by sentence into TTS (can also be set per request)
+LIVE_PIPELINE = os.getenv("LIVE_PIPELINE", "0") == "1"
 
-router = APIRouter(prefix="/live", tags=["live"])
+# WebSocket sessions: cap on buffered audio per turn (history lives in the chat session store)
+MAX_TURN_AUDIO_BYTES = int(os.getenv("LIVE_MAX_TURN_AUDIO_BYTES", str(10 * 1024 * 1024)))
 
-api_key = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=api_key)
+clients.define_model("transcription")
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Bytes / seconds of audio before and after pre-processing, across all turns
+_audio_totals = {"clips": 0, "processed": 0, "bytes_in": 0, "bytes_out": 0, "seconds_in": 0.0, "seconds_out": 0.0}
+
+async def transcribe(audio_content: bytes, mime_type: str, language: str) -> str:
+    with span("live.preprocess"):
+        clip = await run_blocking("audio", preprocess_audio, audio_content, mime_type)
+    _audio_totals["clips"] += 1
+    _audio_totals["bytes_in"] += clip.original_bytes
+    _audio_totals["bytes_out"] += clip.processed_bytes
+    if clip.processed:
+        _audio_totals["processed"] += 1
+        _audio_totals["seconds_in"] += clip.original_seconds
+        _audio_totals["seconds_out"] += clip.processed_seconds
+        print(f"Audio pre-processing: saved {clip.bytes_saved} bytes, {clip.seconds_saved}s "
+              f"({clip.original_bytes} -> {clip.processed_bytes} bytes)")
+        if not clip.processed_seconds:
+            raise ValueError("No speech detected in the recording")
+
+    with span("live.transcribe"):
+        transcription_response = await gateway.generate("transcription", [
+            {"mime_type": clip.mime_type, "data": clip.data},
+            f"Listen to this audio and transcribe it exactly into text. The language is likely {language}. Do not add any other words."
+        ], "transcribe", "voice")
+    return transcription_response.text.strip()
+
+# Time from request start to the first audio byte, per mode (most recent turns)
+_first_audio_ms = {"sequential": deque(maxlen=500), "pipelined": deque(maxlen=500)}
+
+async def _timed(audio, mode: str, started: float):
+    first = True
+    async for chunk in audio:
+        if first:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            _first_audio_ms[mode].append(elapsed_ms)
+            observe_stage(f"live.first_audio_byte.{mode}", elapsed_ms / 1000)
+            print(f"Live turn ({mode}): first audio byte after {elapsed_ms:.0f} ms")
+            first = False
+        yield chunk
 
 def detect_language(text):
     for char in text:
@@ -41,73 +80,221 @@ from urllib.parse import quote
 # ... (imports)
 
 @router.post("/chat")
-async def live_chat(file: UploadFile = File(...), language: str = Form("en"), db: Session = Depends(get_db)):
+async def live_chat(
+    file: UploadFile = File(...),
+    language: str = Form("en"),
+    pipeline: Optional[bool] = Form(None),
+    session_id: Optional[str] = Form(None),
+    db: AsyncSession = Depends(get_db)
+):
+    started = time.perf_counter()
+    pipeline = LIVE_PIPELINE if pipeline is None else pipeline
+    # Same sessions as /chat, so a spoken follow-up sees the typed conversation
+    session = await session_store.get_or_create_async(session_id, language)
     try:
         # Read audio file
-        audio_content = await file.read()
+        # One byte over the limit is enough for pre-processing to reject it
+        audio_content = await file.read(AUDIO_MAX_BYTES + 1)
         
         # 1. Transcribe Audio
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        transcription_response = model.generate_content([
-            {"mime_type": file.content_type or "audio/webm", "data": audio_content},
-            f"Listen to this audio and transcribe it exactly into text. The language is likely {language}. Do not add any other words."
-        ])
-        user_message = transcription_response.text.strip()
+        user_message = await transcribe(audio_content, file.content_type, language)
         print(f"User said: {user_message}")
 
         # 2. Process with Chat Service (SQL Generation)
-        result = await process_chat_message(user_message, db, history=[], language=language)
-        text_response = result["response"]
+        result = await process_chat_message(user_message, db, language=language, stream=pipeline, session=session, priority="voice")
         
-        # 3. Convert Response to Audio (using edge-tts with gTTS fallback)
-        voice_map = {
-            'hi': 'hi-IN-SwaraNeural',
-            'te': 'te-IN-ShrutiNeural',
-            'ta': 'ta-IN-PallaviNeural',
-            'kn': 'kn-IN-GaganNeural',
-            'ml': 'ml-IN-SobhanaNeural',
-            'mr': 'mr-IN-AarohiNeural',
-            'gu': 'gu-IN-DhwaniNeural',
-            'bn': 'bn-IN-TanishaaNeural',
-            'pa': 'pa-IN-OjasNeural',
-            'en': 'en-IN-NeerjaNeural'
-        }
-        
-        voice = voice_map.get(language, 'en-IN-NeerjaNeural')
-        print(f"Generating TTS for: '{text_response}' with voice: {voice}")
-
-        async def audio_stream():
-            try:
-                communicate = edge_tts.Communicate(text_response, voice)
-                async for chunk in communicate.stream():
-                    if chunk["type"] == "audio":
-                        yield chunk["data"]
-            except Exception as e:
-                print(f"EdgeTTS failed: {e}. Falling back to gTTS.")
-                # Fallback to gTTS
-                mp3_fp = io.BytesIO()
-                tts = gTTS(text=text_response, lang=language)
-                tts.write_to_fp(mp3_fp)
-                mp3_fp.seek(0)
-                yield mp3_fp.read()
-
-        # Encode text response for header (handle non-ASCII)
-        encoded_text = quote(text_response)
+        # 3. Convert Response to Audio (cached edge-tts with gTTS fallback)
+        headers = {"X-Language": language, "X-Session-Id": session.id}
+        if result.get("response_stream") is not None:
+            # Pipelined: the answer text is still being generated, so it cannot go
+            # in a header; audio starts with the first complete sentence
+            audio = _timed(synthesize_pipelined(result["response_stream"], language), "pipelined", started)
+            headers["X-Response-Mode"] = "pipelined"
+        else:
+            text_response = result["response"]
+            audio = _timed(synthesize_stream(text_response, language), "pipelined" if pipeline else "sequential", started)
+            # Encode text response for header (handle non-ASCII)
+            headers["X-Text-Response"] = quote(text_response)
         
         return StreamingResponse(
-            audio_stream(), 
+            audio, 
             media_type="audio/mpeg",
-            headers={
-                "X-Text-Response": encoded_text,
-                "X-Language": language
-            }
+            headers=headers
         )
         
+    except AudioTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except LlmUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after), "X-Session-Id": session.id})
     except Exception as e:
         print(f"Error in live chat: {str(e)}")
         # In case of error before streaming starts, return JSON error
         # Note: If streaming started, we can't change status code easily.
         return {
             "text_response": "I'm having trouble hearing you. Please try again.",
-            "error": str(e)
+            "error": str(e),
+            "session_id": session.id
         }
+
+
+# WebSocket protocol (one connection = one conversation):
+#   client -> {"type": "start", "language": "hi", "mime_type": "audio/webm", "pipeline": true,
+#              "session_id": ...}          optional: continue a /chat or earlier live session
+#   client -> binary audio frames while the user speaks
+#   client -> {"type": "end"}                 transcribe and answer the buffered audio
+#   client -> {"type": "text", "content": ..} answer a typed message instead
+#   server -> {"type": "transcript"}, {"type": "text"} pieces, binary MP3 frames, then
+#             {"type": "done", "response", "sql_query", "path", "session_id", "prompt_tokens"} or {"type": "error", "detail"}
+class LiveSession:
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.db = database.AsyncSessionLocal()
+        self.chat = None  # session_store.ChatSession, from the first start message or turn
+        self.language = "en"
+        self.mime_type = "audio/webm"
+        self.pipeline = LIVE_PIPELINE
+        self.audio = bytearray()
+        # Text pieces and audio frames are sent from concurrent tasks in pipelined turns
+        self._send_lock = asyncio.Lock()
+
+    async def send_json(self, payload: dict):
+        async with self._send_lock:
+            await self.websocket.send_text(json.dumps(payload, ensure_ascii=False, default=str))
+
+    async def send_bytes(self, data: bytes):
+        async with self._send_lock:
+            await self.websocket.send_bytes(data)
+
+    async def start(self, message: dict):
+        self.language = message.get("language", self.language)
+        self.mime_type = message.get("mime_type", self.mime_type)
+        if message.get("pipeline") is not None:
+            self.pipeline = bool(message["pipeline"])
+        if self.chat is None or message.get("session_id") not in (None, self.chat.id):
+            self.chat = await session_store.get_or_create_async(message.get("session_id"), self.language)
+        self.audio = bytearray()
+
+    def add_audio(self, data: bytes):
+        if len(self.audio) + len(data) > MAX_TURN_AUDIO_BYTES:
+            self.audio = bytearray()
+            raise ValueError(f"Audio for one turn exceeds {MAX_TURN_AUDIO_BYTES} bytes")
+        self.audio.extend(data)
+
+    async def _relay_text(self, pieces, collected: list):
+        async for piece in pieces:
+            collected.append(piece)
+            await self.send_json({"type": "text", "content": piece})
+            yield piece
+
+    async def turn(self, user_message: str, started: float):
+        if self.chat is None:
+            self.chat = await session_store.create_async(self.language)
+        try:
+            result = await process_chat_message(
+                user_message, self.db, language=self.language, stream=self.pipeline, session=self.chat, priority="voice"
+            )
+        finally:
+            # Hand the connection back to the pool while the user is talking
+            await self.db.close()
+        mode = "pipelined" if self.pipeline else "sequential"
+        if result.get("response_stream") is not None:
+            collected = []
+            audio = synthesize_pipelined(self._relay_text(result["response_stream"], collected), self.language)
+        else:
+            collected = [result["response"]]
+            await self.send_json({"type": "text", "content": result["response"]})
+            audio = synthesize_stream(result["response"], self.language)
+
+        async for chunk in _timed(audio, mode, started):
+            await self.send_bytes(chunk)
+
+        response = "".join(collected).strip()
+        await self.send_json({
+            "type": "done", "response": response,
+            "sql_query": result.get("sql_query"), "path": result.get("path"),
+            "session_id": self.chat.id, "prompt_tokens": result.get("prompt_tokens")
+        })
+
+    async def close(self):
+        await self.db.close()
+
+@router.websocket("/ws")
+async def live_session(websocket: WebSocket):
+    await websocket.accept()
+    session = LiveSession(websocket)
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                try:
+                    session.add_audio(message["bytes"])
+                except ValueError as e:
+                    await session.send_json({"type": "error", "detail": str(e)})
+                continue
+
+            try:
+                control = json.loads(message.get("text") or "{}")
+            except json.JSONDecodeError:
+                await session.send_json({"type": "error", "detail": "Invalid control message"})
+                continue
+
+            kind = control.get("type")
+            try:
+                if kind == "start":
+                    await session.start(control)
+                elif kind == "end":
+                    started = time.perf_counter()
+                    if not session.audio:
+                        await session.send_json({"type": "error", "detail": "No audio received"})
+                        continue
+                    audio, session.audio = bytes(session.audio), bytearray()
+                    user_message = await transcribe(audio, session.mime_type, session.language)
+                    print(f"User said: {user_message}")
+                    await session.send_json({"type": "transcript", "content": user_message})
+                    await session.turn(user_message, started)
+                elif kind == "text":
+                    await session.turn(control.get("content", ""), time.perf_counter())
+                else:
+                    await session.send_json({"type": "error", "detail": f"Unknown message type: {kind}"})
+            except AudioTooLarge as e:
+                await session.send_json({"type": "error", "detail": str(e)})
+            except asyncio.TimeoutError:
+                await session.send_json({"type": "error", "detail": "Upstream service timed out"})
+            except LlmUnavailable as e:
+                await session.send_json({"type": "error", "detail": str(e), "retry_after": e.retry_after})
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                print(f"Error in live session: {str(e)}")
+                await session.send_json({"type": "error", "detail": "I'm having trouble hearing you. Please try again."})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await session.close()
+
+
+def _summary(samples) -> dict:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"turns": 0}
+    return {
+        "turns": len(ordered),
+        "avg_ms": round(sum(ordered) / len(ordered), 1),
+        "p50_ms": round(ordered[len(ordered) // 2], 1),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+    }
+
+@router.get("/stats")
+def live_stats():
+    return {
+        "pipeline_default": LIVE_PIPELINE,
+        "time_to_first_audio": {mode: _summary(samples) for mode, samples in _first_audio_ms.items()},
+        "audio_preprocessing": {
+            **_audio_totals,
+            "seconds_in": round(_audio_totals["seconds_in"], 2),
+            "seconds_out": round(_audio_totals["seconds_out"], 2),
+            "bytes_saved": _audio_totals["bytes_in"] - _audio_totals["bytes_out"],
+        },
+    }
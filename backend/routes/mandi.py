@@ -1,29 +1,57 @@
-import os
-import requests
-from fastapi import APIRouter, HTTPException
+import asyncio
+from datetime import date
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
+from ..database import get_db
+from ..services.concurrency import HTTP_TIMEOUT
+from ..services.mandi_service import (
+    refresh_mandi_prices, refresh_state, mirror_size, query_prices, compare_with_products
+)
 
 load_dotenv()
 
 router = APIRouter(prefix="/mandi", tags=["mandi"])
 
-MANDI_API_KEY = "579b464db66ec23bdd000001b54c44682b914aa571845c4bb6d93ff3"
-BASE_URL = "https://api.data.gov.in/resource/9ef84268-d588-465a-a308-a864a43d0070"
-
 @router.get("/prices")
-async def get_mandi_prices(limit: int = 10):
+async def get_mandi_prices(
+    limit: int = Query(10, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    commodity: Optional[str] = None,
+    state: Optional[str] = None,
+    district: Optional[str] = None,
+    market: Optional[str] = None,
+    since: Optional[date] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    # Served from the local mirror; only a cold (empty) mirror waits for the upstream API
+    if not await db.run_sync(mirror_size):
+        try:
+            await asyncio.wait_for(refresh_mandi_prices(), HTTP_TIMEOUT * 3)
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"Mandi prices not available yet: {str(e)}")
+
+    total, records = await db.run_sync(query_prices, commodity, state, district, market, since, limit, offset)
+    return {
+        "prices": records,
+        "total": total,
+        "last_refreshed": refresh_state["last_success"],
+    }
+
+@router.get("/compare")
+async def compare_mandi_prices(state: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    # Our selling price vs the latest mandi modal price for products matched by name
+    return await db.run_sync(compare_with_products, state)
+
+@router.get("/status")
+async def mandi_status(db: AsyncSession = Depends(get_db)):
+    return {**refresh_state, "records": await db.run_sync(mirror_size)}
+
+@router.post("/refresh")
+async def refresh_mandi_mirror():
     try:
-        params = {
-            "api-key": MANDI_API_KEY,
-            "format": "json",
-            "limit": limit
-        }
-        response = requests.get(BASE_URL, params=params)
-        response.raise_for_status()
-        data = response.json()
-        
-        # Extract relevant records
-        records = data.get("records", [])
-        return {"prices": records}
+        count = await refresh_mandi_prices()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch Mandi prices: {str(e)}")
+        raise HTTPException(status_code=502, detail=f"Failed to fetch Mandi prices: {str(e)}")
+    return {"records": count, "last_refreshed": refresh_state["last_success"]}
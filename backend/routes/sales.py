@@ -1,24 +1,48 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import date, datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from .. import database, models
+from ..database import get_db, run_write
+from ..services.data_version import bump_data_version
+from ..services.rollups import apply_sales
 
 router = APIRouter(prefix="/sales", tags=["sales"])
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 1000
+
+def _decrement_stock(db: Session, product_id: int, quantity: int):
+    # Conditional decrement: only succeeds if enough stock is left at write time,
+    # so concurrent sales of the last units cannot oversell. Returns the new stock or None.
+    return db.execute(
+        update(database.Product)
+        .where(database.Product.id == product_id, database.Product.stock >= quantity)
+        .values(stock=database.Product.stock - quantity)
+        .returning(database.Product.stock)
+    ).scalar()
+
+# Writes reuse the sync rollup/data-version helpers, so they run via run_write
 
 @router.post("/", response_model=models.SaleResponse)
-def create_sale(sale: models.SaleCreate, db: Session = Depends(get_db)):
+async def create_sale(sale: models.SaleCreate, db: AsyncSession = Depends(get_db)):
+    return await run_write(db, _create_sale, sale)
+
+def _create_sale(db: Session, sale: models.SaleCreate):
     # Check stock
     product = db.query(database.Product).filter(database.Product.id == sale.product_id).first()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    if product.stock < sale.quantity:
+    if sale.quantity <= 0:
+        raise HTTPException(status_code=400, detail="Quantity must be positive")
+    
+    # Update stock
+    if _decrement_stock(db, sale.product_id, sale.quantity) is None:
+        db.rollback()
         raise HTTPException(status_code=400, detail="Insufficient stock")
     
     # Calculate total
@@ -31,10 +55,10 @@ def create_sale(sale: models.SaleCreate, db: Session = Depends(get_db)):
         total_amount=total_amount
     )
     
-    # Update stock
-    product.stock -= sale.quantity
-    
     db.add(db_sale)
+    db.flush()
+    apply_sales(db, [db_sale])
+    bump_data_version(db)
     db.commit()
     db.refresh(db_sale)
     
@@ -43,20 +67,210 @@ def create_sale(sale: models.SaleCreate, db: Session = Depends(get_db)):
     response.product_name = product.name
     return response
 
+@router.post("/checkout", response_model=models.CheckoutResponse)
+async def checkout(request: models.CheckoutRequest, db: AsyncSession = Depends(get_db)):
+    return await run_write(db, _checkout, request)
+
+def _checkout(db: Session, request: models.CheckoutRequest):
+    # Whole bill in one request and one transaction
+    if not request.items:
+        raise HTTPException(status_code=400, detail="Cart is empty")
+
+    product_ids = {item.product_id for item in request.items}
+    products = {
+        p.id: p for p in db.query(database.Product).filter(database.Product.id.in_(product_ids)).all()
+    }
+
+    lines = []
+    sales = []
+    for item in request.items:
+        product = products.get(item.product_id)
+        line = models.CheckoutLine(product_id=item.product_id, quantity=item.quantity, status="ok")
+        if not product:
+            line.status = "not_found"
+        elif item.quantity <= 0:
+            line.product_name = product.name
+            line.status = "invalid_quantity"
+        else:
+            line.product_name = product.name
+            remaining = _decrement_stock(db, product.id, item.quantity)
+            if remaining is None:
+                line.status = "insufficient_stock"
+            else:
+                line.remaining_stock = remaining
+                line.total_amount = product.price * item.quantity
+                sales.append((line, database.Sale(
+                    product_id=product.id,
+                    quantity=item.quantity,
+                    total_amount=line.total_amount
+                )))
+        lines.append(line)
+
+    failed = any(line.status != "ok" for line in lines)
+    if not sales or (failed and not request.allow_partial):
+        db.rollback()
+        # Nothing was written, so the stock figures from the rolled back updates are void
+        for line, _ in sales:
+            line.remaining_stock = None
+        response = models.CheckoutResponse(committed=False, total_amount=0, lines=lines)
+        return JSONResponse(status_code=409, content=response.model_dump(mode="json"))
+
+    db.add_all([sale for _, sale in sales])
+    db.flush()
+    for line, sale in sales:
+        line.sale_id = sale.id
+    apply_sales(db, [sale for _, sale in sales])
+    bump_data_version(db)
+    db.commit()
+
+    return models.CheckoutResponse(
+        committed=True,
+        total_amount=sum(line.total_amount for line, _ in sales),
+        lines=lines
+    )
+
+def _sales_query(before_id: Optional[int], start: Optional[datetime], end: Optional[datetime], product_id: Optional[int]):
+    # One joined query for sale rows and product names (no per-sale lazy loads)
+    query = select(
+        database.Sale.id,
+        database.Sale.product_id,
+        database.Sale.quantity,
+        database.Sale.total_amount,
+        database.Sale.timestamp,
+        database.Product.name
+    ).outerjoin(database.Product, database.Sale.product_id == database.Product.id)
+
+    if before_id is not None:
+        query = query.where(database.Sale.id < before_id)
+    if start is not None:
+        query = query.where(database.Sale.timestamp >= start)
+    if end is not None:
+        query = query.where(database.Sale.timestamp < end)
+    if product_id is not None:
+        query = query.where(database.Sale.product_id == product_id)
+    return query.order_by(database.Sale.id.desc())
+
+def _to_sale_response(row) -> models.SaleResponse:
+    return models.SaleResponse(
+        id=row.id,
+        product_id=row.product_id,
+        quantity=row.quantity,
+        total_amount=row.total_amount,
+        timestamp=row.timestamp,
+        product_name=row.name if row.name else "Unknown"
+    )
+
 @router.get("/", response_model=List[models.SaleResponse])
-def read_sales(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    sales = db.query(database.Sale).order_by(database.Sale.id.desc()).offset(skip).limit(limit).all()
-    # Enrich with product names
-    results = []
-    for sale in sales:
-        # Manually construct to avoid validation issues with SQLAlchemy objects
-        s = models.SaleResponse(
-            id=sale.id,
-            product_id=sale.product_id,
-            quantity=sale.quantity,
-            total_amount=sale.total_amount,
-            timestamp=sale.timestamp,
-            product_name=sale.product.name if sale.product else "Unknown"
+async def read_sales(
+    response: Response,
+    skip: int = 0,
+    limit: Optional[int] = None,
+    before_id: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    product_id: Optional[int] = None,
+    format: str = "json",
+    db: AsyncSession = Depends(get_db)
+):
+    # Keyset pagination: pass the X-Next-Cursor header back as before_id.
+    # skip/OFFSET is kept for older clients but gets slower as the table grows.
+    if format == "ndjson":
+        return StreamingResponse(
+            _stream_sales_ndjson(before_id, start, end, product_id, limit),
+            media_type="application/x-ndjson"
         )
-        results.append(s)
-    return results
+
+    limit = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    query = _sales_query(before_id, start, end, product_id)
+    if before_id is None and skip:
+        query = query.offset(skip)
+    rows = (await db.execute(query.limit(limit))).all()
+
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = str(rows[-1].id)
+    return [_to_sale_response(row) for row in rows]
+
+async def _stream_sales_ndjson(before_id, start, end, product_id, limit):
+    # Own session: the request-scoped one may be closed before streaming finishes
+    async with database.AsyncSessionLocal() as db:
+        query = _sales_query(before_id, start, end, product_id)
+        if limit:
+            query = query.limit(limit)
+        result = await db.stream(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+        async for row in result:
+            yield _to_sale_response(row).model_dump_json() + "\n"
+
+# --- Analytics over the sales_daily rollup (one row per product per day) ---
+
+def _window(days: int, end: Optional[date]):
+    # Trailing window of `days` days ending on `end` (inclusive, UTC days)
+    if days < 1:
+        raise HTTPException(status_code=400, detail="days must be at least 1")
+    end = end or datetime.utcnow().date()
+    return end - timedelta(days=days - 1), end
+
+async def _rollup_totals(db: AsyncSession, start: date, end: date):
+    return (await db.execute(select(
+        func.coalesce(func.sum(database.SalesDaily.units), 0),
+        func.coalesce(func.sum(database.SalesDaily.revenue), 0.0),
+        func.count(func.distinct(database.SalesDaily.product_id))
+    ).where(database.SalesDaily.day >= start, database.SalesDaily.day <= end))).one()
+
+@router.get("/analytics/top", response_model=List[models.ProductSalesSummary])
+async def top_products(days: int = 7, end: Optional[date] = None, limit: int = 10, by: str = "units", db: AsyncSession = Depends(get_db)):
+    start, end = _window(days, end)
+    units = func.sum(database.SalesDaily.units)
+    revenue = func.sum(database.SalesDaily.revenue)
+    rows = (await db.execute(select(
+        database.SalesDaily.product_id, database.Product.name, database.Product.category, units, revenue
+    ).outerjoin(
+        database.Product, database.Product.id == database.SalesDaily.product_id
+    ).where(
+        database.SalesDaily.day >= start, database.SalesDaily.day <= end
+    ).group_by(
+        database.SalesDaily.product_id, database.Product.name, database.Product.category
+    ).order_by((revenue if by == "revenue" else units).desc()).limit(limit))).all()
+    return [
+        models.ProductSalesSummary(product_id=r[0], product_name=r[1], category=r[2], units=r[3], revenue=r[4])
+        for r in rows
+    ]
+
+@router.get("/analytics/categories", response_model=List[models.CategorySalesSummary])
+async def sales_by_category(days: int = 30, end: Optional[date] = None, db: AsyncSession = Depends(get_db)):
+    start, end = _window(days, end)
+    revenue = func.sum(database.SalesDaily.revenue)
+    rows = (await db.execute(select(
+        database.Product.category, func.sum(database.SalesDaily.units), revenue
+    ).join(
+        database.Product, database.Product.id == database.SalesDaily.product_id
+    ).where(
+        database.SalesDaily.day >= start, database.SalesDaily.day <= end
+    ).group_by(database.Product.category).order_by(revenue.desc()))).all()
+    return [models.CategorySalesSummary(category=r[0], units=r[1], revenue=r[2]) for r in rows]
+
+@router.get("/analytics/daily", response_model=List[models.DailySalesSummary])
+async def sales_per_day(days: int = 30, end: Optional[date] = None, product_id: Optional[int] = None, db: AsyncSession = Depends(get_db)):
+    start, end = _window(days, end)
+    query = select(
+        database.SalesDaily.day, func.sum(database.SalesDaily.units), func.sum(database.SalesDaily.revenue)
+    ).where(database.SalesDaily.day >= start, database.SalesDaily.day <= end)
+    if product_id is not None:
+        query = query.where(database.SalesDaily.product_id == product_id)
+    rows = (await db.execute(query.group_by(database.SalesDaily.day).order_by(database.SalesDaily.day))).all()
+    return [models.DailySalesSummary(day=r[0], units=r[1], revenue=r[2]) for r in rows]
+
+@router.get("/analytics/window", response_model=models.SalesWindowSummary)
+async def sales_window(days: int = 7, end: Optional[date] = None, db: AsyncSession = Depends(get_db)):
+    # Trailing-window totals plus the window before it for comparison
+    start, end = _window(days, end)
+    units, revenue, products_sold = await _rollup_totals(db, start, end)
+    previous_units, previous_revenue, _ = await _rollup_totals(db, start - timedelta(days=days), start - timedelta(days=1))
+    return models.SalesWindowSummary(
+        start=start,
+        end=end,
+        units=units,
+        revenue=revenue,
+        products_sold=products_sold,
+        previous_units=previous_units,
+        previous_revenue=previous_revenue
+    )
@@ -1,29 +1,28 @@
 import os
-import google.generativeai as genai
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from PIL import Image
-import io
-from dotenv import load_dotenv
-
-load_dotenv()
+import time
+import asyncio
+from typing import List
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Form
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models
+from ..database import get_db, run_write
+from ..services.concurrency import run_blocking
+from ..services.image_preprocess import prepare_image, vision_cache, VISION_CACHE_ENABLED
+from ..services.bill_service import parse_bill_items, merge_bill_items, to_product_creates
+from ..services.inventory_service import upsert_products
+from ..services.metrics import span
+from ..services.llm_gateway import gateway, LlmUnavailable
+from ..services import clients
 
 router = APIRouter(prefix="/vision", tags=["vision"])
 
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    print("Warning: GEMINI_API_KEY not found in environment variables")
-else:
-    genai.configure(api_key=api_key)
+clients.define_model("vision")
 
-model = genai.GenerativeModel('gemini-2.5-flash')
+# Pages of one batch processed at once (the global LLM cap still applies on top)
+OCR_BATCH_CONCURRENCY = int(os.getenv("OCR_BATCH_CONCURRENCY", "4"))
+OCR_BATCH_MAX_FILES = int(os.getenv("OCR_BATCH_MAX_FILES", "20"))
 
-@router.post("/ocr")
-async def process_bill(file: UploadFile = File(...)):
-    try:
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        
-        prompt = """
+OCR_PROMPT = """
         Analyze this bill of lading image. Extract the list of items, their quantities, and prices.
         Return the data in a pure JSON format like this:
         [
@@ -32,17 +31,120 @@ async def process_bill(file: UploadFile = File(...)):
         ]
         Do not include any markdown formatting or explanation. Just the JSON array.
         """
+
+async def _analyze(kind: str, contents: bytes, prompt: str, grayscale: bool, priority: str):
+    # Downscaled/recompressed image to the model; a repeat of a cached image reuses
+    # the earlier result. Returns (text, prepared image, served from cache).
+    with span(f"vision.{kind}.prepare"):
+        prepared = await run_blocking("image", prepare_image, contents, grayscale)
+    vision_cache.record_payload(prepared)
+    print(f"Vision {kind}: {prepared.original_bytes} -> {prepared.processed_bytes} bytes {prepared.size}")
+
+    if VISION_CACHE_ENABLED:
+        cached = vision_cache.get(kind, prepared)
+        if cached is not None:
+            return cached, prepared, True
+
+    with span(f"vision.{kind}.llm"):
+        response = await gateway.generate("vision", [
+            prompt, {"mime_type": prepared.mime_type, "data": prepared.data}
+        ], f"vision_{kind}", priority)
+    result = response.text.strip()
+    if VISION_CACHE_ENABLED:
+        vision_cache.set(kind, prepared, result)
+    return result, prepared, False
+
+async def analyze_image(kind: str, contents: bytes, prompt: str, grayscale: bool = False, priority: str = "vision") -> str:
+    return (await _analyze(kind, contents, prompt, grayscale, priority))[0]
+
+@router.post("/ocr")
+async def process_bill(file: UploadFile = File(...)):
+    try:
+        contents = await file.read()
         
-        response = model.generate_content([prompt, image])
-        return {"data": response.text.strip()}
+        # Bills are text: grayscale keeps the payload small without hurting OCR
+        return {"data": await analyze_image("ocr", contents, OCR_PROMPT, grayscale=True)}
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="OCR timed out. Please try again.")
+    except LlmUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OCR failed: {str(e)}")
 
+def _apply_items(db, products):
+    processed = upsert_products(db, products)
+    db.commit()
+    return processed
+
+@router.post("/ocr/batch", response_model=models.BillBatchResponse)
+async def process_bill_batch(
+    files: List[UploadFile] = File(...),
+    apply: bool = Form(False),
+    category: str = Form("Uncategorized"),
+    allow_cached: bool = Form(False),
+    db: AsyncSession = Depends(get_db)
+):
+    # All pages of one bill, OCR'd concurrently; with apply=true the merged items
+    # are added to inventory in a single transaction (only if every page parsed).
+    # A page whose exact image was read before is marked cached and blocks apply
+    # unless allow_cached=true: it is usually a bill that was already added.
+    if len(files) > OCR_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {OCR_BATCH_MAX_FILES} images per batch")
+
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(OCR_BATCH_CONCURRENCY)
+
+    async def process_page(page: int, file: UploadFile) -> models.BillPage:
+        async with semaphore:
+            try:
+                contents = await file.read()
+                # Queued behind interactive calls (voice, chat, single images)
+                text, prepared, cached = await _analyze("ocr", contents, OCR_PROMPT, True, "batch")
+                digests[page] = prepared.digest
+                return models.BillPage(page=page, filename=file.filename, items=parse_bill_items(text), cached=cached)
+            except asyncio.TimeoutError:
+                return models.BillPage(page=page, filename=file.filename, error="OCR timed out")
+            except Exception as e:
+                return models.BillPage(page=page, filename=file.filename, error=str(e))
+
+    digests = {}
+    pages = await asyncio.gather(*(process_page(i + 1, f) for i, f in enumerate(files)))
+    # The same photo uploaded twice would count its items twice
+    first_page = {}
+    for page in pages:
+        digest = digests.get(page.page)
+        if digest in first_page:
+            page.items, page.error = [], f"Same image as page {first_page[digest]}"
+        elif digest is not None:
+            first_page[digest] = page.page
+    items = merge_bill_items([p.items for p in pages])
+
+    applied = False
+    products = []
+    notice = None
+    if apply and any(p.cached for p in pages) and not allow_cached:
+        notice = "Some pages match bills read before (see pages[].cached); not applied. Send allow_cached=true to apply anyway."
+    elif apply and items and not any(p.error for p in pages):
+        try:
+            products = await run_write(db, _apply_items, to_product_creates(items, category))
+            applied = True
+        except Exception as e:
+            await db.rollback()
+            raise HTTPException(status_code=500, detail=f"Inventory update failed: {str(e)}")
+
+    return models.BillBatchResponse(
+        pages=pages,
+        items=items,
+        applied=applied,
+        products=products,
+        notice=notice,
+        elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+    )
+
 @router.post("/shelf")
 async def analyze_shelf(file: UploadFile = File(...)):
     try:
         contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
         
         prompt = """
         You are an Expert Retail Inventory Manager. 
@@ -59,7 +161,16 @@ async def analyze_shelf(file: UploadFile = File(...)):
         Return the data in a STRICT JSON array format. Do not include any markdown formatting (like ```json ... ```), explanations, or extra text.
         """
         
-        response = model.generate_content([prompt, image])
-        return {"data": response.text.strip()}
+        # Shelf photos keep colour: packaging colours help identify products
+        return {"data": await analyze_image("shelf", contents, prompt)}
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Shelf analysis timed out. Please try again.")
+    except LlmUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Shelf analysis failed: {str(e)}")
+
+
+@router.get("/stats")
+def vision_stats():
+    return vision_cache.stats()
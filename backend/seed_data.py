@@ -3,8 +3,11 @@ from . import models, database
 def seed_default_data():
     db = database.SessionLocal()
     try:
-        # Check if products exist
-        if db.query(database.Product).count() == 0:
+        # The flag row serialises concurrent workers and runs the seed once per
+        # database; the count check leaves databases that predate the flag alone
+        if not database.claim_flag(db, "default_seed"):
+            print("Default data already seeded. Skipping seed.")
+        elif db.query(database.Product).count() == 0:
             print("Seeding default data...")
             default_products = [
                 {"name": "Sona Masoori Rice", "category": "Grains", "price": 55.0, "stock": 100, "max_stock": 200, "shelf_position": "A1", "icon_name": "wheat"},
@@ -34,6 +37,7 @@ def seed_default_data():
             db.commit()
             print("Default data seeded successfully.")
         else:
+            db.commit()
             print("Database already has data. Skipping seed.")
             
     except Exception as e:
@@ -0,0 +1,206 @@
+import os
+import io
+import shutil
+import subprocess
+import wave
+from dataclasses import dataclass
+import numpy as np
+
+# Shrinks voice clips before they are uploaded to Gemini for transcription:
+# decode, downmix to mono, resample to 16 kHz, trim leading/trailing silence
+# with a frame-energy VAD and re-encode. WAV is handled natively; compressed
+# recordings (webm/ogg/mp4 from the app) need ffmpeg on PATH and are passed
+# through untouched (size limit only) when it is missing.
+AUDIO_PREPROCESS = os.getenv("AUDIO_PREPROCESS", "1") == "1"
+AUDIO_MAX_BYTES = int(os.getenv("AUDIO_MAX_BYTES", str(10 * 1024 * 1024)))
+AUDIO_MAX_SECONDS = float(os.getenv("AUDIO_MAX_SECONDS", "60"))
+
+TARGET_RATE = 16000
+FRAME_MS = 20
+# Frames quieter than this (dBFS) count as silence; keep a little padding so
+# word onsets and tails are not clipped
+SILENCE_DBFS = float(os.getenv("AUDIO_SILENCE_DBFS", "-45"))
+PADDING_MS = 200
+
+FFMPEG = shutil.which("ffmpeg")
+FFMPEG_TIMEOUT = 20
+
+
+class AudioTooLarge(ValueError):
+    pass
+
+
+@dataclass
+class PreprocessResult:
+    data: bytes
+    mime_type: str
+    original_bytes: int
+    processed_bytes: int
+    original_seconds: float = None
+    processed_seconds: float = None
+    processed: bool = False
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.processed_bytes
+
+    @property
+    def seconds_saved(self) -> float:
+        if self.original_seconds is None or self.processed_seconds is None:
+            return 0.0
+        return round(self.original_seconds - self.processed_seconds, 3)
+
+
+def is_wav(data: bytes) -> bool:
+    return data[:4] == b"RIFF" and data[8:12] == b"WAVE"
+
+
+def decode_wav(data: bytes):
+    # -> (float32 samples in [-1, 1], shape (frames, channels), sample rate)
+    with wave.open(io.BytesIO(data)) as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        raw = wav.readframes(wav.getnframes())
+
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768
+    elif width == 3:
+        packed = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        ints = (packed[:, 0].astype(np.int32) | (packed[:, 1].astype(np.int32) << 8)
+                | (packed[:, 2].astype(np.int32) << 16))
+        ints = np.where(ints >= 1 << 23, ints - (1 << 24), ints)
+        samples = ints.astype(np.float32) / (1 << 23)
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / (1 << 31)
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {width}")
+    if not rate or not channels:
+        raise ValueError(f"Invalid WAV header: {channels} channels at {rate} Hz")
+    return samples.reshape(-1, channels), rate
+
+
+def encode_wav(samples: np.ndarray, rate: int = TARGET_RATE) -> bytes:
+    pcm = (np.clip(samples, -1, 1) * 32767).astype("<i2")
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.tobytes())
+    return out.getvalue()
+
+
+def to_mono(samples: np.ndarray) -> np.ndarray:
+    if samples.ndim == 1:
+        return samples
+    return samples.mean(axis=1)
+
+
+def resample(samples: np.ndarray, rate: int, target: int = TARGET_RATE) -> np.ndarray:
+    # Linear interpolation is plenty for speech going to a recogniser
+    if rate == target or not len(samples):
+        return samples
+    duration = len(samples) / rate
+    target_len = max(1, int(round(duration * target)))
+    positions = np.arange(target_len) * (rate / target)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def trim_silence(samples: np.ndarray, rate: int = TARGET_RATE, threshold_dbfs: float = SILENCE_DBFS) -> np.ndarray:
+    frame = max(1, rate * FRAME_MS // 1000)
+    frames = len(samples) // frame
+    if not frames:
+        return samples
+    energy = np.sqrt(np.mean(samples[:frames * frame].reshape(frames, frame) ** 2, axis=1))
+    voiced = np.nonzero(energy > 10 ** (threshold_dbfs / 20))[0]
+    if not len(voiced):
+        # All silence: keep nothing rather than sending dead air to the model
+        return samples[:0]
+    padding = PADDING_MS * rate // 1000
+    start = max(0, voiced[0] * frame - padding)
+    end = min(len(samples), (voiced[-1] + 1) * frame + padding)
+    return samples[start:end]
+
+
+def _ffmpeg(args: list, data: bytes) -> bytes:
+    completed = subprocess.run(
+        [FFMPEG, "-hide_banner", "-loglevel", "error", *args],
+        input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=FFMPEG_TIMEOUT, check=True
+    )
+    return completed.stdout
+
+
+def _decode_compressed(data: bytes) -> np.ndarray:
+    pcm = _ffmpeg(["-i", "pipe:0", "-ac", "1", "-ar", str(TARGET_RATE), "-f", "s16le", "pipe:1"], data)
+    return np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768
+
+
+def _encode_opus(samples: np.ndarray) -> bytes:
+    pcm = (np.clip(samples, -1, 1) * 32767).astype("<i2").tobytes()
+    return _ffmpeg([
+        "-f", "s16le", "-ar", str(TARGET_RATE), "-ac", "1", "-i", "pipe:0",
+        "-c:a", "libopus", "-b:a", "24k", "-f", "ogg", "pipe:1"
+    ], pcm)
+
+
+def preprocess_audio(data: bytes, mime_type: str = None) -> PreprocessResult:
+    # Blocking (numpy / ffmpeg): run through run_blocking from async routes.
+    # Raises AudioTooLarge when the clip is over the size or duration limit.
+    if len(data) > AUDIO_MAX_BYTES:
+        raise AudioTooLarge(f"Audio is {len(data)} bytes; the limit is {AUDIO_MAX_BYTES}")
+
+    passthrough = PreprocessResult(data, mime_type or ("audio/wav" if is_wav(data) else "audio/webm"), len(data), len(data))
+    if not AUDIO_PREPROCESS:
+        return passthrough
+
+    if is_wav(data):
+        try:
+            samples, rate = decode_wav(data)
+        except (wave.Error, ValueError, EOFError) as e:
+            # Float / extensible WAV and odd sample widths: Gemini reads them as they are
+            print(f"WAV decode failed, sending original clip: {e}")
+            return passthrough
+        original_seconds = len(samples) / rate
+        samples = resample(to_mono(samples), rate)
+    elif FFMPEG:
+        try:
+            samples = _decode_compressed(data)
+        except (subprocess.SubprocessError, OSError) as e:
+            print(f"Audio decode failed, sending original clip: {e}")
+            return passthrough
+        original_seconds = len(samples) / TARGET_RATE
+    else:
+        return passthrough
+
+    if original_seconds > AUDIO_MAX_SECONDS:
+        raise AudioTooLarge(f"Audio is {original_seconds:.1f}s long; the limit is {AUDIO_MAX_SECONDS:.0f}s")
+
+    samples = trim_silence(samples)
+    processed_seconds = len(samples) / TARGET_RATE
+
+    output, output_type = None, "audio/wav"
+    if FFMPEG:
+        try:
+            output, output_type = _encode_opus(samples), "audio/ogg"
+        except (subprocess.SubprocessError, OSError) as e:
+            print(f"Opus encode failed, using WAV: {e}")
+    if output is None:
+        output = encode_wav(samples)
+
+    if len(output) >= len(data) and processed_seconds >= original_seconds:
+        # Nothing gained (already compact and no silence to cut)
+        passthrough.original_seconds = passthrough.processed_seconds = round(original_seconds, 3)
+        return passthrough
+
+    return PreprocessResult(
+        data=output,
+        mime_type=output_type,
+        original_bytes=len(data),
+        processed_bytes=len(output),
+        original_seconds=round(original_seconds, 3),
+        processed_seconds=round(processed_seconds, 3),
+        processed=True,
+    )
@@ -0,0 +1,88 @@
+import json
+from typing import List
+from pydantic import ValidationError
+from .. import models
+from .inventory_service import normalize_name
+
+# Server-side handling of the bill OCR output that the app used to JSON.parse
+# itself: tolerant parsing, validation and merging of line items across pages.
+
+
+class BillParseError(ValueError):
+    pass
+
+
+def _strip_fences(text: str) -> str:
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
+    return text.strip()
+
+
+def _number(value, cast):
+    # "2", "2.0", "₹ 1,200" -> numbers; anything else -> 0
+    if isinstance(value, (int, float)):
+        return cast(value)
+    if isinstance(value, str):
+        cleaned = "".join(c for c in value if c.isdigit() or c in ".-")
+        try:
+            return cast(float(cleaned))
+        except ValueError:
+            return cast(0)
+    return cast(0)
+
+
+def parse_bill_items(text: str) -> List[models.BillItem]:
+    try:
+        data = json.loads(_strip_fences(text))
+    except json.JSONDecodeError:
+        raise BillParseError("Model did not return valid JSON")
+
+    if isinstance(data, dict):
+        if data.get("error"):
+            raise BillParseError(str(data["error"]))
+        data = data.get("items", [])
+    if not isinstance(data, list):
+        raise BillParseError("Expected a JSON array of items")
+
+    items = []
+    for raw in data:
+        if not isinstance(raw, dict):
+            continue
+        name = " ".join(str(raw.get("name") or "").split())
+        if not name:
+            continue
+        try:
+            items.append(models.BillItem(
+                name=name,
+                quantity=max(0, _number(raw.get("quantity"), int)),
+                price=max(0.0, _number(raw.get("price"), float)),
+            ))
+        except ValidationError:
+            continue
+    return items
+
+
+def merge_bill_items(pages: List[List[models.BillItem]]) -> List[models.BillItem]:
+    # Same line on several pages (or twice on one page): add quantities, keep the last non-zero price
+    merged = {}
+    for items in pages:
+        for item in items:
+            key = normalize_name(item.name)
+            if key in merged:
+                existing = merged[key]
+                existing.quantity += item.quantity
+                if item.price > 0:
+                    existing.price = item.price
+            else:
+                merged[key] = item.model_copy()
+    return list(merged.values())
+
+
+def to_product_creates(items: List[models.BillItem], category: str = "Uncategorized") -> List[models.ProductCreate]:
+    # Bill prices are purchase prices, so, like the app's import, selling prices are left untouched
+    return [
+        models.ProductCreate(name=item.name, category=category, price=0, stock=item.quantity, icon_name="package")
+        for item in items
+    ]
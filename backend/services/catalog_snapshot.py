@@ -0,0 +1,128 @@
+import csv
+import io
+import os
+import threading
+from collections import defaultdict
+from sqlalchemy.orm import Session
+from .. import database
+from .data_version import get_catalog_version
+from .intent_parser import PRODUCT_ALIASES, canonical_token, product_tokens, content_words
+from .metrics import registry
+from .product_index import product_index
+
+# Compact catalog (id, name, aliases, price, stock) put in front of the chat SQL
+# prompt, so the model can target products by primary key ("WHERE id = 12")
+# instead of guessing with LIKE '%rice%' and running extra SELECTs to find out
+# which product was meant. The id/name/alias part is cached and rebuilt only
+# when the catalog version moves (products added, renamed or removed); price and
+# stock are read per message for just the products sent, by primary key. Small
+# catalogs are sent whole, larger ones as the products the message names plus
+# the ones the session was just about.
+CATALOG_PROMPT = os.getenv("CHAT_CATALOG_PROMPT", "1") == "1"
+CATALOG_FULL_LIMIT = int(os.getenv("CHAT_CATALOG_FULL_LIMIT", "60"))
+CATALOG_MATCHES = int(os.getenv("CHAT_CATALOG_MATCHES", "12"))
+CATALOG_MIN_SCORE = float(os.getenv("CHAT_CATALOG_MIN_SCORE", "0.4"))
+CATALOG_MAX_ALIASES = 3
+
+HEADER = "id,name,aliases,price,stock\n"
+
+# English name token -> the Hindi/Telugu/romanised words that mean it
+_ALIASES_BY_TOKEN = defaultdict(list)
+for _alias, _token in PRODUCT_ALIASES.items():
+    _ALIASES_BY_TOKEN[canonical_token(_token)].append(_alias)
+
+
+def aliases_for(name: str) -> str:
+    aliases = []
+    for token in sorted(product_tokens(name)):
+        aliases.extend(_ALIASES_BY_TOKEN.get(token, ()))
+    return "/".join(aliases[:CATALOG_MAX_ALIASES])
+
+
+def _line(product_id, name, aliases, price, stock) -> str:
+    out = io.StringIO()
+    if isinstance(price, float) and price.is_integer():
+        price = int(price)
+    csv.writer(out, lineterminator="\n").writerow([product_id, name, aliases, price, stock])
+    return out.getvalue()
+
+
+class CatalogSnapshot:
+    def __init__(self):
+        self.version = None
+        self._products = {}  # id -> (name, aliases) in id order; swapped whole on refresh
+        self._lock = threading.Lock()
+        self.rebuilds = 0
+        self.served = 0
+        self.products_sent = 0
+
+    def refresh(self, db: Session):
+        version = get_catalog_version(db)
+        if version == self.version:
+            return
+        # No lock around the query: under AsyncSession.run_sync it yields to the
+        # event loop, and a second request blocking on a thread lock there would
+        # stall the loop. Two concurrent rebuilds just build the same snapshot.
+        rows = db.query(database.Product.id, database.Product.name).order_by(database.Product.id).all()
+        products = {row.id: (row.name or "", aliases_for(row.name or "")) for row in rows}
+        with self._lock:
+            self._products = products
+            self.version = version
+            self.rebuilds += 1
+
+    def select(self, message: str, product_ids=()) -> list:
+        products = self._products
+        if len(products) <= CATALOG_FULL_LIMIT:
+            return list(products)
+        ids = [i for i in product_ids if i in products]
+        words = content_words(message)
+        if words:
+            named = product_index.containing(words, CATALOG_MATCHES)
+            if not named:
+                # Misspelt names: fall back to the fuzzy search
+                named = [m.product_id for m in product_index.search(" ".join(words), CATALOG_MATCHES)
+                         if m.score >= CATALOG_MIN_SCORE]
+            ids += [i for i in named if i in products]
+        return list(dict.fromkeys(ids))
+
+    def render(self, db: Session, message: str, product_ids=()) -> str:
+        # Catalog section for one message; "" when nothing relevant is known
+        self.refresh(db)
+        product_index.sync(db)
+        ids = self.select(message, product_ids)
+        self.served += 1
+        self.products_sent += len(ids)
+        if not ids:
+            return ""
+        current = dict(
+            (row.id, row) for row in db.query(
+                database.Product.id, database.Product.price, database.Product.stock
+            ).filter(database.Product.id.in_(ids))
+        )
+        products = self._products
+        lines = [
+            _line(i, products[i][0], products[i][1], current[i].price, current[i].stock)
+            for i in ids if i in current and i in products
+        ]
+        scope = "All products" if len(ids) == len(products) else "Products that may be meant (not the full catalog)"
+        return f"Catalog - {scope}; use these ids in SQL:\n{HEADER}{''.join(lines)}"
+
+    def stats(self) -> dict:
+        return {
+            "enabled": CATALOG_PROMPT,
+            "version": self.version,
+            "products": len(self._products),
+            "rebuilds": self.rebuilds,
+            "served": self.served,
+            "avg_products_sent": round(self.products_sent / self.served, 1) if self.served else 0.0,
+        }
+
+
+catalog_snapshot = CatalogSnapshot()
+
+
+@registry.collector
+def _catalog_metrics():
+    stats = catalog_snapshot.stats()
+    yield "kirana_catalog_snapshot_rebuilds_total", "counter", "Catalog snapshot rebuilds (catalog version changes)", {}, stats["rebuilds"]
+    yield "kirana_catalog_snapshot_products", "gauge", "Products in the cached catalog snapshot", {}, stats["products"]
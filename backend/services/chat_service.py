@@ -1,16 +1,23 @@
 import os
+import time
+import asyncio
 import json
 import re
-import google.generativeai as genai
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import text
-from dotenv import load_dotenv
-
-load_dotenv()
-
-api_key = os.getenv("GEMINI_API_KEY")
-if api_key:
-    genai.configure(api_key=api_key)
+from .. import database
+from ..database import run_write
+from .llm_gateway import gateway, LlmUnavailable
+from .intent_parser import parse_intent, has_reference, STOCK_QUERY, PRICE_QUERY, SALE, RESTOCK
+from .data_version import get_data_version, bump_data_version, bump_catalog_version
+from .product_index import product_index
+from .rollups import apply_sales, rebuild_rollups, stamp_sales
+from .response_cache import chat_cache, make_key, context_fingerprint, CACHE_ENABLED
+from .result_renderer import format_reply, render_results, ResultSet, WriteResult, RENDER_MODE
+from .metrics import span, count, observe_stage, sql_rows, sql_statements
+from .catalog_snapshot import catalog_snapshot, CATALOG_PROMPT
+from .session_store import ChatSession, session_store, SESSION_LAST_PRODUCTS
+from . import clients, prompt_builder, sql_engine
 
 SYSTEM_PROMPT = """
 You are a smart, friendly, and efficient Kirana (Grocery) Shop Assistant.
@@ -19,6 +26,7 @@ Your goal is to help the shopkeeper manage their inventory and sales using natur
 **Database Schema:**
 - `products` (id, name, category, price, stock, shelf_position)
 - `sales` (id, product_id, quantity, total_amount, timestamp)
+- `sales_daily` (product_id, day, units, revenue) -- one row per product per day (UTC), read-only summary of `sales`
 
 **Your Capabilities:**
 1.  **Answer Questions**: Provide helpful answers about the shop's data.
@@ -26,9 +34,12 @@ Your goal is to help the shopkeeper manage their inventory and sales using natur
 3.  **Be Conversational**: If the user says "Hi" or "Thanks", reply naturally.
 
 **Rules for SQL Generation:**
-- **Read Data**: Use `SELECT`. Example: "How much rice?" -> `SELECT name, stock FROM products WHERE name LIKE '%rice%'`
+- **Catalog**: The message may start with a `Catalog` CSV (id, name, aliases, price, stock) of the products the user may mean. When the product is listed there, target it by id (`WHERE id = 12`, `product_id = 12`) instead of `LIKE`, and use its listed price; do not run a SELECT just to find an id or price. Use `LIKE` only for products not in the catalog.
+- **Read Data**: Use `SELECT`. Example: "How much rice?" with rice as id 1 in the catalog -> `SELECT name, stock FROM products WHERE id = 1`
 - **Record Sale**: Use `INSERT` into `sales` AND `UPDATE` `products`. **ALWAYS** follow with a `SELECT` to check the new stock.
 - **Restock**: Use `UPDATE`. **ALWAYS** follow with a `SELECT` to check the new stock.
+- **Totals & Trends**: For top sellers, revenue, units sold per day/week/month or by category, query `sales_daily` (JOIN `products` for name/category) instead of scanning `sales`. Example: "Top sellers this week?" -> `SELECT p.name, SUM(d.units) AS units_sold FROM sales_daily d JOIN products p ON p.id = d.product_id WHERE d.day >= date('now', '-6 days') GROUP BY p.id ORDER BY units_sold DESC LIMIT 5`
+- Never write to `sales_daily`; it is updated automatically.
 
 **Response Format (CRITICAL):**
 You must **ALWAYS** reply with a valid JSON object. Do not output any text outside the JSON.
@@ -56,26 +67,282 @@ You must **ALWAYS** reply with a valid JSON object. Do not output any text outsi
 4.  **Valid JSON**: Ensure the output is strictly valid JSON.
 """
 
-model = genai.GenerativeModel('gemini-2.5-flash', system_instruction=SYSTEM_PROMPT, generation_config={"response_mime_type": "application/json"})
+clients.define_model("chat", system_instruction=SYSTEM_PROMPT, generation_config={"response_mime_type": "application/json"})
 
-async def process_chat_message(message: str, db: Session, history: list = [], language: str = "en"):
-    if not api_key:
-        raise Exception("Gemini API key not configured")
+# Chat-issued statements that add, remove or rename products
+_CATALOG_WRITE_RE = re.compile(
+    r"^\s*(insert\s+into\s+products\b|delete\s+from\s+products\b|update\s+products\s+set\b.*\bname\s*=)",
+    re.IGNORECASE | re.DOTALL
+)
+
+# Chat-issued statements that write to the sales table
+_SALE_INSERT_RE = re.compile(r"^\s*insert\s+into\s+sales\b", re.IGNORECASE)
+_SALE_EDIT_RE = re.compile(r"^\s*(update\s+sales\b|delete\s+from\s+sales\b)", re.IGNORECASE)
+# "UPDATE products SET stock = stock - 2 WHERE id = 1 AND stock >= 2": the sale half of a checkout
+_STOCK_DECREMENT_RE = re.compile(r"^\s*update\s+products\b.*\bstock\s*=\s*stock\s*-", re.IGNORECASE | re.DOTALL)
+
+# Routine stock/sale commands are answered locally without calling Gemini
+FAST_PATH_ENABLED = os.getenv("CHAT_FAST_PATH", "1") == "1"
+
+def match_fast_path(db: Session, message: str, session=None):
+    # Read-only: (intent, product) for messages the fast path can answer, else None
+    if not FAST_PATH_ENABLED:
+        return None
+
+    product_index.sync(db)
+    intent = parse_intent(message, product_index, session.last_product if session else None)
+    if not intent or intent.kind not in (STOCK_QUERY, PRICE_QUERY, SALE, RESTOCK):
+        return None
+
+    product = db.query(database.Product).filter(database.Product.id == intent.product_id).first()
+    if not product:
+        return None
+    if session is not None:
+        session.remember_products([(product.id, product.name)])
+    return intent, product
+
+def fast_path_write(db: Session, intent, product, language: str = "en"):
+    # SALE / RESTOCK intents from match_fast_path; run through run_write
+    db.refresh(product)
+    if intent.kind == SALE:
+        # Conditional decrement so two counters cannot sell the same last unit
+        updated = db.query(database.Product).filter(
+            database.Product.id == product.id,
+            database.Product.stock >= intent.quantity
+        ).update({database.Product.stock: database.Product.stock - intent.quantity}, synchronize_session=False)
+        if not updated:
+            db.rollback()
+            db.refresh(product)
+            return {"response": format_reply(language, "insufficient", name=product.name, stock=product.stock), "sql_query": None, "path": "fast"}
+        sale = database.Sale(product_id=product.id, quantity=intent.quantity, total_amount=product.price * intent.quantity)
+        db.add(sale)
+        db.flush()
+        apply_sales(db, [sale])
+        bump_data_version(db)
+        db.commit()
+        db.refresh(product)
+        reply = format_reply(language, SALE, qty=intent.quantity, name=product.name, stock=product.stock)
+    else:
+        db.query(database.Product).filter(database.Product.id == product.id).update(
+            {database.Product.stock: database.Product.stock + intent.quantity}, synchronize_session=False
+        )
+        bump_data_version(db)
+        db.commit()
+        db.refresh(product)
+        reply = format_reply(language, RESTOCK, qty=intent.quantity, name=product.name, stock=product.stock)
+    return {"response": reply, "sql_query": None, "path": "fast"}
+
+async def try_fast_path(message: str, db: AsyncSession, language: str = "en", session=None):
+    # Parsing and lookups run as plain reads; only sales and restocks queue for
+    # the SQLite write gate, so stock/price questions never wait behind checkouts
+    matched = await db.run_sync(match_fast_path, message, session)
+    if not matched:
+        return None
+    intent, product = matched
+    if intent.kind == STOCK_QUERY:
+        reply = format_reply(language, STOCK_QUERY, name=product.name, stock=product.stock)
+    elif intent.kind == PRICE_QUERY:
+        reply = format_reply(language, PRICE_QUERY, name=product.name, price=product.price)
+    else:
+        return await run_write(db, fast_path_write, intent, product, language)
+    return {"response": reply, "sql_query": None, "path": "fast"}
+
+def execute_queries(db: Session, statements: list):
+    # Runs the model's validated statements (sql_engine.prepare) in one transaction:
+    # via run_write when any of them writes, else on a read-only session
+    changes_made = False
+    result_sets = []
+    writes = []
+    rollups_stale = False
+
+    sql_statements.observe(len(statements))
+    for position, statement in enumerate(statements):
+        query = statement.raw
+        if statement.like_scan:
+            count("sql_like_scan")
+        if statement.by_id:
+            count("sql_id_lookup")
+        if statement.readonly:
+            with span("chat.sql_exec"):
+                columns, rows, truncated = sql_engine.execute_read(db, statement)
+            sql_rows.observe(len(rows))
+            result_sets.append(ResultSet(query=query, columns=columns, rows=rows, truncated=truncated))
+            continue
+
+        # Sale inserts report their rows back so the daily rollup can be
+        # updated incrementally; other edits to sales force a rebuild
+        sale_insert = _SALE_INSERT_RE.match(query) and " returning " not in f" {query.lower()} "
+        if sale_insert:
+            with span("chat.sql_exec"):
+                inserted = sql_engine.execute_write(db, statement, returning="id, product_id, quantity, total_amount, timestamp")
+            inserted = stamp_sales(db, inserted)
+            apply_sales(db, inserted)
+            writes.append(WriteResult(query=query, rowcount=len(inserted)))
+            changes_made = changes_made or bool(inserted)
+            continue
+        if _SALE_EDIT_RE.match(query):
+            rollups_stale = True
+
+        with span("chat.sql_exec"):
+            rowcount = sql_engine.execute_write(db, statement)
+        writes.append(WriteResult(query=query, rowcount=rowcount))
+        if rowcount > 0:
+            changes_made = True
+        elif _STOCK_DECREMENT_RE.match(query):
+            # Not enough stock (or no such product): the sale in the same batch
+            # must not be kept. Undo everything and answer from the unchanged rows
+            db.rollback()
+            writes = [WriteResult(query=w.query, rowcount=0) for w in writes]
+            writes += [WriteResult(query=later.raw, rowcount=0) for later in statements[position + 1:] if not later.readonly]
+            result_sets = []
+            for read in (each for each in statements if each.readonly):
+                columns, rows, truncated = sql_engine.execute_read(db, read)
+                result_sets.append(ResultSet(query=read.raw, columns=columns, rows=rows, truncated=truncated))
+            return result_sets, writes, False
+
+    if changes_made:
+        if rollups_stale:
+            rebuild_rollups(db)
+        bump_data_version(db)
+        catalog_changed = any(_CATALOG_WRITE_RE.match(w.query) for w in writes if w.rowcount > 0)
+        if catalog_changed:
+            bump_catalog_version(db)
+        db.commit()
+        if catalog_changed:
+            product_index.invalidate()
+    return result_sets, writes, changes_made
 
-    # Convert history to Gemini format
-    gemini_history = []
-    for msg in history:
-        role = "user" if msg.get("role") == "user" else "model"
-        # We need to ensure history parts are strings, not JSON objects if we want to maintain context cleanly
-        # But since we are changing the format, old history might confuse it. 
-        # For now, we pass the content as is.
-        gemini_history.append({"role": role, "parts": [msg.get("content")]})
+async def run_statements(db: AsyncSession, statements: list):
+    if all(statement.readonly for statement in statements):
+        async with database.ReadOnlySessionLocal() as read_db:
+            return await read_db.run_sync(execute_queries, statements)
+    return await run_write(db, execute_queries, statements)
 
-    chat_session = model.start_chat(history=gemini_history)
-    prompt = f"User: {message}\nLanguage: {language}\nRespond in {language}.\n"
+def _remember(cache_key, result: dict) -> dict:
+    if cache_key is not None and result.get("response"):
+        chat_cache.set(cache_key, result)
+    return result
+
+async def _stream_answer(contents: list, cache_key, sql_query: str, priority: str):
+    # Plain-text streaming variant of the final answer call, for the pipelined voice mode
+    started = time.perf_counter()
+    parts, first = [], True
+    async for chunk in gateway.stream("chat", contents, "chat_answer", priority,
+                                      generation_config={"response_mime_type": "text/plain"}):
+        if first:
+            observe_stage("chat.llm_answer_first_token", time.perf_counter() - started)
+            first = False
+        try:
+            piece = chunk.text
+        except ValueError:
+            # Chunks without text parts (e.g. the final finish_reason chunk)
+            continue
+        parts.append(piece)
+        yield piece
+    observe_stage("chat.llm_answer", time.perf_counter() - started)
+    _remember(cache_key, {"response": "".join(parts).strip(), "sql_query": sql_query, "path": "llm"})
+
+async def process_chat_message(message: str, db: AsyncSession, history: list = [], language: str = "en", stream: bool = False, session: ChatSession = None, priority: str = "chat"):
+    # stream=True: when the answer needs the second model call, return it as an async
+    # iterator of text pieces in result["response_stream"] (with "response": None)
+    # session: server-side conversation (services/session_store.py); replaces
+    # `history` and gets this turn recorded, including streamed answers
+    # priority: queue position for the model calls (llm_gateway.PRIORITIES)
+    usage = {"prompt_tokens": 0}
+    with span("chat.total"):
+        result = await _process_chat_message(message, db, history, language, stream, usage, session, priority)
+    count(f"chat_path_{result.get('path')}")
+    result = {**result, "prompt_tokens": usage["prompt_tokens"]}
+    if session is not None:
+        result["session_id"] = session.id
+        if result.get("response_stream") is not None:
+            result["response_stream"] = _record_stream(session, message, result["response_stream"])
+        else:
+            await _record_turn(session, message, result.get("response"))
+    return result
+
+async def _record_turn(session: ChatSession, message: str, response: str):
+    session.add_turn(message, response)
+    await session_store.save_async(session)
+
+async def _record_stream(session: ChatSession, message: str, pieces):
+    collected = []
+    async for piece in pieces:
+        collected.append(piece)
+        yield piece
+    await _record_turn(session, message, "".join(collected).strip())
+
+def _remember_results(session: ChatSession, result_sets: list):
+    # Last non-empty result and the products in it, for follow-up questions
+    result = next((r for r in result_sets if r.rows), None)
+    if result is None:
+        return
+    session.remember_result(result)
+    columns = [c.lower() for c in result.columns]
+    if "name" not in columns:
+        return
+    name_at = columns.index("name")
+    id_at = next((columns.index(c) for c in ("id", "product_id") if c in columns), None)
+    products = []
+    for row in result.rows[:SESSION_LAST_PRODUCTS]:
+        if id_at is not None:
+            products.append((row[id_at], row[name_at]))
+        else:
+            # Joined/aggregated results often carry only the name; the in-memory index resolves it
+            match = product_index.best_match(str(row[name_at]))
+            if match and match.confident:
+                products.append((match.product_id, match.name))
+    session.remember_products(products)
+
+async def _process_chat_message(message: str, db: AsyncSession, history: list, language: str, stream: bool, usage: dict, session: ChatSession, priority: str):
+    with span("chat.fast_path"):
+        fast_result = await try_fast_path(message, db, language, session)
+    if fast_result:
+        return fast_result
+
+    # Repeated read questions are served from cache until the next data write.
+    # The key includes the conversation so far, so a follow-up like "and sugar?"
+    # only matches the same question asked after the same turns, and voice
+    # (spoken plain text) and text (markdown) answers are kept apart; follow-ups
+    # that refer back into a session ("what about those?") are not cached at all
+    cache_key = None
+    if CACHE_ENABLED and not (session is not None and has_reference(message)):
+        if session is not None:
+            fingerprint = context_fingerprint(session.history, session.summary, session.last_products)
+        else:
+            fingerprint = context_fingerprint(history)
+        mode = "spoken" if stream else "markdown"
+        cache_key = make_key(message, language, await db.run_sync(get_data_version), fingerprint, mode)
+        cached = chat_cache.get(cache_key)
+        count("chat_cache_hit" if cached else "chat_cache_miss")
+        if cached:
+            return {**cached, "path": "cache"}
+
+    if not clients.api_key:
+        raise Exception("Gemini API key not configured")
+
+    # Recent turns are replayed as Gemini history, older ones summarised in the prompt
+    if session is not None:
+        context = prompt_builder.build_history(session.history, session.summary)
+        notes = prompt_builder.session_notes(session.last_products, session.last_result)
+    else:
+        context = prompt_builder.build_history(history)
+        notes = ""
+    if CATALOG_PROMPT:
+        # Product ids, names and current price/stock, so the SQL can use WHERE id = ...
+        recent_ids = [p["id"] for p in session.last_products] if session is not None else ()
+        catalog = await db.run_sync(catalog_snapshot.render, message, recent_ids)
+        notes = "\n".join(part for part in (catalog, notes) if part)
+    # Stateless calls with the history spelled out, so identical concurrent
+    # questions can share one model request in the gateway
+    prompt = prompt_builder.sql_prompt(message, language, context, notes)
+    contents = context.history + [{"role": "user", "parts": [prompt]}]
+    sent_tokens = prompt_builder.record_prompt("chat_sql", prompt, context.history_tokens)
+    usage["prompt_tokens"] += sent_tokens
 
     try:
-        response = chat_session.send_message(prompt)
+        with span("chat.llm_sql"):
+            response = await gateway.generate("chat", contents, "chat_sql", priority)
         text_response = response.text.strip()
         
         try:
@@ -87,42 +354,42 @@ async def process_chat_message(message: str, db: Session, history: list = [], la
                 data = json.loads(clean_text)
             except:
                 # Ultimate fallback: treat as answer
-                return {"response": text_response, "sql_query": None}
+                return {"response": text_response, "sql_query": None, "path": "llm"}
 
         if data.get("type") == "answer":
-            return {"response": data.get("content"), "sql_query": None}
+            return _remember(cache_key, {"response": data.get("content"), "sql_query": None, "path": "llm"})
 
         elif data.get("type") == "sql":
             sql_query = data.get("content")
             try:
                 # Clean up SQL
                 sql_query = sql_query.replace("```sql", "").replace("```", "").strip()
-                queries = [q.strip() for q in sql_query.split(';') if q.strip()]
-                data_str = ""
-                changes_made = False
-                
-                for query in queries:
-                    if not any(query.upper().startswith(kw) for kw in ["SELECT", "INSERT", "UPDATE", "DELETE"]):
-                        continue
-
-                    result = db.execute(text(query))
-                    
-                    if query.upper().startswith("SELECT"):
-                        rows = result.fetchall()
-                        if rows:
-                            data_str += f"Query: {query}\nResult:\n"
-                            for row in rows:
-                                data_str += str(row) + "\n"
-                        else:
-                            data_str += f"Query: {query}\nResult: No data found.\n\n"
-                    else:
-                        if result.rowcount > 0:
-                            changes_made = True
-                            
-                if changes_made:
-                    db.commit()
+                statements = sql_engine.prepare(sql_query)
+                result_sets, writes, changes_made = await run_statements(db, statements)
+                if session is not None:
+                    _remember_results(session, result_sets)
+
+                # Only pure reads are cacheable; the version key handles invalidation
+                if writes:
+                    cache_key = None
+
+                # Phrase the answer locally when we recognise the result shape
+                if RENDER_MODE != "llm":
+                    with span("chat.render"):
+                        rendered = render_results(result_sets, writes, language, force=RENDER_MODE == "local")
+                    if rendered is not None:
+                        return _remember(cache_key, {"response": rendered, "sql_query": sql_query, "path": "llm_local_render"})
                 
                 # Generate final natural language response
+                if stream:
+                    formatting = "If the data retrieved contains multiple rows, list the most relevant ones in short spoken sentences (no tables)."
+                    output_format = "Return plain text only (no JSON, no Markdown), in short sentences that can be read aloud."
+                else:
+                    formatting = "If the data retrieved contains multiple rows (more than 1), YOU MUST present it as a Markdown Table in your response."
+                    output_format = 'Return a JSON object: `{ "type": "answer", "content": "..." }`'
+                # The answer call replays the history and the SQL exchange as well
+                history_tokens = sent_tokens + prompt_builder.estimate_tokens(text_response)
+                data_str = prompt_builder.encode_results(result_sets, prompt_builder.results_budget(history_tokens))
                 answer_prompt = f"""
                 User Question: {message}
                 SQL Queries Executed: {sql_query}
@@ -137,23 +404,43 @@ async def process_chat_message(message: str, db: Session, history: list = [], la
                    - Example: "Sold 2 milk. Remaining stock: 8"
                    - Example: "Added 10 sugar. Total stock is now: 50"
                 4. **CRITICAL**: Reply in the SAME language as the user's question ({language}).
-                5. **Formatting**: If the data retrieved contains multiple rows (more than 1), YOU MUST present it as a Markdown Table in your response.
-                6. **Output Format**: Return a JSON object: `{{ "type": "answer", "content": "..." }}`
+                5. **Formatting**: {formatting}
+                6. **Output Format**: {output_format}
                 """
+                usage["prompt_tokens"] += prompt_builder.record_prompt("chat_answer", answer_prompt, history_tokens)
+                contents += [{"role": "model", "parts": [text_response]}, {"role": "user", "parts": [answer_prompt]}]
                 
-                final_response = chat_session.send_message(answer_prompt)
+                if stream:
+                    return {
+                        "response": None,
+                        "response_stream": _stream_answer(contents, cache_key, sql_query, priority),
+                        "sql_query": sql_query,
+                        "path": "llm_stream",
+                    }
+
+                with span("chat.llm_answer"):
+                    final_response = await gateway.generate("chat", contents, "chat_answer", priority)
                 try:
                     final_data = json.loads(final_response.text.strip())
-                    return {"response": final_data.get("content"), "sql_query": sql_query}
+                    return _remember(cache_key, {"response": final_data.get("content"), "sql_query": sql_query, "path": "llm"})
                 except:
                     # If final response isn't JSON, just return text
-                    return {"response": final_response.text.strip(), "sql_query": sql_query}
+                    return _remember(cache_key, {"response": final_response.text.strip(), "sql_query": sql_query, "path": "llm"})
 
+            except (asyncio.TimeoutError, LlmUnavailable):
+                raise
+            except sql_engine.SqlRejected as e:
+                await db.rollback()
+                print(f"Rejected generated SQL ({e}): {sql_query}")
+                return {"response": "I can't run that request safely. Please ask about products or sales in a different way.", "sql_query": sql_query, "path": "llm"}
+            except sql_engine.SqlTimeout:
+                await db.rollback()
+                return {"response": "That question took too long to answer. Please narrow it down (e.g. a product or a date range).", "sql_query": sql_query, "path": "llm"}
             except Exception as e:
-                db.rollback()
-                return {"response": f"I encountered an error while accessing the database. Error: {str(e)}", "sql_query": sql_query}
+                await db.rollback()
+                return {"response": f"I encountered an error while accessing the database. Error: {str(e)}", "sql_query": sql_query, "path": "llm"}
 
-        return {"response": "I'm not sure how to help with that.", "sql_query": None}
+        return {"response": "I'm not sure how to help with that.", "sql_query": None, "path": "llm"}
 
     except Exception as e:
         import traceback
@@ -0,0 +1,68 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+
+# Shared registry for the Gemini models. Modules declare what they need with
+# define_model() at import time (cheap: just the kwargs); google.generativeai is
+# imported and the models are built on first use, so importing the app and
+# starting a uvicorn worker does not pay for SDKs a request may never touch.
+# main.py's lifespan calls preload() in a background thread once the worker is
+# serving, so the first real request normally finds everything ready.
+load_dotenv()
+
+api_key = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+CLIENTS_PRELOAD = os.getenv("CLIENTS_PRELOAD", "1") == "1"
+
+_specs = {}  # name -> GenerativeModel kwargs
+_models = {}  # name -> built model, or an override from set_model()
+_lock = threading.Lock()
+_configured = False
+
+# Milliseconds spent on lazy imports/construction, reported by main.py at startup
+timings = {}
+
+
+def define_model(name: str, **kwargs):
+    _specs[name] = kwargs
+
+
+def set_model(name: str, model):
+    # Benchmarks swap in offline fakes here
+    _models[name] = model
+
+
+def _genai():
+    global _configured
+    started = time.perf_counter()
+    import google.generativeai as genai
+    if not _configured:
+        if api_key:
+            genai.configure(api_key=api_key)
+        else:
+            print("Warning: GEMINI_API_KEY not found in environment variables")
+        _configured = True
+        timings.setdefault("genai_import_ms", round((time.perf_counter() - started) * 1000, 1))
+    return genai
+
+
+def get_model(name: str):
+    model = _models.get(name)
+    if model is None:
+        with _lock:
+            model = _models.get(name)
+            if model is None:
+                model = _models[name] = _genai().GenerativeModel(GEMINI_MODEL, **_specs[name])
+    return model
+
+
+def preload():
+    # Blocking: run in a thread. Builds every declared model and imports the TTS libraries.
+    started = time.perf_counter()
+    for name in list(_specs):
+        get_model(name)
+    import edge_tts  # noqa: F401
+    import gtts  # noqa: F401
+    timings["preload_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    print(f"Clients preloaded in {timings['preload_ms']:.0f} ms")
@@ -0,0 +1,55 @@
+import os
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+# Timeouts (seconds) and concurrency caps for calls that leave the process.
+# Every external call from an async route goes through here so a slow Gemini,
+# edge-tts or data.gov.in response never blocks the event loop.
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+TTS_TIMEOUT = float(os.getenv("TTS_TIMEOUT_SECONDS", "15"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT_SECONDS", "10"))
+
+CONCURRENCY_LIMITS = {
+    # Enforced by llm_gateway's priority queue rather than a semaphore here
+    "llm": int(os.getenv("MAX_CONCURRENT_LLM_CALLS", "8")),
+    "tts": int(os.getenv("MAX_CONCURRENT_TTS_CALLS", "8")),
+    "http": int(os.getenv("MAX_CONCURRENT_HTTP_CALLS", "8")),
+    "audio": int(os.getenv("MAX_CONCURRENT_AUDIO_JOBS", "4")),
+    "image": int(os.getenv("MAX_CONCURRENT_IMAGE_JOBS", "4")),
+}
+
+# Thread pool for the remaining blocking clients (gTTS, requests) and audio/image processing
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BLOCKING_IO_WORKERS", "8")),
+    thread_name_prefix="kirana-io"
+)
+_semaphores = {}
+
+def _semaphore(kind: str) -> asyncio.Semaphore:
+    # Created lazily so they bind to the running event loop
+    if kind not in _semaphores:
+        _semaphores[kind] = asyncio.Semaphore(CONCURRENCY_LIMITS[kind])
+    return _semaphores[kind]
+
+async def run_async(kind: str, coro, timeout: float = None):
+    # Await an async client call under the concurrency cap for `kind`
+    async with _semaphore(kind):
+        return await asyncio.wait_for(coro, timeout)
+
+async def run_blocking(kind: str, func, *args, timeout: float = None, **kwargs):
+    # Run a blocking call on the bounded executor under the concurrency cap for `kind`
+    async with _semaphore(kind):
+        loop = asyncio.get_running_loop()
+        return await asyncio.wait_for(loop.run_in_executor(_executor, partial(func, *args, **kwargs)), timeout)
+
+async def iterate_with_timeout(kind: str, aiterator, timeout: float = None):
+    # Stream an async iterator, bounding the wait for each item rather than the whole stream
+    async with _semaphore(kind):
+        iterator = aiterator.__aiter__()
+        while True:
+            try:
+                item = await asyncio.wait_for(iterator.__anext__(), timeout)
+            except StopAsyncIteration:
+                break
+            yield item
@@ -0,0 +1,29 @@
+from sqlalchemy.orm import Session
+from .. import database
+
+# Rows in the data_version table:
+#   DATA_VERSION    - bumped on every write to products or sales (cache keys)
+#   CATALOG_VERSION - bumped only when products are added, renamed or removed
+DATA_VERSION = 1
+CATALOG_VERSION = 2
+
+def get_data_version(db: Session, counter: int = DATA_VERSION) -> int:
+    row = db.query(database.DataVersion.version).filter(database.DataVersion.id == counter).first()
+    return row[0] if row else 0
+
+def bump_data_version(db: Session, counter: int = DATA_VERSION):
+    # Call before commit, inside the transaction that writes products/sales
+    updated = db.query(database.DataVersion).filter(database.DataVersion.id == counter).update(
+        {database.DataVersion.version: database.DataVersion.version + 1}, synchronize_session=False
+    )
+    if not updated:
+        db.add(database.DataVersion(id=counter, version=1))
+
+def get_catalog_version(db: Session) -> int:
+    return get_data_version(db, CATALOG_VERSION)
+
+def bump_catalog_version(db: Session) -> int:
+    # Returns the new version so in-process indexes can apply the change incrementally
+    bump_data_version(db, CATALOG_VERSION)
+    db.flush()
+    return get_catalog_version(db)
@@ -0,0 +1,183 @@
+import os
+import io
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from PIL import Image, ImageOps
+from .metrics import registry
+
+# Prepares phone photos for the vision model (orientation, size, grayscale for
+# text-only OCR, JPEG recompression) and caches parsed results so a re-uploaded
+# bill or re-shot shelf skips the model call. Results are keyed on the exact
+# image bytes; only the kinds in VISION_NEAR_MATCH_KINDS also match photos with
+# a close perceptual hash. Bills stay exact-only: bills printed on the same
+# supplier template differ by a few dHash bits, and their line items must never
+# be swapped.
+VISION_MAX_EDGE = int(os.getenv("VISION_MAX_EDGE", "1600"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "80"))
+
+VISION_CACHE_ENABLED = os.getenv("VISION_CACHE_ENABLED", "1") == "1"
+VISION_CACHE_MAX_ENTRIES = int(os.getenv("VISION_CACHE_MAX_ENTRIES", "256"))
+VISION_CACHE_TTL_SECONDS = float(os.getenv("VISION_CACHE_TTL_SECONDS", str(24 * 3600)))
+# Max differing bits (of 64) for two photos to count as the same image
+VISION_HASH_DISTANCE = int(os.getenv("VISION_HASH_DISTANCE", "6"))
+VISION_NEAR_MATCH_KINDS = set(filter(None, os.getenv("VISION_NEAR_MATCH_KINDS", "shelf").split(",")))
+
+EXIF_ORIENTATION = 0x0112
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime_type: str
+    dhash: int
+    digest: str  # sha256 of the prepared bytes
+    original_bytes: int
+    processed_bytes: int
+    size: tuple
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.processed_bytes
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    # Difference hash: brightness gradient between neighbouring pixels of a
+    # tiny grayscale thumbnail; robust to rescaling and recompression
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def prepare_image(data: bytes, grayscale: bool = False) -> PreparedImage:
+    # Blocking (PIL): run through run_blocking from async routes
+    original = Image.open(io.BytesIO(data))
+    upright = original.getexif().get(EXIF_ORIENTATION, 1) == 1
+    image = ImageOps.exif_transpose(original)
+    image_hash = dhash(image)
+
+    resized = max(image.size) > VISION_MAX_EDGE
+    image = image.convert("L" if grayscale else "RGB")
+    if resized:
+        image.thumbnail((VISION_MAX_EDGE, VISION_MAX_EDGE), Image.LANCZOS)
+
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+    processed = out.getvalue()
+    if len(processed) >= len(data) and original.format == "JPEG" and upright and not resized:
+        # Already a compact, upright JPEG: re-encoding would only cost quality
+        processed = data
+    return PreparedImage(
+        data=processed,
+        mime_type="image/jpeg",
+        dhash=image_hash,
+        digest=hashlib.sha256(processed).hexdigest(),
+        original_bytes=len(data),
+        processed_bytes=len(processed),
+        size=image.size,
+    )
+
+
+class PerceptualCache:
+    # LRU of model results keyed by (kind, sha256 of the image). Kinds in
+    # near_kinds also match any entry of the same kind whose dHash is within
+    # VISION_HASH_DISTANCE bits.
+    def __init__(self, max_entries: int = VISION_CACHE_MAX_ENTRIES, ttl_seconds: float = VISION_CACHE_TTL_SECONDS,
+                 max_distance: int = VISION_HASH_DISTANCE, near_kinds: set = VISION_NEAR_MATCH_KINDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.near_kinds = near_kinds
+        self._entries = OrderedDict()  # (kind, digest) -> (stored_at, dhash, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def get(self, kind: str, prepared: PreparedImage):
+        now = time.monotonic()
+        with self._lock:
+            best_key = (kind, prepared.digest)
+            entry = self._entries.get(best_key)
+            if entry is not None and now - entry[0] > self.ttl_seconds:
+                del self._entries[best_key]
+                entry = None
+            if entry is None and kind in self.near_kinds:
+                best_key, best_distance = None, None
+                for key, (stored_at, image_hash, _) in list(self._entries.items()):
+                    if now - stored_at > self.ttl_seconds:
+                        del self._entries[key]
+                        continue
+                    if key[0] != kind:
+                        continue
+                    distance = hamming(image_hash, prepared.dhash)
+                    if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                        best_key, best_distance = key, distance
+                if best_key is not None:
+                    entry = self._entries[best_key]
+                    self.near_hits += 1
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, kind: str, prepared: PreparedImage, value):
+        key = (kind, prepared.digest)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), prepared.dhash, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def record_payload(self, prepared: PreparedImage):
+        with self._lock:
+            self.bytes_in += prepared.original_bytes
+            self.bytes_out += prepared.processed_bytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": VISION_CACHE_ENABLED,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "near_match_kinds": sorted(self.near_kinds),
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "payload_bytes_in": self.bytes_in,
+                "payload_bytes_out": self.bytes_out,
+                "payload_bytes_saved": self.bytes_in - self.bytes_out,
+            }
+
+
+vision_cache = PerceptualCache()
+
+
+@registry.collector
+def _vision_cache_metrics():
+    stats = vision_cache.stats()
+    yield "kirana_cache_hits_total", "counter", "Cache hits", {"cache": "vision"}, stats["hits"]
+    yield "kirana_cache_misses_total", "counter", "Cache misses", {"cache": "vision"}, stats["misses"]
+    yield "kirana_cache_entries", "gauge", "Entries currently cached", {"cache": "vision"}, stats["entries"]
+    yield "kirana_vision_payload_bytes_saved_total", "counter", "Image bytes not sent to the model", {}, stats["payload_bytes_saved"]
@@ -0,0 +1,239 @@
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+# Local parser for the handful of counter intents that make up most chat traffic
+# ("rice stock", "sold 2 milk", "add 10 sugar") in English, Hindi and Telugu.
+# Anything it is not sure about returns None so the caller can fall back to the LLM.
+
+STOCK_QUERY = "stock_query"
+PRICE_QUERY = "price_query"
+SALE = "sale"
+RESTOCK = "restock"
+
+# Devanagari and Telugu digits -> ASCII
+_DIGITS = {ord(c): str(i) for i, c in enumerate("०१२३४५६७८९")}
+_DIGITS.update({ord(c): str(i) for i, c in enumerate("౦౧౨౩౪౫౬౭౮౯")})
+
+# Latin letters/digits and the Indic scripts from Devanagari to Malayalam (Bengali,
+# Gurmukhi, Gujarati, Tamil, Telugu, Kannada, ...), minus the danda punctuation
+_TOKEN_RE = re.compile(r"[a-z0-9\u0900-\u0963\u0966-\u0d7f]+")
+
+NUMBER_WORDS = {
+    # English
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "fifteen": 15,
+    "twenty": 20,
+    # Hindi
+    "एक": 1, "दो": 2, "तीन": 3, "चार": 4, "पांच": 5, "पाँच": 5, "छह": 6, "छः": 6,
+    "सात": 7, "आठ": 8, "नौ": 9, "दस": 10, "बारह": 12, "पंद्रह": 15, "बीस": 20,
+    # Telugu
+    "ఒకటి": 1, "ఒక": 1, "రెండు": 2, "మూడు": 3, "నాలుగు": 4, "ఐదు": 5, "ఆరు": 6,
+    "ఏడు": 7, "ఎనిమిది": 8, "తొమ్మిది": 9, "పది": 10, "పన్నెండు": 12, "ఇరవై": 20,
+}
+
+# Verb / question words. Native-script entries are stems and match by prefix so
+# inflections (बेचा/बेचे, అమ్మాను/అమ్మేశాను) are covered.
+SALE_WORDS = {"sold", "sell", "sells", "sale", "selling", "becha", "beche", "bech"}
+SALE_STEMS = ("बेच", "बिक", "అమ్మ")
+
+RESTOCK_WORDS = {"add", "added", "adding", "restock", "restocked", "received", "receive", "jodo", "jod"}
+RESTOCK_STEMS = ("जोड़", "जोड", "डाल", "मंगा", "आया", "आए", "आये", "జోడించ", "జోడి", "చేర్చ", "కలప", "కలుపు", "వచ్చ")
+
+STOCK_WORDS = {"stock", "left", "remaining", "available", "kitna", "kitne"}
+STOCK_STEMS = ("कितन", "स्टॉक", "बच", "ఎంత", "ఎన్ని", "స్టాక్", "మిగిలి")
+
+PRICE_WORDS = {"price", "cost", "rate", "mrp", "daam", "dam"}
+PRICE_STEMS = ("दाम", "कीमत", "भाव", "रेट", "ధర", "రేటు")
+
+# "How much rice?" may ask for the stock or the price, and "how many sugar sold"
+# is not a sale: a question word alone is no intent, and never a sale or restock
+QUESTION_WORDS = {"how"}
+
+FILLER_WORDS = {
+    # English
+    "is", "are", "the", "of", "a", "an", "do", "does", "we", "i", "have", "has", "in",
+    "there", "please", "pls", "for", "much", "many", "what", "whats", "s", "to", "our",
+    "me", "tell", "check", "ok", "okay", "just", "today", "now", "unit", "units",
+    "piece", "pieces", "pcs", "packet", "packets", "pack", "packs", "kg", "kgs", "bag",
+    "bags", "bottle", "bottles", "litre", "litres", "liter", "liters", "more", "some",
+    "current", "currently", "stocks", "it", "its", "and", "hai", "hain", "ka", "ki", "ke",
+    # Hindi
+    "है", "हैं", "का", "की", "के", "में", "और", "क्या", "अभी", "आज", "पैकेट", "किलो",
+    "बोतल", "हमारे", "पास", "ने", "को", "गया", "गए", "गई", "दिया", "दिए", "कर", "करो",
+    # Telugu
+    "ఉంది", "ఉన్నాయి", "ఉన్నది", "యొక్క", "ఇప్పుడు", "ఈరోజు", "ప్యాకెట్లు", "ప్యాకెట్",
+    "కిలో", "కిలోలు", "బాటిల్", "మన", "దగ్గర", "చేయి", "చేయండి", "ను", "కి",
+}
+
+# "it", "its", "that one": the product the conversation was just about
+REFERENCE_WORDS = {
+    "it", "its", "that", "this", "same", "them", "those", "uska", "iska", "wo", "woh",
+    "उसका", "उसकी", "उसके", "इसका", "इसकी", "इसके", "उस", "इस", "वह", "वो", "यह", "ये",
+    "దాని", "దీని", "అది", "ఇది", "దానికి", "దీనికి", "వాటి",
+}
+
+# Native-script and romanised product words -> English tokens used in product names.
+PRODUCT_ALIASES = {
+    # Hindi
+    "चावल": "rice", "दाल": "dal", "तेल": "oil", "आटा": "atta", "चीनी": "sugar",
+    "शक्कर": "sugar", "नमक": "salt", "मिर्च": "chilli", "हल्दी": "turmeric",
+    "दूध": "milk", "दही": "curd", "मैगी": "maggi", "बिस्कुट": "biscuits", "सेब": "apple",
+    "केला": "banana", "केले": "banana", "आलू": "potato", "प्याज": "onion", "प्याज़": "onion",
+    "कोक": "coke", "चाय": "tea", "चायपत्ती": "tea",
+    # Telugu
+    "బియ్యం": "rice", "పప్పు": "dal", "నూనె": "oil", "ఆటా": "atta", "గోధుమపిండి": "atta",
+    "చక్కెర": "sugar", "పంచదార": "sugar", "ఉప్పు": "salt", "కారం": "chilli",
+    "పసుపు": "turmeric", "పాలు": "milk", "పాల": "milk", "పెరుగు": "curd", "మ్యాగీ": "maggi",
+    "బిస్కెట్లు": "biscuits", "బిస్కెట్": "biscuits", "ఆపిల్": "apple", "యాపిల్": "apple",
+    "అరటి": "banana", "అరటిపండ్లు": "banana", "బంగాళదుంప": "potato", "ఆలు": "potato",
+    "ఉల్లిపాయ": "onion", "ఉల్లిపాయలు": "onion", "ఉల్లి": "onion", "కోక్": "coke", "టీ": "tea",
+    # Romanised Hindi
+    "chawal": "rice", "chaval": "rice", "daal": "dal", "tel": "oil", "cheeni": "sugar",
+    "chini": "sugar", "namak": "salt", "mirchi": "chilli", "chili": "chilli", "haldi": "turmeric",
+    "doodh": "milk", "dudh": "milk", "dahi": "curd", "aloo": "potato", "alu": "potato",
+    "pyaz": "onion", "pyaaz": "onion", "kela": "banana", "seb": "apple", "chai": "tea",
+}
+
+_NATIVE_ALIASES = sorted(
+    (alias for alias in PRODUCT_ALIASES if not alias.isascii() and len(alias) >= 2),
+    key=len, reverse=True
+)
+
+
+@dataclass
+class Intent:
+    kind: str
+    product_id: int
+    product_name: str
+    quantity: Optional[int] = None
+
+
+def normalize_text(text: str) -> str:
+    return text.lower().translate(_DIGITS)
+
+
+def tokenize(text: str) -> list:
+    return _TOKEN_RE.findall(normalize_text(text))
+
+
+def _stem(token: str) -> str:
+    if len(token) > 4 and token.endswith("es"):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s"):
+        return token[:-1]
+    return token
+
+
+
+
+def _alias(token: str) -> Optional[str]:
+    if token in PRODUCT_ALIASES:
+        return PRODUCT_ALIASES[token]
+    if token.isascii():
+        return None
+    # Telugu/Hindi case suffixes (పాలను, चावलों) -> match the longest alias prefix
+    for native in _NATIVE_ALIASES:
+        if token.startswith(native):
+            return PRODUCT_ALIASES[native]
+    return None
+
+
+def canonical_token(token: str) -> str:
+    # Shared by the product index so "chawal", "चावल" and "Rice" meet on "rice"
+    return _stem(_alias(token) or token)
+
+
+def product_tokens(name: str) -> set:
+    return {canonical_token(t) for t in tokenize(name)}
+
+
+def _classify_verb(token: str) -> Optional[str]:
+    if token in SALE_WORDS or token.startswith(SALE_STEMS):
+        return SALE
+    if token in RESTOCK_WORDS or token.startswith(RESTOCK_STEMS):
+        return RESTOCK
+    if token in PRICE_WORDS or token.startswith(PRICE_STEMS):
+        return PRICE_QUERY
+    if token in STOCK_WORDS or token.startswith(STOCK_STEMS):
+        return STOCK_QUERY
+    return None
+
+
+def content_words(message: str) -> list:
+    # The words of a message that could name a product (no fillers, verbs or numbers)
+    return [
+        token for token in tokenize(message)
+        if not token.isdigit() and token not in NUMBER_WORDS and token not in FILLER_WORDS
+        and token not in REFERENCE_WORDS and token not in QUESTION_WORDS and not _classify_verb(token)
+    ]
+
+
+def has_reference(message: str) -> bool:
+    return any(token in REFERENCE_WORDS for token in tokenize(message))
+
+
+def parse_intent(message: str, index, last_product: Optional[tuple] = None) -> Optional[Intent]:
+    # index: services.product_index.ProductIndex (already synced with the DB)
+    # last_product: (id, name) the conversation was about, for "and its price?"
+    tokens = tokenize(message)
+    if not tokens or len(tokens) > 12:
+        return None
+
+    kinds = set()
+    numbers = []
+    words = []
+    referenced = False
+    question = False
+    for token in tokens:
+        if token in QUESTION_WORDS:
+            question = True
+            continue
+        if token in REFERENCE_WORDS:
+            referenced = True
+            continue
+        if token.isdigit():
+            numbers.append(int(token))
+            continue
+        if token in NUMBER_WORDS:
+            numbers.append(NUMBER_WORDS[token])
+            continue
+        if token in FILLER_WORDS:
+            continue
+        kind = _classify_verb(token)
+        if kind:
+            kinds.add(kind)
+            continue
+        words.append(canonical_token(token))
+
+    # "kitna" + "sold" etc. is an analytics question, not a counter command
+    if len(kinds) != 1 or len(numbers) > 1:
+        return None
+    kind = kinds.pop()
+    if question and kind in (SALE, RESTOCK):
+        return None
+
+    if not words:
+        # Follow-up about the last product ("and its price?", "sell 2 more of it")
+        if not referenced or last_product is None:
+            return None
+        match = last_product
+    else:
+        match, hits = index.resolve_tokens(words)
+        if not match:
+            return None
+        leftovers = [w for w in words if w not in hits]
+        if leftovers:
+            # Unknown words ("last week", "cheapest") change the meaning; let the LLM handle it
+            return None
+
+    product_id, name = match
+    if kind in (SALE, RESTOCK):
+        quantity = numbers[0] if numbers else 1
+        if quantity <= 0:
+            return None
+        return Intent(kind=kind, product_id=product_id, product_name=name, quantity=quantity)
+
+    if numbers:
+        return None
+    return Intent(kind=kind, product_id=product_id, product_name=name)
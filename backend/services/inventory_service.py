@@ -0,0 +1,136 @@
+import os
+from typing import List
+from sqlalchemy import insert, update, select, bindparam, case, func, event
+from sqlalchemy.orm import Session
+from .. import database, models
+from .data_version import bump_data_version, bump_catalog_version
+from .product_index import product_index
+
+# Names without an exact (case-insensitive) match are merged into an existing
+# product only when the fuzzy index is this sure; otherwise a new product is created
+BULK_MERGE_THRESHOLD = float(os.getenv("PRODUCT_BULK_MERGE_THRESHOLD", "0.9"))
+
+# Keep IN (...) lists and executemany batches well below SQLite's variable limit
+BATCH_SIZE = 500
+
+products_table = database.Product.__table__
+
+# Session.info key for index updates waiting on the caller's commit
+_PENDING_INDEX = "pending_product_index"
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(name.split()).lower()
+
+
+def _chunks(items: list, size: int = BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _merge_duplicates(products: List[models.ProductCreate]) -> dict:
+    # Supplier bills often list the same item twice; fold them into one line
+    merged = {}
+    for product in products:
+        key = normalize_name(product.name)
+        if not key:
+            continue
+        if key in merged:
+            existing = merged[key]
+            existing["stock"] += product.stock
+            if product.price > 0:
+                existing["price"] = product.price
+        else:
+            merged[key] = product.dict()
+    return merged
+
+
+def find_existing_ids(db: Session, keys: list) -> dict:
+    # normalized name -> product id, resolved with one indexed query per batch
+    found = {}
+    for chunk in _chunks(keys):
+        rows = db.execute(
+            select(products_table.c.id, func.lower(products_table.c.name))
+            .where(func.lower(products_table.c.name).in_(chunk))
+            .order_by(products_table.c.id)
+        ).all()
+        for product_id, lowered in rows:
+            found.setdefault(lowered, product_id)
+    return found
+
+
+def _index_on_commit(db: Session, names: list, version: int):
+    # The caller owns the transaction, so new products reach the shared index only
+    # once it commits; after a rollback the index never saw them
+    db.info.setdefault(_PENDING_INDEX, []).append((names, version))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pending_index(session):
+    for names, version in session.info.pop(_PENDING_INDEX, ()):
+        for product_id, name in names:
+            product_index.upsert(product_id, name)
+        product_index.advance(version)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending_index(session):
+    session.info.pop(_PENDING_INDEX, None)
+
+
+def upsert_products(db: Session, products: List[models.ProductCreate]) -> List[models.Product]:
+    # Set-based version of the old per-item ilike lookup: existing products get
+    # their stock incremented (and price replaced when a non-zero price is given),
+    # new ones are inserted. The caller owns the transaction.
+    merged = _merge_duplicates(products)
+    if not merged:
+        return []
+
+    existing = find_existing_ids(db, list(merged.keys()))
+
+    # "Sona Masoori" vs "Sona masoori rice": only high-confidence fuzzy matches are merged
+    unresolved = [key for key in merged if key not in existing]
+    if unresolved:
+        product_index.sync(db)
+        for key in unresolved:
+            match = product_index.best_match(key)
+            if match and match.score >= BULK_MERGE_THRESHOLD and not match.ambiguous:
+                existing[key] = match.product_id
+
+    updates = [
+        {"b_id": existing[key], "b_stock": item["stock"], "b_price": item["price"]}
+        for key, item in merged.items() if key in existing
+    ]
+    if updates:
+        db.execute(
+            update(products_table)
+            .where(products_table.c.id == bindparam("b_id"))
+            .values(
+                stock=products_table.c.stock + bindparam("b_stock"),
+                price=case((bindparam("b_price") > 0, bindparam("b_price")), else_=products_table.c.price)
+            ),
+            updates
+        )
+
+    rows_by_id = {}
+    new_items = [item for key, item in merged.items() if key not in existing]
+    for chunk in _chunks(new_items):
+        result = db.execute(
+            insert(products_table).returning(*products_table.c, sort_by_parameter_order=True),
+            chunk
+        )
+        for row, item in zip(result.mappings(), chunk):
+            rows_by_id[row["id"]] = row
+            existing[normalize_name(item["name"])] = row["id"]
+    if new_items:
+        version = bump_catalog_version(db)
+        _index_on_commit(db, [(product_id, row["name"]) for product_id, row in rows_by_id.items()], version)
+
+    # Final values for updated rows in one select per batch, no per-row refresh
+    updated_ids = list({u["b_id"] for u in updates})
+    for chunk in _chunks(updated_ids):
+        for row in db.execute(select(products_table).where(products_table.c.id.in_(chunk))).mappings():
+            rows_by_id[row["id"]] = row
+
+    bump_data_version(db)
+    return [models.Product.model_validate(dict(rows_by_id[existing[key]])) for key in merged]
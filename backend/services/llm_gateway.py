@@ -0,0 +1,288 @@
+import os
+import time
+import json
+import math
+import heapq
+import random
+import asyncio
+import hashlib
+import itertools
+from collections import Counter
+from .concurrency import CONCURRENCY_LIMITS, LLM_TIMEOUT
+from .metrics import registry, llm_queue_wait, count, record_llm_usage
+from . import clients
+
+# Every Gemini call (chat, transcription, vision) goes through this gateway:
+#   - identical calls already in flight (same model, contents and options) are
+#     coalesced: one request to Gemini, every caller gets its result
+#   - a token bucket keeps us under the project's requests-per-minute quota
+#     (LLM_REQUESTS_PER_MINUTE, bursts of LLM_BURST; 0 = no limit)
+#   - calls wait for a token and a concurrency slot in a priority queue, so a
+#     spoken question is not stuck behind a 20-page OCR batch
+#   - rate-limit and transient errors are retried with jittered backoff; when
+#     the quota stays exhausted callers get LlmUnavailable (routes send 503)
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "1000"))
+LLM_BURST = int(os.getenv("LLM_BURST", "10"))
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "200"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "20"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_BACKOFF_SECONDS = float(os.getenv("LLM_BACKOFF_SECONDS", "1"))
+LLM_COALESCE = os.getenv("LLM_COALESCE", "1") == "1"
+
+# Lower runs first
+PRIORITIES = {"voice": 0, "chat": 1, "vision": 2, "batch": 3}
+
+# HTTP statuses google.api_core attaches to its exceptions (.code)
+QUOTA_STATUS = {429}
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class LlmUnavailable(Exception):
+    # Quota exhausted or the queue is full; retry_after is a hint for the client
+    def __init__(self, message: str, retry_after: float = 5):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))  # whole seconds, for Retry-After
+
+
+def _status(error: Exception) -> int:
+    try:
+        return int(getattr(error, "code", 0) or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _fingerprint(model: str, contents, options: dict) -> str:
+    # Bytes (audio, images) are hashed rather than serialised
+    def default(value):
+        if isinstance(value, (bytes, bytearray)):
+            return "sha256:" + hashlib.sha256(value).hexdigest()
+        return repr(value)
+    payload = json.dumps([model, contents, options], sort_keys=True, default=default, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, burst: int):
+        self.rate = per_minute / 60
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> float:
+        # 0 if a token was taken, otherwise seconds until one is available
+        if self.rate <= 0:
+            return 0
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def drain(self, seconds: float):
+        # Gemini said 429: stop issuing for a while regardless of our own count
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class LlmGateway:
+    def __init__(self, per_minute: float = LLM_REQUESTS_PER_MINUTE, burst: int = LLM_BURST,
+                 max_concurrent: int = CONCURRENCY_LIMITS["llm"]):
+        self.bucket = TokenBucket(per_minute, burst)
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self._queue = []  # [priority, seq, future]
+        self._sequence = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+        self._loop = None
+        self._pending = {}  # fingerprint -> task of the call being shared
+        self.depth = Counter()  # priority name -> waiting calls
+        self.calls = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.rejected = 0
+
+    # Scheduling
+
+    def _ensure_dispatcher(self):
+        # Created lazily so the event and task bind to the running loop (and
+        # again if the app is started on a new one, as TestClient does)
+        loop = asyncio.get_running_loop()
+        if self._dispatcher is None or self._dispatcher.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue, self.in_flight = [], 0
+            self._wakeup = asyncio.Event()
+            self._dispatcher = loop.create_task(self._dispatch())
+
+    async def _dispatch(self):
+        while True:
+            self._queue = [entry for entry in self._queue if not entry[2].done()]
+            heapq.heapify(self._queue)
+            if not self._queue or self.in_flight >= self.max_concurrent:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            wait = self.bucket.take()
+            if wait:
+                # Sleep until the next token, or until a higher-priority call arrives
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, future = heapq.heappop(self._queue)
+            self.in_flight += 1
+            future.set_result(None)
+
+    async def _acquire(self, priority: str):
+        if len(self._queue) >= LLM_QUEUE_MAX:
+            self.rejected += 1
+            raise LlmUnavailable("Too many AI requests are waiting. Please try again shortly.")
+        self._ensure_dispatcher()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, [PRIORITIES.get(priority, PRIORITIES["chat"]), next(self._sequence), future])
+        self.depth[priority] += 1
+        self._wakeup.set()
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), LLM_QUEUE_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Granted at the last moment: hand the slot back
+                self._release()
+            future.cancel()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.rejected += 1
+            raise LlmUnavailable("The AI quota is exhausted right now. Please try again shortly.")
+        finally:
+            self.depth[priority] -= 1
+            llm_queue_wait.observe(time.perf_counter() - started, priority=priority)
+
+    def _release(self):
+        self.in_flight -= 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _attempts(self, call: str, priority: str, send):
+        # send() starts one request; retried on quota and transient errors
+        for attempt in range(LLM_RETRIES + 1):
+            await self._acquire(priority)
+            try:
+                return await send()
+            except Exception as e:
+                status = _status(e)
+                if status not in RETRY_STATUS:
+                    raise
+                delay = random.uniform(0, LLM_BACKOFF_SECONDS * 2 ** attempt)
+                if status in QUOTA_STATUS:
+                    self.bucket.drain(delay)
+                if attempt == LLM_RETRIES:
+                    if status in QUOTA_STATUS:
+                        self.rejected += 1
+                        raise LlmUnavailable("The AI quota is exhausted right now. Please try again shortly.",
+                                             retry_after=LLM_BACKOFF_SECONDS * 2 ** attempt)
+                    raise
+                self.retries += 1
+                count("llm_retry")
+                print(f"Gemini {call} failed with HTTP {status}; retrying in {delay:.1f}s")
+            finally:
+                self._release()
+            await asyncio.sleep(delay)
+
+    # Calls
+
+    async def generate(self, model: str, contents, call: str, priority: str = "chat", **options):
+        # generate_content_async on the named model; identical concurrent calls share one request
+        key = _fingerprint(model, contents, options) if LLM_COALESCE else None
+        task = self._pending.get(key) if key else None
+        if task is not None:
+            self.coalesced += 1
+            count("llm_coalesced")
+            return await asyncio.shield(task)
+
+        async def send():
+            return await asyncio.wait_for(
+                clients.get_model(model).generate_content_async(contents, **options), LLM_TIMEOUT
+            )
+
+        async def run():
+            self.calls += 1
+            response = await self._attempts(call, priority, send)
+            record_llm_usage(call, response)
+            return response
+
+        task = asyncio.get_running_loop().create_task(run())
+        if key:
+            self._pending[key] = task
+        task.add_done_callback(lambda done: self._finished(key, done))
+        # Shielded: a caller that goes away does not cancel the call for the others
+        return await asyncio.shield(task)
+
+    async def stream(self, model: str, contents, call: str, priority: str = "chat", **options):
+        # Streaming generate_content_async: yields chunks, holding a slot until the
+        # stream ends. Not coalesced; only the initial request is retried.
+        await self._acquire(priority)
+        try:
+            self.calls += 1
+            response = await asyncio.wait_for(
+                clients.get_model(model).generate_content_async(contents, stream=True, **options), LLM_TIMEOUT
+            )
+            iterator = response.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), LLM_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                yield chunk
+            record_llm_usage(call, response)
+        except Exception as e:
+            if _status(e) in QUOTA_STATUS:
+                self.bucket.drain(LLM_BACKOFF_SECONDS)
+                self.rejected += 1
+                raise LlmUnavailable("The AI quota is exhausted right now. Please try again shortly.")
+            raise
+        finally:
+            self._release()
+
+    def _finished(self, key, task):
+        if key and self._pending.get(key) is task:
+            del self._pending[key]
+        # Mark the outcome retrieved even if every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "requests_per_minute": LLM_REQUESTS_PER_MINUTE,
+            "burst": self.bucket.capacity,
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self.in_flight,
+            "queued": {name: self.depth[name] for name in PRIORITIES},
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+            "rejected": self.rejected,
+        }
+
+
+gateway = LlmGateway()
+
+
+@registry.collector
+def _gateway_metrics():
+    stats = gateway.stats()
+    for priority, depth in stats["queued"].items():
+        yield "kirana_llm_queue_depth", "gauge", "Gemini calls waiting for a quota token or slot", {"priority": priority}, depth
+    yield "kirana_llm_in_flight", "gauge", "Gemini calls in progress", {}, stats["in_flight"]
+    yield "kirana_llm_calls_total", "counter", "Gemini requests issued (after coalescing)", {}, stats["calls"]
+    yield "kirana_llm_coalesced_total", "counter", "Gemini calls served by an identical in-flight request", {}, stats["coalesced"]
+    yield "kirana_llm_retries_total", "counter", "Gemini requests retried after a rate-limit or transient error", {}, stats["retries"]
+    yield "kirana_llm_rejected_total", "counter", "Gemini calls refused because the quota or queue was exhausted", {}, stats["rejected"]
@@ -0,0 +1,306 @@
+import os
+import asyncio
+import random
+from datetime import date, datetime, timedelta
+from typing import Optional
+import httpx
+from sqlalchemy import delete, func, select, and_
+from sqlalchemy.orm import Session
+from .. import database
+from .concurrency import HTTP_TIMEOUT
+from .product_index import product_index
+from .metrics import span, count
+
+# Mirrors the data.gov.in "current daily mandi prices" resource into the
+# mandi_prices table. A background task refreshes it every MANDI_REFRESH_SECONDS;
+# requests are served from the table. MANDI_BASE_URL can point at a local fake.
+MANDI_API_KEY = os.getenv("MANDI_API_KEY", "579b464db66ec23bdd000001b54c44682b914aa571845c4bb6d93ff3")
+MANDI_BASE_URL = os.getenv("MANDI_BASE_URL", "https://api.data.gov.in/resource/9ef84268-d588-465a-a308-a864a43d0070")
+MANDI_REFRESH_SECONDS = float(os.getenv("MANDI_REFRESH_SECONDS", "3600"))
+MANDI_PAGE_SIZE = int(os.getenv("MANDI_PAGE_SIZE", "1000"))
+MANDI_MAX_RECORDS = int(os.getenv("MANDI_MAX_RECORDS", "20000"))
+MANDI_RETENTION_DAYS = int(os.getenv("MANDI_RETENTION_DAYS", "30"))
+MANDI_RETRIES = int(os.getenv("MANDI_RETRIES", "3"))
+MANDI_BACKOFF_SECONDS = float(os.getenv("MANDI_BACKOFF_SECONDS", "1"))
+
+BATCH_SIZE = 500
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+mandi_prices = database.MandiPrice.__table__
+
+# Shared pooled client; replaced in tests with one using httpx.MockTransport
+client: Optional[httpx.AsyncClient] = None
+
+refresh_state = {
+    "last_success": None,
+    "last_attempt": None,
+    "last_error": None,
+    "last_count": 0,
+    "mirror_rows": None,  # rows in the table after the last refresh; None until known
+}
+_refresh_lock = None
+
+
+def get_client() -> httpx.AsyncClient:
+    global client
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=2),
+        )
+    return client
+
+
+async def _get_page(offset: int) -> dict:
+    params = {"api-key": MANDI_API_KEY, "format": "json", "limit": MANDI_PAGE_SIZE, "offset": offset}
+    for attempt in range(MANDI_RETRIES + 1):
+        try:
+            response = await get_client().get(MANDI_BASE_URL, params=params)
+            if response.status_code not in RETRY_STATUS:
+                response.raise_for_status()
+                return response.json()
+            error = f"HTTP {response.status_code}"
+        except httpx.TransportError as e:
+            error = f"{type(e).__name__}: {e}"
+        if attempt == MANDI_RETRIES:
+            raise RuntimeError(f"Mandi API failed after {attempt + 1} attempts: {error}")
+        # Exponential backoff with full jitter
+        delay = random.uniform(0, MANDI_BACKOFF_SECONDS * 2 ** attempt)
+        count("mandi_retry")
+        print(f"Mandi API {error}; retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+
+async def fetch_records() -> list:
+    records = []
+    offset = 0
+    while offset < MANDI_MAX_RECORDS:
+        page = (await _get_page(offset)).get("records", [])
+        records.extend(page)
+        if len(page) < MANDI_PAGE_SIZE:
+            break
+        offset += len(page)
+    return records
+
+
+def _price(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _arrival_date(value) -> Optional[date]:
+    # Upstream format is dd/mm/yyyy
+    for fmt in ("%d/%m/%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(str(value), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_record(record: dict) -> Optional[dict]:
+    arrival = _arrival_date(record.get("arrival_date"))
+    if arrival is None or not record.get("commodity"):
+        return None
+    row = {key: (record.get(key) or "").strip() for key in ("state", "district", "market", "commodity", "variety", "grade")}
+    row.update(
+        arrival_date=arrival,
+        min_price=_price(record.get("min_price")),
+        max_price=_price(record.get("max_price")),
+        modal_price=_price(record.get("modal_price")),
+    )
+    return row
+
+
+def _upsert(db: Session):
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(mandi_prices)
+
+
+def store_records(db: Session, records: list) -> int:
+    rows = {}
+    for record in records:
+        row = parse_record(record)
+        if row:
+            key = tuple(row[k] for k in ("state", "district", "market", "commodity", "variety", "grade", "arrival_date"))
+            rows[key] = row
+    rows = list(rows.values())
+    fetched_at = datetime.utcnow()
+    for i in range(0, len(rows), BATCH_SIZE):
+        stmt = _upsert(db).values([{**row, "fetched_at": fetched_at} for row in rows[i:i + BATCH_SIZE]])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[mandi_prices.c.state, mandi_prices.c.district, mandi_prices.c.market,
+                            mandi_prices.c.commodity, mandi_prices.c.variety, mandi_prices.c.grade,
+                            mandi_prices.c.arrival_date],
+            set_={
+                "min_price": stmt.excluded.min_price,
+                "max_price": stmt.excluded.max_price,
+                "modal_price": stmt.excluded.modal_price,
+                "fetched_at": stmt.excluded.fetched_at,
+            }
+        )
+        db.execute(stmt)
+    prune(db)
+    return len(rows)
+
+
+def prune(db: Session):
+    # Drops rows past the retention window, but each market keeps its latest
+    # snapshot however old: a feed that has been stale for weeks still shows
+    # the last known prices rather than nothing
+    cutoff = date.today() - timedelta(days=MANDI_RETENTION_DAYS)
+    newer = mandi_prices.alias("newer")
+    latest = select(func.max(newer.c.arrival_date)).where(and_(
+        newer.c.state == mandi_prices.c.state,
+        newer.c.district == mandi_prices.c.district,
+        newer.c.market == mandi_prices.c.market,
+    )).scalar_subquery()
+    db.execute(delete(mandi_prices).where(mandi_prices.c.arrival_date < cutoff, mandi_prices.c.arrival_date < latest))
+
+
+def _store(records: list) -> int:
+    db = database.SessionLocal()
+    try:
+        count = store_records(db, records)
+        db.commit()
+        refresh_state["mirror_rows"] = _count_rows(db)
+        return count
+    finally:
+        db.close()
+
+
+async def refresh_mandi_prices() -> int:
+    global _refresh_lock
+    if _refresh_lock is None:
+        _refresh_lock = asyncio.Lock()
+    # Concurrent triggers (startup task, empty-mirror request, POST /refresh) share one fetch
+    if _refresh_lock.locked():
+        async with _refresh_lock:
+            return refresh_state["last_count"]
+
+    async with _refresh_lock:
+        refresh_state["last_attempt"] = datetime.utcnow()
+        try:
+            with span("mandi.fetch"):
+                records = await fetch_records()
+            with span("mandi.store"):
+                stored = await asyncio.to_thread(_store, records)
+        except Exception as e:
+            count("mandi_refresh_failed")
+            refresh_state["last_error"] = str(e)
+            print(f"Mandi refresh failed: {e}")
+            raise
+        refresh_state.update(last_success=datetime.utcnow(), last_error=None, last_count=stored)
+        print(f"Mandi mirror refreshed: {stored} records")
+        return stored
+
+
+async def run_refresher():
+    while True:
+        try:
+            await refresh_mandi_prices()
+        except Exception:
+            pass
+        await asyncio.sleep(MANDI_REFRESH_SECONDS)
+
+
+def _count_rows(db: Session) -> int:
+    return db.execute(select(func.count()).select_from(mandi_prices)).scalar()
+
+
+def mirror_size(db: Session) -> int:
+    # Counted once per refresh, not per request; an empty mirror (cheap to count)
+    # is re-checked in case another worker has filled it since
+    if not refresh_state["mirror_rows"]:
+        refresh_state["mirror_rows"] = _count_rows(db)
+    return refresh_state["mirror_rows"]
+
+
+def to_record(row) -> dict:
+    # Same field names and formats as the upstream API, which the app renders directly
+    return {
+        "state": row.state,
+        "district": row.district,
+        "market": row.market,
+        "commodity": row.commodity,
+        "variety": row.variety,
+        "grade": row.grade,
+        "arrival_date": row.arrival_date.strftime("%d/%m/%Y"),
+        "min_price": row.min_price,
+        "max_price": row.max_price,
+        "modal_price": row.modal_price,
+    }
+
+
+def query_prices(db: Session, commodity: str = None, state: str = None, district: str = None,
+                 market: str = None, since: date = None, limit: int = 10, offset: int = 0):
+    stmt = select(database.MandiPrice)
+    if commodity:
+        stmt = stmt.where(func.lower(mandi_prices.c.commodity) == commodity.strip().lower())
+    if state:
+        stmt = stmt.where(func.lower(mandi_prices.c.state) == state.strip().lower())
+    if district:
+        stmt = stmt.where(func.lower(mandi_prices.c.district) == district.strip().lower())
+    if market:
+        stmt = stmt.where(func.lower(mandi_prices.c.market) == market.strip().lower())
+    if since:
+        stmt = stmt.where(mandi_prices.c.arrival_date >= since)
+    total = db.execute(select(func.count()).select_from(stmt.subquery())).scalar()
+    rows = db.execute(
+        stmt.order_by(mandi_prices.c.arrival_date.desc(), mandi_prices.c.id).limit(limit).offset(offset)
+    ).scalars().all()
+    return total, [to_record(row) for row in rows]
+
+
+def compare_with_products(db: Session, state: str = None) -> list:
+    # Latest average modal price per commodity, matched to our products by name.
+    # Mandi prices are per quintal (100 kg); product prices are per unit, so the
+    # margin is only meaningful for products sold by the kg.
+    latest = select(
+        mandi_prices.c.commodity,
+        func.max(mandi_prices.c.arrival_date).label("arrival_date"),
+    ).group_by(mandi_prices.c.commodity)
+    if state:
+        latest = latest.where(func.lower(mandi_prices.c.state) == state.strip().lower())
+    latest = latest.subquery()
+
+    stmt = select(
+        mandi_prices.c.commodity,
+        latest.c.arrival_date,
+        func.avg(mandi_prices.c.modal_price).label("modal_price"),
+        func.count().label("markets"),
+    ).join(
+        latest,
+        (mandi_prices.c.commodity == latest.c.commodity) & (mandi_prices.c.arrival_date == latest.c.arrival_date)
+    ).group_by(mandi_prices.c.commodity, latest.c.arrival_date)
+    if state:
+        stmt = stmt.where(func.lower(mandi_prices.c.state) == state.strip().lower())
+
+    product_index.sync(db)
+    prices = {p.id: p.price for p in db.query(database.Product.id, database.Product.price)}
+    results = []
+    for commodity, arrival_date, modal_price, markets in db.execute(stmt):
+        match = product_index.best_match(commodity)
+        if not match or not match.confident or modal_price is None:
+            continue
+        price = prices.get(match.product_id)
+        mandi_per_kg = round(modal_price / 100, 2)
+        results.append({
+            "product_id": match.product_id,
+            "product_name": match.name,
+            "product_price": price,
+            "commodity": commodity,
+            "match_score": match.score,
+            "arrival_date": arrival_date,
+            "markets": markets,
+            "mandi_modal_price": round(modal_price, 2),
+            "mandi_price_per_kg": mandi_per_kg,
+            "margin_per_kg": round(price - mandi_per_kg, 2) if price is not None else None,
+        })
+    results.sort(key=lambda r: r["product_name"])
+    return results
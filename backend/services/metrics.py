@@ -0,0 +1,203 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Minimal in-process Prometheus metrics (text exposition format 0.0.4), served
+# at GET /metrics. Each series is a few integer/float updates under a lock, so
+# it is cheap enough to leave on. Values are per worker process.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ROW_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 500, 1000, 5000)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 12)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 3000, 4000, 8000, 16000, 32000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labels
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="%s"' % _number(float(bound))
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_labels(self.labelnames, key, le)} {series[-1]}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(round(series[-2], 6))}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {series[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name: str, help_text: str, labels: tuple = ()) -> Counter:
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        # func() -> iterable of (name, kind, help, {label: value}, value); read at scrape
+        # time for state that already lives elsewhere (cache stats, queue depths)
+        self._collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        # Several collectors report the same family (e.g. cache hits per cache);
+        # the exposition format wants each family's samples together
+        families = {}
+        for func in self._collectors:
+            try:
+                samples = list(func())
+            except Exception as e:
+                print(f"Metrics collector {func.__name__} failed: {e}")
+                continue
+            for name, kind, help_text, labels, value in samples:
+                family = families.setdefault(name, (kind, help_text, []))
+                family[2].append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_number(value)}")
+        for name, (kind, help_text, samples) in families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "kirana_http_requests_total", "HTTP requests by route template and status", ("method", "route", "status"))
+http_duration = registry.histogram(
+    "kirana_http_request_duration_seconds", "HTTP request latency (until response headers)", ("method", "route"))
+stage_duration = registry.histogram(
+    "kirana_stage_duration_seconds", "Latency of individual pipeline stages", ("stage",))
+stage_errors = registry.counter(
+    "kirana_stage_errors_total", "Stages that raised", ("stage",))
+events = registry.counter(
+    "kirana_events_total", "Notable outcomes: chat paths, TTS fallbacks, cache results", ("event",))
+llm_tokens = registry.counter(
+    "kirana_llm_tokens_total", "Gemini tokens by call and direction", ("call", "direction"))
+sql_rows = registry.histogram(
+    "kirana_sql_rows_returned", "Rows returned per SELECT issued from chat", (), ROW_BUCKETS)
+sql_statements = registry.histogram(
+    "kirana_sql_statements_per_turn", "Statements executed per chat turn that went to SQL", (), STATEMENT_BUCKETS)
+llm_queue_wait = registry.histogram(
+    "kirana_llm_queue_wait_seconds", "Time Gemini calls waited for a quota token and slot", ("priority",))
+prompt_tokens = registry.histogram(
+    "kirana_prompt_tokens", "Estimated tokens sent per Gemini chat call (prompt plus replayed history)", ("call",), TOKEN_BUCKETS)
+
+
+@contextmanager
+def span(stage: str):
+    # Times the enclosed block into kirana_stage_duration_seconds{stage=...};
+    # works around awaits too, since it only reads the clock on entry and exit
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        stage_duration.observe(time.perf_counter() - started, stage=stage)
+
+
+def observe_stage(stage: str, seconds: float):
+    stage_duration.observe(seconds, stage=stage)
+
+
+def count(event: str, amount: float = 1):
+    events.inc(amount, event=event)
+
+
+def record_llm_usage(call: str, response):
+    # google-generativeai responses carry usage_metadata once complete
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return
+    prompt = getattr(usage, "prompt_token_count", 0) or 0
+    output = getattr(usage, "candidates_token_count", 0) or 0
+    if prompt:
+        llm_tokens.inc(prompt, call=call, direction="prompt")
+    if output:
+        llm_tokens.inc(output, call=call, direction="output")
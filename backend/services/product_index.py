@@ -0,0 +1,206 @@
+import os
+import threading
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Optional
+from sqlalchemy.orm import Session
+from .. import database
+from .data_version import get_catalog_version
+from .intent_parser import tokenize, canonical_token, product_tokens
+
+# In-memory fuzzy index over product names, shared by shelf mapping, bulk/OCR
+# import and the chat fast path. Built once from the DB, updated incrementally
+# on product writes in this process, and rebuilt when the catalog version in
+# the DB shows another worker changed the catalog.
+
+# Scores are in [0, 1]; callers treat matches below their threshold, or too
+# close to the runner-up, as low confidence and flag them instead of applying.
+MATCH_THRESHOLD = float(os.getenv("PRODUCT_MATCH_THRESHOLD", "0.6"))
+AMBIGUITY_MARGIN = float(os.getenv("PRODUCT_MATCH_MARGIN", "0.05"))
+
+COMMON_POSTING_MIN = 50
+COMMON_POSTING_FRACTION = 0.1
+MAX_CANDIDATES = 50
+
+
+@dataclass
+class Match:
+    product_id: int
+    name: str
+    score: float
+    ambiguous: bool = False
+
+    @property
+    def confident(self) -> bool:
+        return self.score >= MATCH_THRESHOLD and not self.ambiguous
+
+
+def _trigrams(tokens) -> set:
+    text = f"  {' '.join(sorted(tokens))} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ProductIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._names = {}
+        self._tokens = {}
+        self._grams = {}
+        self._token_postings = defaultdict(set)
+        self._gram_postings = defaultdict(set)
+        self._version = None
+
+    # --- maintenance -----------------------------------------------------
+
+    def _add(self, product_id: int, name: str):
+        tokens = product_tokens(name)
+        grams = _trigrams(tokens)
+        self._names[product_id] = name
+        self._tokens[product_id] = tokens
+        self._grams[product_id] = grams
+        for token in tokens:
+            self._token_postings[token].add(product_id)
+        for gram in grams:
+            self._gram_postings[gram].add(product_id)
+
+    def _remove(self, product_id: int):
+        for token in self._tokens.pop(product_id, ()):
+            self._token_postings[token].discard(product_id)
+        for gram in self._grams.pop(product_id, ()):
+            self._gram_postings[gram].discard(product_id)
+        self._names.pop(product_id, None)
+
+    def rebuild(self, db: Session):
+        version = get_catalog_version(db)
+        rows = db.query(database.Product.id, database.Product.name).all()
+        with self._lock:
+            self._names.clear()
+            self._tokens.clear()
+            self._grams.clear()
+            self._token_postings.clear()
+            self._gram_postings.clear()
+            for product_id, name in rows:
+                if name:
+                    self._add(product_id, name)
+            self._version = version
+
+    def sync(self, db: Session):
+        # One primary-key lookup; full rebuild only when the catalog changed elsewhere
+        if self._version is None or get_catalog_version(db) != self._version:
+            self.rebuild(db)
+
+    def upsert(self, product_id: int, name: str):
+        with self._lock:
+            self._remove(product_id)
+            if name:
+                self._add(product_id, name)
+
+    def remove(self, product_id: int):
+        with self._lock:
+            self._remove(product_id)
+
+    def advance(self, version: int):
+        # Record that this process applied the write that produced `version`
+        # (from bump_catalog_version). If other writes happened in between we
+        # cannot vouch for the index, so the next sync() rebuilds it.
+        with self._lock:
+            if self._version is not None and version == self._version + 1:
+                self._version = version
+            else:
+                self._version = None
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+
+    # --- lookups ---------------------------------------------------------
+
+    def resolve_tokens(self, words: list):
+        # Strict token match for the chat intent parser. Returns ((id, name), matched
+        # words), or (None, set()) when nothing or more than one product fits equally.
+        with self._lock:
+            candidates = set()
+            for word in words:
+                candidates |= self._token_postings.get(word, set())
+
+            scored = []
+            for product_id in candidates:
+                ptokens = self._tokens[product_id]
+                hits = {w for w in words if w in ptokens}
+                scored.append((len(hits), len(hits) / len(ptokens), product_id, hits))
+            if not scored:
+                return None, set()
+
+            best_hits = max(s[0] for s in scored)
+            top = [s for s in scored if s[0] == best_hits]
+            if len(top) > 1:
+                # Only break ties when the message names one product completely
+                # ("sugar" -> Sugar rather than Brown Sugar); "powder" stays ambiguous.
+                top = [s for s in top if s[1] == 1.0]
+                if len(top) != 1:
+                    return None, set()
+            _, _, product_id, hits = top[0]
+            return (product_id, self._names[product_id]), hits
+
+    def containing(self, words: list, limit: int = 10) -> list:
+        # Ids of products whose names contain any of the words, most words matched first
+        tokens = {canonical_token(w) for w in words}
+        with self._lock:
+            hits = Counter()
+            for token in tokens:
+                hits.update(self._token_postings.get(token, ()))
+        return [product_id for product_id, _ in sorted(hits.items(), key=lambda h: (-h[1], h[0]))[:limit]]
+
+    def _candidates(self, query_tokens: set, query_grams: set) -> list:
+        # Postings shared by a large part of the catalog ("item", " po") act like
+        # stop words: they barely discriminate but would make every lookup score
+        # every product. Use them only when nothing rarer matches.
+        common_limit = max(COMMON_POSTING_MIN, int(len(self._names) * COMMON_POSTING_FRACTION))
+        postings = [self._token_postings.get(t, ()) for t in query_tokens]
+        postings += [self._gram_postings.get(g, ()) for g in query_grams]
+        postings = [p for p in postings if p]
+        rare = [p for p in postings if len(p) <= common_limit]
+        # Only the products sharing the most tokens/trigrams get fully scored
+        overlap = Counter()
+        for posting in rare or postings:
+            overlap.update(posting)
+        return [product_id for product_id, _ in overlap.most_common(MAX_CANDIDATES)]
+
+    def search(self, text: str, limit: int = 5) -> list:
+        query_tokens = {canonical_token(t) for t in tokenize(text)}
+        if not query_tokens:
+            return []
+        query_grams = _trigrams(query_tokens)
+
+        with self._lock:
+            candidates = self._candidates(query_tokens, query_grams)
+            scored = []
+            for product_id in candidates:
+                ptokens = self._tokens[product_id]
+                common = len(query_tokens & ptokens)
+                token_f1 = 2 * common / (len(query_tokens) + len(ptokens))
+                pgrams = self._grams[product_id]
+                dice = 2 * len(query_grams & pgrams) / (len(query_grams) + len(pgrams))
+                match = Match(product_id, self._names[product_id], round(max(token_f1, dice), 3))
+                scored.append((match, common, common == len(ptokens)))
+
+        scored.sort(key=lambda s: (-s[0].score, s[0].product_id))
+        if len(scored) > 1:
+            (best, best_common, best_exact), (runner_up, runner_common, _) = scored[0], scored[1]
+            # "powder" fits Turmeric Powder slightly better than Red Chilli Powder,
+            # but both contain every query word, so neither is a safe pick
+            if best.score - runner_up.score < AMBIGUITY_MARGIN or (
+                best_common and best_common == runner_common and not best_exact
+            ):
+                best.ambiguous = True
+        return [match for match, _, _ in scored[:limit]]
+
+    def best_match(self, text: str) -> Optional[Match]:
+        results = self.search(text, limit=2)
+        return results[0] if results else None
+
+    def __len__(self):
+        return len(self._names)
+
+
+product_index = ProductIndex()
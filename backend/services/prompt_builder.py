@@ -0,0 +1,197 @@
+import csv
+import io
+import os
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Optional
+from .metrics import prompt_tokens
+from .result_renderer import ResultSet
+
+# Keeps what we send to Gemini per chat request within a token budget, however
+# long the conversation or however many rows a query returns:
+#   - query results are sent as CSV (header once, no per-row tuple reprs); sets
+#     over the budget are cut to their first rows plus per-column totals over all
+#     fetched rows, with a note saying so
+#   - the most recent turns are replayed verbatim, older ones are folded into a
+#     short rolling summary placed in front of the new message
+# Token counts are estimates (no tokenizer round trip); usage_metadata on the
+# response still reports the exact figure in kirana_llm_tokens_total.
+PROMPT_TOKEN_BUDGET = int(os.getenv("CHAT_PROMPT_TOKEN_BUDGET", "3000"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1000"))
+HISTORY_RECENT_TURNS = int(os.getenv("CHAT_HISTORY_RECENT_TURNS", "6"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("CHAT_SUMMARY_TOKEN_BUDGET", "200"))
+# Longest single history message replayed verbatim
+MESSAGE_TOKEN_LIMIT = int(os.getenv("CHAT_MESSAGE_TOKEN_LIMIT", "300"))
+
+# Session context (last products and a sample of the last result) in the SQL prompt
+SESSION_NOTES_TOKEN_BUDGET = int(os.getenv("CHAT_SESSION_NOTES_TOKEN_BUDGET", "300"))
+
+# Room kept for the question, instructions and SQL text in the answer prompt
+ANSWER_OVERHEAD_TOKENS = 500
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English/SQL/CSV; Devanagari and Telugu
+    # characters come out close to one token each
+    if not text:
+        return 0
+    other = sum(1 for char in text if ord(char) > 127)
+    return (len(text) - other + 3) // 4 + other
+
+
+def _clip(text: str, tokens: int) -> str:
+    if estimate_tokens(text) <= tokens:
+        return text
+    # Binary search on length, since the characters-per-token ratio varies
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) + 1 <= tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low].rstrip() + "…"
+
+
+def _cell(value):
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else round(value, 2)
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M")
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _csv(columns, rows) -> str:
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    if columns:
+        writer.writerow(columns)
+    writer.writerows([_cell(v) for v in row] for row in rows)
+    return out.getvalue()
+
+
+def _totals(columns, rows) -> str:
+    # sum/min/max of the numeric columns, computed over every fetched row
+    parts = []
+    for index, column in enumerate(columns):
+        values = [row[index] for row in rows if isinstance(row[index], (int, float)) and not isinstance(row[index], bool)]
+        if not values or column.lower() in ("id", "product_id"):
+            continue
+        parts.append(f"{column}: sum {_cell(float(sum(values)))}, min {_cell(float(min(values)))}, max {_cell(float(max(values)))}")
+    return "; ".join(parts)
+
+
+def encode_results(result_sets: list, budget: int) -> str:
+    # Data section of the answer prompt. The budget is split evenly between the
+    # result sets; writes are reported separately by the caller.
+    if not result_sets:
+        return ""
+    share = max(budget // len(result_sets), 50)
+    sections = []
+    for result in result_sets:
+        header = f"Query: {result.query}\n"
+        if not result.rows:
+            sections.append(header + "Result: No data found.\n")
+            continue
+        total = f"at least {len(result.rows)}" if result.truncated else str(len(result.rows))
+        body = _csv(result.columns, result.rows)
+        if estimate_tokens(header + body) <= share and not result.truncated:
+            sections.append(f"{header}Result ({total} rows, CSV):\n{body}")
+            continue
+
+        # Too big: keep as many leading rows as fit next to the totals line
+        totals = _totals(result.columns, result.rows)
+        note = f"Totals over all {len(result.rows)} fetched rows: {totals}\n" if totals else ""
+        room = share - estimate_tokens(header + note) - 30
+        lines = body.splitlines(keepends=True)
+        kept, used = [lines[0]], estimate_tokens(lines[0])
+        for line in lines[1:]:
+            used += estimate_tokens(line)
+            if used > room:
+                break
+            kept.append(line)
+        shown = len(kept) - 1
+        sections.append(
+            f"{header}Result ({total} rows; showing the first {shown}, CSV):\n{''.join(kept)}"
+            f"{note}(Only a sample of the rows is shown; do not list or count rows beyond it.)\n"
+        )
+    return "\n".join(sections)
+
+
+def summarize(messages: list, previous: str = "") -> str:
+    # Extractive rolling summary: one short line per older turn, newest kept
+    # when it runs over its budget. No extra model call.
+    lines = [previous] if previous else []
+    for message in messages:
+        who = "Asked" if message.get("role") == "user" else "Answered"
+        text = " ".join(str(message.get("content") or "").split())
+        lines.append(f"{who}: {_clip(text, 40)}")
+    summary = "\n".join(lines)
+    while estimate_tokens(summary) > SUMMARY_TOKEN_BUDGET and "\n" in summary:
+        summary = summary.split("\n", 1)[1]
+    return _clip(summary, SUMMARY_TOKEN_BUDGET)
+
+
+@dataclass
+class ChatContext:
+    history: list = field(default_factory=list)  # Gemini-format turns replayed verbatim
+    summary: str = ""  # older turns, condensed
+    history_tokens: int = 0  # of the replayed turns; the summary is part of the prompt
+    dropped: int = 0  # messages folded into the summary
+
+
+def build_history(history: list, summary: str = "", budget: int = HISTORY_TOKEN_BUDGET) -> ChatContext:
+    # Newest turns first until the budget or HISTORY_RECENT_TURNS runs out;
+    # the rest go into the summary. `summary` carries an earlier rolling summary.
+    recent, used = [], 0
+    for message in reversed(history[-HISTORY_RECENT_TURNS:] if HISTORY_RECENT_TURNS else []):
+        content = _clip(str(message.get("content") or ""), MESSAGE_TOKEN_LIMIT)
+        cost = estimate_tokens(content) + 4
+        if used + cost > budget:
+            break
+        recent.append({"role": "user" if message.get("role") == "user" else "model", "parts": [content]})
+        used += cost
+    recent.reverse()
+    # Gemini expects the replayed history to start with a user turn
+    while recent and recent[0]["role"] != "user":
+        used -= estimate_tokens(recent[0]["parts"][0]) + 4
+        recent.pop(0)
+
+    older = history[:len(history) - len(recent)]
+    summary = summarize(older, summary) if older else summary
+    return ChatContext(history=recent, summary=summary, history_tokens=used, dropped=len(older))
+
+
+def session_notes(last_products: list, last_result: Optional[dict]) -> str:
+    # What a server-side chat session remembers (services/session_store.py), so
+    # follow-ups can refer to it or be answered from it without a new query
+    notes = ""
+    if last_products:
+        notes += "Products just discussed: " + ", ".join(f"{p['name']} (id {p['id']})" for p in last_products) + "\n"
+    if last_result and last_result.get("rows"):
+        result = ResultSet(query=last_result["query"], columns=last_result["columns"],
+                           rows=last_result["rows"], truncated=last_result.get("truncated", False))
+        notes += "Last result shown to the user:\n" + encode_results([result], SESSION_NOTES_TOKEN_BUDGET)
+    return notes
+
+
+def sql_prompt(message: str, language: str, context: ChatContext, notes: str = "") -> str:
+    prompt = f"User: {message}\nLanguage: {language}\nRespond in {language}.\n"
+    if notes:
+        prompt = notes + "\n" + prompt
+    if context.summary:
+        prompt = f"Earlier in this conversation (summary):\n{context.summary}\n\n" + prompt
+    return prompt
+
+
+def record_prompt(call: str, prompt: str, replayed_tokens: int = 0) -> int:
+    # Estimated tokens sent for one call: the prompt plus the replayed history
+    tokens = estimate_tokens(prompt) + replayed_tokens
+    prompt_tokens.observe(tokens, call=call)
+    return tokens
+
+
+def results_budget(history_tokens: int = 0) -> int:
+    return max(PROMPT_TOKEN_BUDGET - ANSWER_OVERHEAD_TOKENS - history_tokens, 200)
@@ -0,0 +1,111 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from .intent_parser import tokenize, normalize_text
+from .metrics import registry
+
+# Cache of read-only chat answers. Keys include the data version, so any write
+# through /sales, /inventory or chat makes every older entry unreachable.
+CACHE_ENABLED = os.getenv("CHAT_CACHE_ENABLED", "1") == "1"
+CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "512"))
+CACHE_TTL_SECONDS = float(os.getenv("CHAT_CACHE_TTL_SECONDS", "600"))
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": CACHE_ENABLED,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def context_fingerprint(history: list, summary: str = "", products: list = ()) -> str:
+    # What the answer may depend on besides the message: the conversation so far
+    # and the products a session remembers. "" for a fresh conversation, so
+    # first questions from different devices still share entries.
+    if not history and not summary and not products:
+        return ""
+    digest = hashlib.sha256()
+    for message in history:
+        digest.update(f"{message.get('role')}\x00{message.get('content')}\x01".encode("utf-8"))
+    digest.update(summary.encode("utf-8"))
+    digest.update(repr([p.get("id") for p in products]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Characters that only decorate a question; anything else (<, >, =, %, ₹) changes its meaning
+_DECORATION_RE = re.compile(r"[\s?!.,।॥]+")
+
+
+def make_key(message: str, language: str, data_version: int, context: str = "", mode: str = "markdown"):
+    # "Low stock items?" and "low  stock items" share an entry. Messages with
+    # operators or symbols ("price > 50" vs "price < 50"), or in scripts the
+    # tokenizer does not cover, are keyed on the case-folded text instead.
+    # mode keeps spoken plain-text answers apart from markdown ones (tables)
+    tokens = tokenize(message)
+    if tokens and "".join(tokens) == _DECORATION_RE.sub("", normalize_text(message)):
+        normalized = " ".join(tokens)
+    else:
+        normalized = " ".join(message.casefold().split())
+    return (normalized, language or "en", data_version, context, mode)
+
+
+chat_cache = ResponseCache()
+
+
+@registry.collector
+def _chat_cache_metrics():
+    stats = chat_cache.stats()
+    yield "kirana_cache_hits_total", "counter", "Cache hits", {"cache": "chat"}, stats["hits"]
+    yield "kirana_cache_misses_total", "counter", "Cache misses", {"cache": "chat"}, stats["misses"]
+    yield "kirana_cache_entries", "gauge", "Entries currently cached", {"cache": "chat"}, stats["size"]
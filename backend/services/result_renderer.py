@@ -0,0 +1,240 @@
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+# Turns executed SQL results into the final chat reply locally, replacing the
+# second "phrase the answer" Gemini call for the result shapes we know.
+#   auto  - render locally, ask Gemini only when the shape is not recognised
+#   local - always render locally (generic table for unknown shapes)
+#   llm   - always ask Gemini to phrase the answer
+RENDER_MODE = os.getenv("CHAT_RENDER_MODE", "auto").lower()
+
+MAX_TABLE_ROWS = int(os.getenv("CHAT_RENDER_MAX_ROWS", "25"))
+
+SUPPORTED_LANGUAGES = ("en", "hi", "te")
+
+TEMPLATES = {
+    "en": {
+        "stock_query": "{name}: {stock} in stock.",
+        "price_query": "Price of {name} is ₹{price}.",
+        "sale": "Sold {qty} {name}. Remaining stock: {stock}",
+        "sale_recorded": "Sale recorded for {name}. Remaining stock: {stock}",
+        "restock": "Added {qty} {name}. Total stock is now: {stock}",
+        "updated": "Updated {name}. Current stock: {stock}",
+        "insufficient": "Not enough stock of {name}. Only {stock} left.",
+        "not_changed": "Nothing was changed.",
+        "rows_changed": "Done. {count} record(s) updated.",
+        "no_rows": "No matching records found.",
+        "found_rows": "Found {count} result(s):",
+        "truncated": "Showing the first {shown} of {count}.",
+    },
+    "hi": {
+        "stock_query": "{name} का स्टॉक: {stock}",
+        "price_query": "{name} की कीमत ₹{price} है।",
+        "sale": "{qty} {name} बेचा गया। बचा हुआ स्टॉक: {stock}",
+        "sale_recorded": "{name} की बिक्री दर्ज की गई। बचा हुआ स्टॉक: {stock}",
+        "restock": "{qty} {name} जोड़ा गया। कुल स्टॉक अब: {stock}",
+        "updated": "{name} अपडेट किया गया। मौजूदा स्टॉक: {stock}",
+        "insufficient": "{name} का पर्याप्त स्टॉक नहीं है। केवल {stock} बचे हैं।",
+        "not_changed": "कोई बदलाव नहीं किया गया।",
+        "rows_changed": "हो गया। {count} रिकॉर्ड अपडेट किए गए।",
+        "no_rows": "कोई मिलता-जुलता रिकॉर्ड नहीं मिला।",
+        "found_rows": "{count} परिणाम मिले:",
+        "truncated": "{count} में से पहले {shown} दिखाए जा रहे हैं।",
+    },
+    "te": {
+        "stock_query": "{name} స్టాక్: {stock}",
+        "price_query": "{name} ధర ₹{price}.",
+        "sale": "{qty} {name} అమ్మబడింది. మిగిలిన స్టాక్: {stock}",
+        "sale_recorded": "{name} అమ్మకం నమోదు చేయబడింది. మిగిలిన స్టాక్: {stock}",
+        "restock": "{qty} {name} జోడించబడింది. మొత్తం స్టాక్ ఇప్పుడు: {stock}",
+        "updated": "{name} అప్‌డేట్ చేయబడింది. ప్రస్తుత స్టాక్: {stock}",
+        "insufficient": "{name} తగినంత స్టాక్ లేదు. కేవలం {stock} మాత్రమే ఉన్నాయి.",
+        "not_changed": "ఏ మార్పూ చేయబడలేదు.",
+        "rows_changed": "పూర్తయింది. {count} రికార్డులు అప్‌డేట్ చేయబడ్డాయి.",
+        "no_rows": "సరిపోలే రికార్డులు ఏవీ కనుగొనబడలేదు.",
+        "found_rows": "{count} ఫలితాలు కనుగొనబడ్డాయి:",
+        "truncated": "{count}లో మొదటి {shown} చూపిస్తున్నాం.",
+    },
+}
+
+# Column headers for the products/sales columns (and the aliases the model tends to use)
+COLUMN_LABELS = {
+    "en": {
+        "id": "ID", "name": "Product", "product_name": "Product", "category": "Category",
+        "price": "Price", "stock": "Stock", "max_stock": "Max Stock", "shelf_position": "Shelf",
+        "product_id": "Product ID", "quantity": "Quantity", "total_amount": "Amount",
+        "timestamp": "Time", "day": "Day", "units": "Units", "units_sold": "Units Sold",
+        "revenue": "Revenue",
+    },
+    "hi": {
+        "id": "आईडी", "name": "उत्पाद", "product_name": "उत्पाद", "category": "श्रेणी",
+        "price": "कीमत", "stock": "स्टॉक", "max_stock": "अधिकतम स्टॉक", "shelf_position": "शेल्फ",
+        "product_id": "उत्पाद आईडी", "quantity": "मात्रा", "total_amount": "राशि",
+        "timestamp": "समय", "day": "दिन", "units": "इकाइयाँ", "units_sold": "बिकी इकाइयाँ",
+        "revenue": "आय",
+    },
+    "te": {
+        "id": "ఐడి", "name": "ఉత్పత్తి", "product_name": "ఉత్పత్తి", "category": "వర్గం",
+        "price": "ధర", "stock": "స్టాక్", "max_stock": "గరిష్ట స్టాక్", "shelf_position": "షెల్ఫ్",
+        "product_id": "ఉత్పత్తి ఐడి", "quantity": "పరిమాణం", "total_amount": "మొత్తం",
+        "timestamp": "సమయం", "day": "రోజు", "units": "యూనిట్లు", "units_sold": "అమ్మిన యూనిట్లు",
+        "revenue": "ఆదాయం",
+    },
+}
+
+MONEY_COLUMNS = {"price", "total_amount", "revenue"}
+
+_ALIAS_RE = re.compile(r"^[a-z_][a-z0-9_]*$")
+_STOCK_CHANGE_RE = re.compile(r"stock\s*=\s*stock\s*([+-])\s*(\d+)", re.IGNORECASE)
+_SALE_INSERT_RE = re.compile(r"^\s*insert\s+into\s+sales\b", re.IGNORECASE)
+
+
+@dataclass
+class ResultSet:
+    query: str
+    columns: list
+    rows: list = field(default_factory=list)
+    # More rows matched than the SQL engine returns (sql_engine.SQL_MAX_ROWS)
+    truncated: bool = False
+
+
+@dataclass
+class WriteResult:
+    query: str
+    rowcount: int
+
+
+def format_reply(language: str, key: str, **values) -> str:
+    templates = TEMPLATES.get(language, TEMPLATES["en"])
+    return templates[key].format(**{k: _format_value(k, v) for k, v in values.items()})
+
+
+def _format_value(column: str, value) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        if value.is_integer():
+            return str(int(value))
+        return f"{value:.2f}"
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M")
+    if column == "timestamp" and isinstance(value, str):
+        # Raw SQLite timestamps: "2024-05-01 10:15:42.123456"
+        return value[:16]
+    return str(value).replace("|", "/")
+
+
+def _label(column: str, language: str) -> Optional[str]:
+    key = column.lower()
+    labels = COLUMN_LABELS.get(language, COLUMN_LABELS["en"])
+    if key in labels:
+        return labels[key]
+    if _ALIAS_RE.match(key):
+        # Readable alias chosen by the model, e.g. "total_sales"
+        return key.replace("_", " ").title()
+    return None
+
+
+def _markdown_table(result: ResultSet, language: str, force: bool) -> Optional[str]:
+    headers = []
+    for column in result.columns:
+        label = _label(column, language)
+        if label is None:
+            if not force:
+                return None
+            label = column
+        headers.append(label)
+
+    shown = result.rows[:MAX_TABLE_ROWS]
+    lines = [
+        "| " + " | ".join(headers) + " |",
+        "| " + " | ".join("---" for _ in headers) + " |",
+    ]
+    for row in shown:
+        cells = []
+        for column, value in zip(result.columns, row):
+            cell = _format_value(column.lower(), value)
+            cells.append(f"₹{cell}" if column.lower() in MONEY_COLUMNS and value is not None else cell)
+        lines.append("| " + " | ".join(cells) + " |")
+
+    total = f"{len(result.rows)}+" if result.truncated else len(result.rows)
+    parts = [format_reply(language, "found_rows", count=total), "\n".join(lines)]
+    if len(result.rows) > len(shown) or result.truncated:
+        parts.append(format_reply(language, "truncated", shown=len(shown), count=total))
+    return "\n\n".join(parts)
+
+
+def _row_dict(result: ResultSet, row) -> dict:
+    return {column.lower(): value for column, value in zip(result.columns, row)}
+
+
+def _render_confirmation(result_sets: list, writes: list, language: str) -> Optional[str]:
+    # Only claim a change the database actually made
+    if not result_sets:
+        count = sum(max(w.rowcount, 0) for w in writes)
+        return format_reply(language, "rows_changed" if count else "not_changed", count=count)
+
+    last = result_sets[-1]
+    if len(last.rows) != 1:
+        return None
+    row = _row_dict(last, last.rows[0])
+    if "name" not in row or "stock" not in row:
+        return None
+
+    name, stock = row["name"], row["stock"]
+    for write in writes:
+        change = _STOCK_CHANGE_RE.search(write.query)
+        if change:
+            sign, qty = change.groups()
+            if write.rowcount <= 0:
+                # A guarded decrement (... AND stock >= qty) matched nothing
+                if sign == "-" and isinstance(stock, (int, float)) and stock < int(qty):
+                    return format_reply(language, "insufficient", name=name, stock=stock)
+                return format_reply(language, "not_changed")
+            key = "sale" if sign == "-" else "restock"
+            return format_reply(language, key, qty=qty, name=name, stock=stock)
+    if any(_SALE_INSERT_RE.match(w.query) and w.rowcount > 0 for w in writes):
+        return format_reply(language, "sale_recorded", name=name, stock=stock)
+    if not any(w.rowcount > 0 for w in writes):
+        return format_reply(language, "not_changed")
+    return format_reply(language, "updated", name=name, stock=stock)
+
+
+def render_results(result_sets: list, writes: list, language: str = "en", force: bool = False) -> Optional[str]:
+    # Returns the reply text, or None when the result shape should be phrased by the LLM.
+    if language not in SUPPORTED_LANGUAGES:
+        if not force:
+            return None
+        language = "en"
+
+    if writes:
+        reply = _render_confirmation(result_sets, writes, language)
+        if reply is not None or not force:
+            return reply
+
+    if len(result_sets) != 1:
+        if not force or not result_sets:
+            return None
+        # Forced: render each result set in turn
+        tables = [_render_single(r, language, force) for r in result_sets]
+        return "\n\n".join(t for t in tables if t)
+
+    return _render_single(result_sets[0], language, force)
+
+
+def _render_single(result: ResultSet, language: str, force: bool) -> Optional[str]:
+    if not result.rows:
+        return format_reply(language, "no_rows")
+
+    columns = [c.lower() for c in result.columns]
+    if len(result.rows) == 1:
+        row = _row_dict(result, result.rows[0])
+        if set(columns) == {"name", "stock"}:
+            return format_reply(language, "stock_query", name=row["name"], stock=row["stock"])
+        if set(columns) == {"name", "price"}:
+            return format_reply(language, "price_query", name=row["name"], price=row["price"])
+
+    return _markdown_table(result, language, force)
@@ -0,0 +1,122 @@
+from collections import defaultdict
+from datetime import date, datetime
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.orm import Session
+from .. import database
+
+# sales_daily is updated in the same transaction as the sale rows it summarises.
+# Sales are in UTC (Sale.timestamp defaults to utcnow), so days are UTC days.
+
+sales = database.Sale.__table__
+sales_daily = database.SalesDaily.__table__
+
+
+def _day(timestamp):
+    if isinstance(timestamp, datetime):
+        return timestamp.date()
+    if isinstance(timestamp, date):
+        return timestamp
+    # Raw SQLite rows from chat-issued INSERT ... RETURNING: "2024-05-01 10:15:42"
+    return date.fromisoformat(str(timestamp)[:10])
+
+
+def _upsert(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(sales_daily)
+
+
+def apply_sales(db: Session, rows):
+    # rows: Sale objects or mappings with product_id, timestamp, quantity, total_amount.
+    # Call after flush (so ORM defaults like timestamp are set) and before commit.
+    totals = defaultdict(lambda: [0, 0.0])
+    for row in rows:
+        if isinstance(row, database.Sale):
+            product_id, timestamp, quantity, amount = row.product_id, row.timestamp, row.quantity, row.total_amount
+        else:
+            product_id, timestamp, quantity, amount = row["product_id"], row["timestamp"], row["quantity"], row["total_amount"]
+        if timestamp is None or product_id is None:
+            continue
+        key = (product_id, _day(timestamp))
+        totals[key][0] += quantity or 0
+        totals[key][1] += amount or 0.0
+    if not totals:
+        return
+
+    stmt = _upsert(db)
+    stmt = stmt.values([
+        {"product_id": product_id, "day": day, "units": units, "revenue": revenue}
+        for (product_id, day), (units, revenue) in totals.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[sales_daily.c.product_id, sales_daily.c.day],
+        set_={
+            "units": sales_daily.c.units + stmt.excluded.units,
+            "revenue": sales_daily.c.revenue + stmt.excluded.revenue,
+        }
+    )
+    db.execute(stmt)
+
+
+def stamp_sales(db: Session, rows) -> list:
+    # Raw INSERTs (model-generated SQL) skip the Python-side utcnow default and
+    # store NULL, which no date filter or rollup would ever see. rows: mappings
+    # returned by the insert, including id and timestamp.
+    rows = [dict(row) for row in rows]
+    unstamped = [row["id"] for row in rows if row["timestamp"] is None]
+    if unstamped:
+        now = datetime.utcnow()
+        db.execute(update(sales).where(sales.c.id.in_(unstamped)).values(timestamp=now))
+        for row in rows:
+            if row["timestamp"] is None:
+                row["timestamp"] = now
+    return rows
+
+
+def _backfill_sale_timestamps(db: Session) -> int:
+    # Sales stored with a NULL timestamp before stamp_sales existed get the
+    # timestamp of the sale recorded just before them (ids are increasing)
+    earlier = sales.alias("earlier")
+    previous = (
+        select(func.max(earlier.c.timestamp))
+        .where(earlier.c.id < sales.c.id, earlier.c.timestamp.isnot(None))
+        .scalar_subquery()
+    )
+    fixed = db.execute(
+        update(sales).where(sales.c.timestamp.is_(None))
+        .values(timestamp=func.coalesce(previous, datetime.utcnow()))
+    ).rowcount
+    return fixed
+
+
+def rebuild_rollups(db: Session):
+    # Full recompute, used for backfill and after chat-issued UPDATE/DELETE on sales
+    db.execute(delete(sales_daily))
+    day = func.date(sales.c.timestamp)
+    db.execute(insert(sales_daily).from_select(
+        ["product_id", "day", "units", "revenue"],
+        select(sales.c.product_id, day, func.sum(sales.c.quantity), func.sum(sales.c.total_amount))
+        .where(sales.c.timestamp.isnot(None), sales.c.product_id.isnot(None))
+        .group_by(sales.c.product_id, day)
+    ))
+
+
+def backfill_rollups():
+    # Databases created before sales_daily existed start with an empty rollup;
+    # sales saved without a timestamp are stamped and counted in it
+    db = database.SessionLocal()
+    try:
+        has_sales = db.execute(select(sales.c.id).limit(1)).first()
+        has_rollups = db.execute(select(sales_daily.c.day).limit(1)).first()
+        stamped = _backfill_sale_timestamps(db) if has_sales else 0
+        if stamped:
+            print(f"Gave {stamped} sales without a timestamp the time of the previous sale")
+        if has_sales and (stamped or not has_rollups):
+            print("Backfilling daily sales rollups...")
+            rebuild_rollups(db)
+        db.commit()
+    finally:
+        db.close()
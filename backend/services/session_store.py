@@ -0,0 +1,253 @@
+import os
+import json
+import asyncio
+import time
+import secrets
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from typing import Optional
+from .metrics import registry
+from .prompt_builder import summarize
+
+# Server-side chat sessions, so clients send a session_id instead of the whole
+# history and text and voice turns share one conversation. Each session keeps
+# the recent turns (older ones folded into a rolling summary), the products the
+# last answers were about and a small sample of the last query result, which
+# follow-ups like "and its price?" resolve against.
+#
+# Sessions live in an in-process LRU (CHAT_SESSION_MAX sessions, each bounded by
+# the history and result caps below) and expire after CHAT_SESSION_TTL_SECONDS
+# idle. With CHAT_SESSION_DB set they are also written through to that SQLite
+# file, so they survive restarts and are shared by workers on one host: every
+# lookup checks the table and reloads the session when another worker saved a
+# newer copy. (Two turns of one session running at the same moment on two
+# workers still end with the later save.) The *_async methods used by request
+# handlers run that sqlite3 I/O on a worker thread, not on the event loop.
+SESSION_TTL_SECONDS = float(os.getenv("CHAT_SESSION_TTL_SECONDS", "1800"))
+SESSION_MAX = int(os.getenv("CHAT_SESSION_MAX", "1000"))
+SESSION_DB = os.getenv("CHAT_SESSION_DB", "")
+SESSION_MAX_HISTORY = int(os.getenv("CHAT_SESSION_MAX_HISTORY", "20"))
+SESSION_RESULT_ROWS = int(os.getenv("CHAT_SESSION_RESULT_ROWS", "20"))
+SESSION_LAST_PRODUCTS = 5
+
+
+@dataclass
+class ChatSession:
+    id: str
+    language: str = "en"
+    history: list = field(default_factory=list)  # [{"role", "content"}], oldest first
+    summary: str = ""  # turns that no longer fit in history
+    last_products: list = field(default_factory=list)  # [{"id", "name"}], most recent first
+    last_result: Optional[dict] = None  # {"query", "columns", "rows", "truncated"}
+    updated_at: float = field(default_factory=time.time)
+
+    def add_turn(self, user_message: str, response: str):
+        self.history.extend([
+            {"role": "user", "content": user_message},
+            {"role": "model", "content": response or ""},
+        ])
+        self.trim()
+
+    def trim(self):
+        overflow = len(self.history) - SESSION_MAX_HISTORY
+        if overflow > 0:
+            self.summary = summarize(self.history[:overflow], self.summary)
+            del self.history[:overflow]
+
+    def remember_products(self, products: list):
+        # products: [(id, name)], most relevant first
+        seen = {product_id for product_id, _ in products}
+        self.last_products = [{"id": product_id, "name": name} for product_id, name in products] + [
+            p for p in self.last_products if p["id"] not in seen
+        ]
+        del self.last_products[SESSION_LAST_PRODUCTS:]
+
+    def remember_result(self, result):
+        # result: result_renderer.ResultSet
+        self.last_result = {
+            "query": result.query,
+            "columns": list(result.columns),
+            "rows": [list(row) for row in result.rows[:SESSION_RESULT_ROWS]],
+            "truncated": result.truncated or len(result.rows) > SESSION_RESULT_ROWS,
+        }
+
+    @property
+    def last_product(self):
+        return (self.last_products[0]["id"], self.last_products[0]["name"]) if self.last_products else None
+
+
+class SessionStore:
+    def __init__(self, max_sessions: int = SESSION_MAX, ttl: float = SESSION_TTL_SECONDS, path: str = SESSION_DB):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.path = path
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.created = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.restored = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened on first use so importing this module never touches the disk
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("PRAGMA busy_timeout=5000")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS chat_sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_chat_sessions_updated_at ON chat_sessions (updated_at)")
+        return self._db
+
+    def _expired(self, session: ChatSession, now: float) -> bool:
+        return session.updated_at + self.ttl < now
+
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if self.path:
+                row = self._connection().execute(
+                    "SELECT data, updated_at FROM chat_sessions WHERE id = ?", (session_id,)
+                ).fetchone()
+                if row and (session is None or row[1] > session.updated_at):
+                    # Not in memory, or another worker saved a later turn
+                    session = ChatSession(**json.loads(row[0]))
+                    self.restored += 1
+                    self._put(session)
+                elif row is None and session is not None:
+                    # Ended (DELETE /chat/sessions/...) or swept by another worker
+                    self._sessions.pop(session_id, None)
+                    return None
+            if session is None:
+                return None
+            if self._expired(session, now):
+                self._delete(session_id)
+                self.expirations += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def create(self, language: str = "en", history: list = None) -> ChatSession:
+        session = ChatSession(id=secrets.token_urlsafe(16), language=language or "en")
+        for message in history or []:
+            session.history.append({"role": message.get("role"), "content": message.get("content")})
+        session.trim()
+        with self._lock:
+            self.created += 1
+            self._put(session)
+            self._write(session.id, _dump(session), session.updated_at)
+        return session
+
+    def get_or_create(self, session_id: Optional[str], language: str = "en", history: list = None) -> ChatSession:
+        # Unknown or expired ids start a new session (with a new id); a client
+        # that still sends history seeds it from that
+        session = self.get(session_id) if session_id else None
+        return session or self.create(language, history)
+
+    def save(self, session: ChatSession):
+        session.updated_at = time.time()
+        self._save(session, _dump(session))
+
+    async def get_or_create_async(self, session_id: Optional[str], language: str = "en", history: list = None) -> ChatSession:
+        return await self._off_loop(self.get_or_create, session_id, language, history)
+
+    async def create_async(self, language: str = "en", history: list = None) -> ChatSession:
+        return await self._off_loop(self.create, language, history)
+
+    async def save_async(self, session: ChatSession):
+        session.updated_at = time.time()
+        # Serialised on the loop, so a turn in progress cannot change it mid-write
+        await self._off_loop(self._save, session, _dump(session))
+
+    async def _off_loop(self, method, *args):
+        if not self.path:
+            return method(*args)  # memory only: nothing to wait for
+        return await asyncio.to_thread(method, *args)
+
+    def _save(self, session: ChatSession, data: str):
+        with self._lock:
+            self._put(session)
+            self._write(session.id, data, session.updated_at)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._delete(session_id)
+
+    def sweep(self) -> int:
+        # Drops idle sessions from memory and the backing table
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, session in self._sessions.items() if self._expired(session, now)]
+            for session_id in expired:
+                self._sessions.pop(session_id, None)
+            if self.path:
+                self._connection().execute("DELETE FROM chat_sessions WHERE updated_at < ?", (now - self.ttl,))
+            self.expirations += len(expired)
+        return len(expired)
+
+    def _write(self, session_id: str, data: str, updated_at: float):
+        if self.path:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO chat_sessions (id, data, updated_at) VALUES (?, ?, ?)",
+                (session_id, data, updated_at)
+            )
+
+    def _put(self, session: ChatSession):
+        self._sessions[session.id] = session
+        self._sessions.move_to_end(session.id)
+        while len(self._sessions) > self.max_sessions:
+            # Least recently used; still in the backing table if there is one
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    def _delete(self, session_id: str) -> bool:
+        found = self._sessions.pop(session_id, None) is not None
+        if self.path:
+            found = self._connection().execute("DELETE FROM chat_sessions WHERE id = ?", (session_id,)).rowcount > 0 or found
+        return found
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl,
+                "persistent": bool(self.path),
+                "created": self.created,
+                "restored": self.restored,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+            }
+
+
+def _dump(session: ChatSession) -> str:
+    return json.dumps(asdict(session), ensure_ascii=False, default=str)
+
+
+session_store = SessionStore()
+
+
+async def run_sweeper():
+    # Idle sessions are also dropped lazily on lookup; this bounds what never gets looked up again
+    interval = max(min(SESSION_TTL_SECONDS / 2, 300), 1)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(session_store.sweep)
+        except Exception as e:
+            print(f"Chat session sweep failed: {e}")
+
+
+@registry.collector
+def _session_metrics():
+    stats = session_store.stats()
+    yield "kirana_chat_sessions", "gauge", "Chat sessions held in memory", {}, stats["sessions"]
+    yield "kirana_chat_sessions_created_total", "counter", "Chat sessions started", {}, stats["created"]
+    yield "kirana_chat_sessions_expired_total", "counter", "Chat sessions dropped after idling", {}, stats["expirations"]
+    yield "kirana_chat_sessions_evicted_total", "counter", "Chat sessions evicted by the memory cap", {}, stats["evictions"]
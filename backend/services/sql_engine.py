@@ -0,0 +1,487 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Optional
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from .. import database
+from .metrics import registry, count
+
+# Guarded execution of model-generated SQL. Each statement is tokenized and
+# checked against an allow-list of tables, columns and functions, and its
+# literals are lifted into bind parameters, so "... LIKE '%rice%'" and
+# "... LIKE '%dal%'" share one template: validation is cached per template and
+# the driver reuses the prepared statement. Reads are capped at SQL_MAX_ROWS and
+# fetched lazily (a SELECT over all of sales never materialises); writes must be
+# targeted and may touch at most SQL_MAX_WRITE_ROWS rows; every statement gets
+# SQL_TIMEOUT_SECONDS.
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "200"))
+SQL_MAX_WRITE_ROWS = int(os.getenv("SQL_MAX_WRITE_ROWS", "100"))
+SQL_TIMEOUT_SECONDS = float(os.getenv("SQL_TIMEOUT_SECONDS", "5"))
+SQL_TEMPLATE_CACHE_SIZE = int(os.getenv("SQL_TEMPLATE_CACHE_SIZE", "512"))
+
+READABLE_TABLES = ("products", "sales", "sales_daily")
+WRITABLE_TABLES = ("products", "sales")
+TABLE_COLUMNS = {
+    name: {column.name for column in database.Base.metadata.tables[name].columns} | {"rowid"}
+    for name in READABLE_TABLES
+}
+
+FUNCTIONS = {
+    "count", "sum", "avg", "min", "max", "total", "group_concat", "string_agg",
+    "coalesce", "ifnull", "nullif", "iif", "abs", "round", "lower", "upper", "length",
+    "trim", "ltrim", "rtrim", "substr", "substring", "replace", "instr", "printf", "format",
+    "date", "time", "datetime", "julianday", "strftime", "unixepoch", "date_trunc", "now",
+    "typeof", "concat", "row_number", "rank", "dense_rank", "lag", "lead", "ntile",
+    "first_value", "last_value", "percent_rank", "cume_dist",
+}
+
+KEYWORDS = {
+    "select", "distinct", "all", "from", "where", "group", "by", "having", "order", "asc", "desc",
+    "limit", "offset", "join", "inner", "left", "right", "full", "outer", "cross", "natural", "on",
+    "using", "as", "and", "or", "not", "in", "is", "null", "like", "glob", "escape", "between",
+    "exists", "case", "when", "then", "else", "end", "union", "intersect", "except", "with",
+    "recursive", "insert", "into", "values", "default", "update", "set", "delete", "returning",
+    "cast", "collate", "nocase", "integer", "int", "real", "text", "numeric", "date", "true", "false",
+    "current_date", "current_time", "current_timestamp", "filter", "over", "partition", "rows",
+    "range", "preceding", "following", "unbounded", "current", "row", "nulls", "first", "last",
+    "interval", "ilike", "conflict", "do", "nothing", "ignore", "abort", "fail", "isnull", "notnull",
+}
+
+# Never allowed, whatever the position
+FORBIDDEN = {
+    "attach", "detach", "pragma", "drop", "alter", "create", "vacuum", "reindex", "analyze",
+    "savepoint", "release", "rollback", "trigger", "grant", "revoke", "truncate", "copy",
+}
+
+# The whole batch runs in one transaction, so these are dropped rather than rejected
+TRANSACTION_CONTROL = {"begin", "commit", "end"}
+
+_CLAUSES = {"select", "from", "join", "where", "group", "order", "having", "limit", "offset",
+            "on", "using", "set", "values", "returning", "union", "intersect", "except"}
+
+_TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<quoted>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+  | (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<param>[?:@$][A-Za-z0-9_]*)
+  | (?P<op>\|\||<=|>=|<>|!=|==|<<|>>|[-+*/%=<>(),.;&|~])
+""", re.VERBOSE | re.DOTALL)
+
+
+# "WHERE id = :p0", "p.id IN (:p0, :p1)", "product_id = :p2" in a lifted template
+_ID_FILTER_RE = re.compile(r"\b(?:\w+\.)?(?:id|product_id) (?:= :p\d+|IN \(:p\d+)")
+
+
+class SqlRejected(ValueError):
+    pass
+
+
+class SqlTimeout(Exception):
+    pass
+
+
+@dataclass
+class Token:
+    kind: str  # word, ident, string, number, param, op
+    value: str  # lowercased for words, unquoted for identifiers and strings
+    text: str = ""  # as written
+
+
+@dataclass
+class Statement:
+    raw: str
+    template: str
+    params: dict = field(default_factory=dict)
+    kind: str = "read"  # read | write
+    table: Optional[str] = None  # target table of a write
+
+    @property
+    def readonly(self) -> bool:
+        return self.kind == "read"
+
+    @property
+    def like_scan(self) -> bool:
+        # LIKE '%...%' cannot use an index, so it reads every row of the table
+        return " LIKE " in self.template
+
+    @property
+    def by_id(self) -> bool:
+        return _ID_FILTER_RE.search(self.template) is not None
+
+
+def tokenize(sql: str) -> list:
+    tokens = []
+    pos = 0
+    while pos < len(sql):
+        match = _TOKEN_RE.match(sql, pos)
+        if not match:
+            raise SqlRejected(f"Unexpected character {sql[pos]!r}")
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group()
+        if kind in ("space", "comment"):
+            continue
+        if kind == "string":
+            value = value[1:-1].replace("''", "'")
+        elif kind == "quoted":
+            kind, value = "ident", value[1:-1].lower()
+        elif kind == "word":
+            value = value.lower()
+        tokens.append(Token(kind, value, match.group()))
+    return tokens
+
+
+def _split(tokens: list) -> list:
+    statements, current = [], []
+    for token in tokens:
+        if token.kind == "op" and token.value == ";":
+            if current:
+                statements.append(current)
+            current = []
+        else:
+            current.append(token)
+    if current:
+        statements.append(current)
+    return statements
+
+
+def _is_name(token: Optional[Token]) -> bool:
+    return token is not None and (token.kind == "ident" or (token.kind == "word" and token.value not in KEYWORDS))
+
+
+def _is_op(token: Optional[Token], value: str) -> bool:
+    return token is not None and token.kind == "op" and token.value == value
+
+
+def _is_word(token: Optional[Token], *values) -> bool:
+    return token is not None and token.kind == "word" and token.value in values
+
+
+def _lift(tokens: list):
+    # Template text with literals replaced by :pN, plus the bound values.
+    # Numbers in ORDER BY / GROUP BY stay inline: there they are column positions.
+    parts, params = [], {}
+    clause_stack = [None]
+    for i, token in enumerate(tokens):
+        previous = tokens[i - 1] if i else None
+        if _is_op(token, "("):
+            clause_stack.append(None)
+        elif _is_op(token, ")") and len(clause_stack) > 1:
+            clause_stack.pop()
+        elif token.kind == "word" and token.value in _CLAUSES:
+            clause_stack[-1] = token.value
+
+        if token.kind == "string":
+            name = f"p{len(params)}"
+            params[name] = token.value
+            piece = f":{name}"
+        elif token.kind == "number":
+            positional = clause_stack[-1] in ("group", "order") and (
+                _is_word(previous, "by") or _is_op(previous, ","))
+            if positional:
+                piece = token.value
+            else:
+                name = f"p{len(params)}"
+                params[name] = int(token.value, 0) if re.fullmatch(r"\d+|0[xX][0-9a-fA-F]+", token.value) else float(token.value)
+                piece = f":{name}"
+        elif token.kind == "ident":
+            piece = '"' + token.value.replace('"', '""') + '"'
+        elif token.kind == "word":
+            piece = token.value.upper() if token.value in KEYWORDS else token.value
+        else:
+            piece = token.value
+
+        # "sum(" not "sum (", but "IN (" and "AS ("
+        call = piece == "(" and (_is_name(previous) or _is_word(previous, *FUNCTIONS))
+        if parts and not (call or piece in (",", ")", ".") or parts[-1] in ("(", ".")):
+            parts.append(" ")
+        parts.append(piece)
+    return "".join(parts), params
+
+
+def _validate(tokens: list) -> tuple:
+    # Returns (kind, write target). Raises SqlRejected with a reason the logs can show.
+    first = tokens[0]
+    if not _is_word(first, "select", "with", "insert", "update", "delete"):
+        raise SqlRejected("Only SELECT, INSERT, UPDATE and DELETE statements are allowed")
+    for token in tokens:
+        if token.kind == "param":
+            raise SqlRejected("Placeholders are not allowed")
+        if token.kind == "word" and token.value in FORBIDDEN:
+            raise SqlRejected(f"{token.value.upper()} is not allowed")
+
+    kind, target = "read", None
+    if any(_is_word(t, "insert", "update", "delete") for t in tokens):
+        kind = "write"
+        if first.value not in ("insert", "update", "delete"):
+            raise SqlRejected("Writes must start with INSERT, UPDATE or DELETE")
+        i = 1
+        if _is_word(tokens[i] if i < len(tokens) else None, "or"):
+            i += 2
+        if _is_word(tokens[i] if i < len(tokens) else None, "into", "from"):
+            i += 1
+        target = tokens[i].value if i < len(tokens) and _is_name(tokens[i]) else None
+        if target not in WRITABLE_TABLES:
+            raise SqlRejected(f"Writes are only allowed on {', '.join(WRITABLE_TABLES)}")
+        if first.value in ("update", "delete") and not _top_level_word(tokens, "where"):
+            raise SqlRejected(f"{first.value.upper()} without a WHERE clause is not allowed")
+
+    # Pass 1: table references, their aliases, CTE names and output aliases.
+    # Only real tables and CTEs may appear where a table is read; an output
+    # alias ("SELECT 1 sqlite_master") is only ever a column
+    ctes = set()  # WITH name AS (...)
+    subqueries = set()  # FROM (...) name: valid as a qualifier
+    outputs = set()  # SUM(units) AS total: valid as a column
+    aliases = {}  # alias -> table
+    referenced = set()
+    definitions = set()  # token positions that define a name rather than use one
+    for i in range(len(tokens) - 2):
+        if _is_name(tokens[i]) and _is_word(tokens[i + 1], "as") and _is_op(tokens[i + 2], "("):
+            ctes.add(tokens[i].value)
+            definitions.add(i)
+
+    clause_stack = [None]
+    for i, token in enumerate(tokens):
+        previous = tokens[i - 1] if i else None
+        following = tokens[i + 1] if i + 1 < len(tokens) else None
+        if _is_op(token, "("):
+            clause_stack.append(None)
+            continue
+        if _is_op(token, ")"):
+            if len(clause_stack) > 1:
+                clause_stack.pop()
+            continue
+        if token.kind == "word" and token.value in _CLAUSES | {"into", "update"}:
+            clause_stack[-1] = "from" if token.value in ("join", "into", "update") else token.value
+            continue
+        if not _is_name(token) or _is_op(following, "."):
+            continue
+
+        table_position = _is_word(previous, "from", "join", "into", "update") or (
+            clause_stack[-1] == "from" and _is_op(previous, ","))
+        if _is_op(following, "(") and not table_position:
+            continue
+        if table_position:
+            if token.value not in READABLE_TABLES and token.value not in ctes:
+                raise SqlRejected(f"Unknown table {token.value}")
+            referenced.add(token.value)
+            definitions.add(i)
+            # FROM products p / FROM products AS p
+            alias_at = i + 2 if _is_word(following, "as") else i + 1
+            if alias_at < len(tokens) and _is_name(tokens[alias_at]):
+                aliases[tokens[alias_at].value] = token.value
+                definitions.add(alias_at)
+        elif _is_word(previous, "as") or (
+            previous is not None and (_is_name(previous) or previous.kind in ("string", "number")
+                                      or _is_op(previous, ")") or _is_word(previous, "end"))
+            and not _is_op(tokens[i - 2] if i >= 2 else None, ".")
+            or (_is_name(previous) and _is_op(tokens[i - 2] if i >= 2 else None, "."))
+        ):
+            # Output or derived-table alias: "SUM(units) AS total", "SUM(units) total", ") t"
+            after_subquery = _is_op(tokens[i - 2] if _is_word(previous, "as") else previous, ")")
+            if after_subquery and clause_stack[-1] == "from":
+                subqueries.add(token.value)
+            else:
+                outputs.add(token.value)
+            definitions.add(i)
+
+    names = {name for table in referenced if table in TABLE_COLUMNS for name in TABLE_COLUMNS[table]}
+
+    # Pass 2: every other name must be a known function, qualifier or column
+    for i, token in enumerate(tokens):
+        if not _is_name(token) or i in definitions:
+            continue
+        previous = tokens[i - 1] if i else None
+        following = tokens[i + 1] if i + 1 < len(tokens) else None
+        if _is_op(following, "("):
+            if token.value not in FUNCTIONS:
+                raise SqlRejected(f"Function {token.value} is not allowed")
+        elif _is_op(following, "."):
+            if token.value not in referenced and token.value not in aliases and token.value not in subqueries:
+                raise SqlRejected(f"Unknown table {token.value}")
+        elif _is_op(previous, "."):
+            qualifier = tokens[i - 2].value
+            table = aliases.get(qualifier, qualifier)
+            if table in TABLE_COLUMNS and token.value not in TABLE_COLUMNS[table]:
+                raise SqlRejected(f"Unknown column {qualifier}.{token.value}")
+        elif token.value not in names | outputs | aliases.keys() | subqueries:
+            raise SqlRejected(f"Unknown column {token.value}")
+    return kind, target
+
+
+def _top_level_word(tokens: list, word: str) -> bool:
+    depth = 0
+    for token in tokens:
+        if _is_op(token, "("):
+            depth += 1
+        elif _is_op(token, ")"):
+            depth -= 1
+        elif depth == 0 and _is_word(token, word):
+            return True
+    return False
+
+
+class TemplateCache:
+    # template text -> (kind, target, compiled text() clause); validation does not
+    # depend on literal values, so it is done once per template
+    def __init__(self, max_entries: int = SQL_TEMPLATE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    def get(self, template: str):
+        with self._lock:
+            entry = self._entries.get(template)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(template)
+            self.hits += 1
+            return entry
+
+    def set(self, template: str, entry):
+        with self._lock:
+            self._entries[template] = entry
+            self._entries.move_to_end(template)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clause(self, template: str):
+        # Executable form (reads carry the row cap); evicted entries are rebuilt
+        with self._lock:
+            entry = self._entries.get(template)
+        return entry[2] if entry else text(template)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "rejected": self.rejected,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+template_cache = TemplateCache()
+
+
+@registry.collector
+def _template_cache_metrics():
+    stats = template_cache.stats()
+    yield "kirana_cache_hits_total", "counter", "Cache hits", {"cache": "sql_template"}, stats["hits"]
+    yield "kirana_cache_misses_total", "counter", "Cache misses", {"cache": "sql_template"}, stats["misses"]
+    yield "kirana_cache_entries", "gauge", "Entries currently cached", {"cache": "sql_template"}, stats["size"]
+
+
+def prepare(sql: str) -> list:
+    # Model output -> validated statements. Rejects the whole batch if any statement fails.
+    statements = []
+    for tokens in _split(tokenize(sql)):
+        if len(tokens) <= 2 and _is_word(tokens[0], *TRANSACTION_CONTROL):
+            continue
+        template, params = _lift(tokens)
+        entry = template_cache.get(template)
+        if entry is None:
+            try:
+                kind, target = _validate(tokens)
+            except SqlRejected:
+                template_cache.rejected += 1
+                count("sql_rejected")
+                raise
+            capped = template
+            if kind == "read" and not _top_level_word(tokens, "limit"):
+                capped += " LIMIT :row_cap"
+            entry = (kind, target, text(capped))
+            template_cache.set(template, entry)
+        kind, target, clause = entry
+        statements.append(Statement(raw=_raw(tokens), template=template, params=params, kind=kind, table=target))
+    if not statements:
+        raise SqlRejected("No statement to run")
+    return statements
+
+
+def _raw(tokens: list) -> str:
+    # Statement as written (comments and extra whitespace dropped), for logs and the renderer
+    parts = []
+    for token in tokens:
+        if parts and not (token.text in (",", ")", ".") or parts[-1] in ("(", ".")):
+            parts.append(" ")
+        parts.append(token.text)
+    return "".join(parts)
+
+
+@contextmanager
+def statement_timeout(db: Session, seconds: float = SQL_TIMEOUT_SECONDS):
+    connection = db.connection()
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        connection.execute(text(f"SET LOCAL statement_timeout = {int(seconds * 1000)}"))
+        yield
+        return
+    if dialect != "sqlite":
+        yield
+        return
+    # sqlite3's interrupt() is safe to call from another thread; aiosqlite keeps
+    # the sqlite3 connection on _conn
+    driver = connection.connection.driver_connection
+    raw = getattr(driver, "_conn", driver)
+    timer = threading.Timer(seconds, raw.interrupt)
+    timer.daemon = True
+    timer.start()
+    try:
+        yield
+    except OperationalError as e:
+        if "interrupted" in str(e):
+            count("sql_timeout")
+            raise SqlTimeout(f"Query took longer than {seconds:g}s") from e
+        raise
+    finally:
+        timer.cancel()
+
+
+def execute_read(db: Session, statement: Statement):
+    # (columns, rows, truncated); at most SQL_MAX_ROWS rows are ever fetched
+    clause = template_cache.clause(statement.template)
+    params = dict(statement.params)
+    if ":row_cap" in clause.text:
+        params["row_cap"] = SQL_MAX_ROWS + 1
+    with statement_timeout(db):
+        result = db.execute(clause, params)
+        rows = result.fetchmany(SQL_MAX_ROWS + 1)
+        result.close()
+    truncated = len(rows) > SQL_MAX_ROWS
+    if truncated:
+        count("sql_truncated")
+    return list(result.keys()), rows[:SQL_MAX_ROWS], truncated
+
+
+def execute_write(db: Session, statement: Statement, returning: str = None):
+    # Row count, or the returned rows when `returning` columns are given. The caller
+    # rolls back on SqlRejected (too many rows changed).
+    template = statement.template
+    clause = template_cache.clause(template) if not returning else text(f"{template} RETURNING {returning}")
+    with statement_timeout(db):
+        result = db.execute(clause, statement.params)
+        if returning:
+            rows = result.mappings().all()
+            changed = len(rows)
+        else:
+            changed = result.rowcount
+    if changed > SQL_MAX_WRITE_ROWS:
+        count("sql_write_cap")
+        raise SqlRejected(f"Statement would change {changed} rows (limit {SQL_MAX_WRITE_ROWS})")
+    return rows if returning else changed
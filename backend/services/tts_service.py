@@ -0,0 +1,296 @@
+import os
+import io
+import re
+import json
+import asyncio
+import hashlib
+import tempfile
+import time
+import threading
+from collections import OrderedDict
+from .concurrency import iterate_with_timeout, run_blocking, TTS_TIMEOUT
+from .metrics import registry, span, count, observe_stage
+
+# Shared text-to-speech for /tts and /live: edge-tts with gTTS fallback, behind an
+# on-disk LRU cache keyed by (text, voice). Cache hits are streamed from disk
+# without any synthesis; misses are streamed live and written to the cache.
+
+VOICE_MAP = {
+    'hi': 'hi-IN-SwaraNeural',
+    'te': 'te-IN-ShrutiNeural',
+    'ta': 'ta-IN-PallaviNeural',
+    'kn': 'kn-IN-GaganNeural',
+    'ml': 'ml-IN-SobhanaNeural',
+    'mr': 'mr-IN-AarohiNeural',
+    'gu': 'gu-IN-DhwaniNeural',
+    'bn': 'bn-IN-TanishaaNeural',
+    'pa': 'pa-IN-OjasNeural',
+    'en': 'en-IN-NeerjaNeural'
+}
+DEFAULT_VOICE = 'en-IN-NeerjaNeural'
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "kirana_tts_cache"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+TTS_PREWARM = os.getenv("TTS_PREWARM", "1") == "1"
+# Optional JSON file: {"en": ["phrase", ...], "hi": [...]}
+TTS_PREWARM_FILE = os.getenv("TTS_PREWARM_FILE")
+
+CHUNK_SIZE = 32 * 1024
+
+# Pipelined synthesis: sentences shorter than this are merged with the next one
+# so edge-tts is not called once per "OK."
+MIN_SENTENCE_CHARS = int(os.getenv("TTS_MIN_SENTENCE_CHARS", "20"))
+
+# Sentence end: . ! ? or Devanagari danda followed by whitespace, or a newline.
+# "₹45.50" does not split because the dot is not followed by whitespace.
+_SENTENCE_END_RE = re.compile(r"[.!?।॥]+(?=\s)|\n+")
+
+DEFAULT_PREWARM_PHRASES = {
+    "en": [
+        "I'm having trouble hearing you. Please try again.",
+        "I'm not sure how to help with that.",
+        "Hello! How can I help you today?",
+    ],
+    "hi": [
+        "नमस्ते! मैं आपकी क्या मदद कर सकता हूँ?",
+        "माफ़ कीजिए, मैं समझ नहीं पाया। कृपया फिर से बोलें।",
+    ],
+    "te": [
+        "నమస్కారం! నేను మీకు ఎలా సహాయం చేయగలను?",
+        "క్షమించండి, నాకు అర్థం కాలేదు. దయచేసి మళ్ళీ చెప్పండి.",
+    ],
+}
+
+
+def voice_for(language: str) -> str:
+    return VOICE_MAP.get(language, DEFAULT_VOICE)
+
+
+def cache_key(text: str, voice: str) -> str:
+    return hashlib.sha256(f"{voice}\n{text}".encode("utf-8")).hexdigest()
+
+
+def synthesize_gtts(text: str, language: str) -> bytes:
+    # Blocking: callers must run this through run_blocking
+    from gtts import gTTS  # imported on first fallback, not at startup
+    mp3_fp = io.BytesIO()
+    tts = gTTS(text=text, lang=language, timeout=TTS_TIMEOUT)
+    tts.write_to_fp(mp3_fp)
+    return mp3_fp.getvalue()
+
+
+class AudioCache:
+    def __init__(self, directory: str = TTS_CACHE_DIR, max_bytes: int = TTS_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> size, least recently used first
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.fallbacks = 0
+        self.prewarmed = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def _load(self):
+        # Recover the LRU order from file mtimes (touched on every hit)
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".mp3"):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def lookup(self, key: str):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            path = self._path(key)
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # Evicted by another worker sharing the directory
+                self._total_bytes -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return path
+
+    def store(self, key: str, data: bytes):
+        if not data or len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            while self._total_bytes > self.max_bytes and self._entries:
+                old_key, size = self._entries.popitem(last=False)
+                self._total_bytes -= size
+                self.evictions += 1
+                try:
+                    os.remove(self._path(old_key))
+                except FileNotFoundError:
+                    pass
+
+    def contains(self, key: str) -> bool:
+        return key in self._entries
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "gtts_fallbacks": self.fallbacks,
+                "prewarmed": self.prewarmed,
+            }
+
+
+audio_cache = AudioCache()
+
+
+@registry.collector
+def _tts_cache_metrics():
+    stats = audio_cache.stats()
+    yield "kirana_cache_hits_total", "counter", "Cache hits", {"cache": "tts"}, stats["hits"]
+    yield "kirana_cache_misses_total", "counter", "Cache misses", {"cache": "tts"}, stats["misses"]
+    yield "kirana_cache_entries", "gauge", "Entries currently cached", {"cache": "tts"}, stats["entries"]
+    yield "kirana_cache_bytes", "gauge", "Bytes currently cached", {"cache": "tts"}, stats["bytes"]
+
+
+def _read_cached(key: str):
+    # Blocking (utime + read): run on a worker thread, not the event loop
+    path = audio_cache.lookup(key)
+    if not path:
+        return None
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+async def synthesize_stream(text: str, language: str = "en"):
+    # Async iterator of MP3 bytes for `text`
+    voice = voice_for(language)
+    key = cache_key(text, voice)
+
+    # Cache file I/O runs off the loop, and outside the "tts" cap so hits never
+    # wait behind synthesis
+    audio = await asyncio.to_thread(_read_cached, key)
+    if audio is not None:
+        for start in range(0, len(audio), CHUNK_SIZE):
+            yield audio[start:start + CHUNK_SIZE]
+        return
+
+    print(f"Generating TTS for: '{text}' with voice: {voice}")
+    buffer = bytearray()
+    started = time.perf_counter()
+    try:
+        import edge_tts  # imported on first synthesis, not at startup
+        communicate = edge_tts.Communicate(text, voice)
+        async for chunk in iterate_with_timeout("tts", communicate.stream(), timeout=TTS_TIMEOUT):
+            if chunk["type"] == "audio":
+                if not buffer:
+                    observe_stage("tts.edge_first_byte", time.perf_counter() - started)
+                buffer.extend(chunk["data"])
+                yield chunk["data"]
+    except Exception as e:
+        print(f"EdgeTTS failed: {e}. Falling back to gTTS.")
+        audio_cache.fallbacks += 1
+        count("tts_gtts_fallback")
+        # gTTS audio is not cached so the phrase gets the neural voice once edge-tts recovers
+        with span("tts.gtts"):
+            audio = await run_blocking("tts", synthesize_gtts, text, language, timeout=TTS_TIMEOUT)
+        yield audio
+        return
+
+    observe_stage("tts.edge_total", time.perf_counter() - started)
+    count("tts_edge_success")
+    await asyncio.to_thread(audio_cache.store, key, bytes(buffer))
+
+
+def load_prewarm_phrases() -> dict:
+    if TTS_PREWARM_FILE:
+        with open(TTS_PREWARM_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    return DEFAULT_PREWARM_PHRASES
+
+
+async def prewarm(phrases: dict = None):
+    # Synthesize frequent phrases ahead of time; runs in the background at startup
+    phrases = phrases or load_prewarm_phrases()
+    for language, texts in phrases.items():
+        for text in texts:
+            if audio_cache.contains(cache_key(text, voice_for(language))):
+                continue
+            try:
+                async for _ in synthesize_stream(text, language):
+                    pass
+                audio_cache.prewarmed += 1
+            except Exception as e:
+                print(f"TTS prewarm failed for '{text}': {e}")
+
+
+async def split_sentences(text_chunks, min_chars: int = MIN_SENTENCE_CHARS):
+    # Re-cut an async stream of text pieces at sentence boundaries
+    buffer = ""
+    async for piece in text_chunks:
+        buffer += piece
+        start = 0
+        for end in _SENTENCE_END_RE.finditer(buffer):
+            sentence = buffer[start:end.end()].strip()
+            if len(sentence) >= min_chars:
+                yield sentence
+                start = end.end()
+        buffer = buffer[start:]
+    if buffer.strip():
+        yield buffer.strip()
+
+
+async def synthesize_pipelined(text_chunks, language: str = "en"):
+    # Audio for a streamed answer: sentence N is synthesised while the model is
+    # still generating sentence N+1, so the first audio byte does not wait for
+    # the whole answer.
+    sentences = asyncio.Queue()
+
+    async def produce():
+        try:
+            async for sentence in split_sentences(text_chunks):
+                await sentences.put(sentence)
+        except Exception as e:
+            print(f"Answer stream failed: {e}")
+        finally:
+            await sentences.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            sentence = await sentences.get()
+            if sentence is None:
+                break
+            async for chunk in synthesize_stream(sentence, language):
+                yield chunk
+    finally:
+        producer.cancel()
@@ -0,0 +1,100 @@
+import io
+import struct
+import wave
+import numpy as np
+import pytest
+from backend.services import audio_preprocess
+from backend.services.audio_preprocess import AudioTooLarge, decode_wav, preprocess_audio
+
+
+def make_wav(rate: int, channels: int = 1, speech=(0.5, 1.0), total: float = 2.0, width: int = 2) -> bytes:
+    # A 440 Hz tone between speech[0] and speech[1] seconds, silence elsewhere
+    t = np.arange(int(total * rate)) / rate
+    signal = np.where((t >= speech[0]) & (t < speech[1]), 0.5 * np.sin(2 * np.pi * 440 * t), 0.0)
+    samples = np.repeat(signal[:, None], channels, axis=1)
+    if width == 1:
+        raw = (samples * 127 + 128).astype(np.uint8).tobytes()
+    elif width == 2:
+        raw = (samples * 32767).astype("<i2").tobytes()
+    else:
+        ints = (samples * ((1 << 23) - 1)).astype("<i4")
+        raw = b"".join(int(v).to_bytes(3, "little", signed=True) for v in ints.ravel())
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(width)
+        wav.setframerate(rate)
+        wav.writeframes(raw)
+    return out.getvalue()
+
+
+def float_wav(rate: int = 16000, seconds: float = 0.5) -> bytes:
+    # IEEE float (format tag 3), which the wave module cannot read
+    data = np.zeros(int(rate * seconds), dtype="<f4").tobytes()
+    fmt = struct.pack("<HHIIHH", 3, 1, rate, rate * 4, 4, 32)
+    body = b"WAVE" + b"fmt " + struct.pack("<I", len(fmt)) + fmt + b"data" + struct.pack("<I", len(data)) + data
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+
+@pytest.fixture(autouse=True)
+def wav_output(monkeypatch):
+    # WAV in and out regardless of whether ffmpeg is installed
+    monkeypatch.setattr(audio_preprocess, "FFMPEG", None)
+    monkeypatch.setattr(audio_preprocess, "AUDIO_PREPROCESS", True)
+
+
+@pytest.mark.parametrize("rate", [48000, 44100])
+def test_stereo_clip_is_downmixed_resampled_and_trimmed(rate):
+    clip = preprocess_audio(make_wav(rate, channels=2), "audio/wav")
+
+    assert clip.processed
+    assert clip.mime_type == "audio/wav"
+    assert clip.original_seconds == pytest.approx(2.0, abs=0.01)
+    # 0.5 s of tone plus up to 200 ms of padding on each side
+    assert 0.5 <= clip.processed_seconds <= 0.9 + 0.02
+    assert clip.processed_bytes < clip.original_bytes
+    samples, out_rate = decode_wav(clip.data)
+    assert out_rate == 16000
+    assert samples.shape[1] == 1
+    assert len(samples) / out_rate == pytest.approx(clip.processed_seconds, abs=0.01)
+
+
+@pytest.mark.parametrize("width", [1, 3])
+def test_other_sample_widths_decode(width):
+    samples, rate = decode_wav(make_wav(16000, width=width))
+    assert rate == 16000
+    assert np.abs(samples).max() == pytest.approx(0.5, abs=0.02)
+
+
+def test_silent_clip_is_trimmed_to_nothing():
+    clip = preprocess_audio(make_wav(16000, speech=(0, 0)), "audio/wav")
+    assert clip.processed
+    assert clip.processed_seconds == 0
+
+
+def test_clip_without_silence_is_passed_through():
+    data = make_wav(16000, speech=(0, 2.0))
+    clip = preprocess_audio(data, "audio/wav")
+    assert not clip.processed
+    assert clip.data == data
+
+
+def test_size_limit(monkeypatch):
+    data = make_wav(16000)
+    monkeypatch.setattr(audio_preprocess, "AUDIO_MAX_BYTES", len(data) - 1)
+    with pytest.raises(AudioTooLarge):
+        preprocess_audio(data, "audio/wav")
+
+
+def test_duration_limit(monkeypatch):
+    monkeypatch.setattr(audio_preprocess, "AUDIO_MAX_SECONDS", 1.5)
+    with pytest.raises(AudioTooLarge):
+        preprocess_audio(make_wav(16000, total=2.0), "audio/wav")
+
+
+def test_undecodable_wav_is_passed_through():
+    data = float_wav()
+    clip = preprocess_audio(data, None)
+    assert not clip.processed
+    assert clip.data == data
+    assert clip.mime_type == "audio/wav"
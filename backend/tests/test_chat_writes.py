@@ -0,0 +1,46 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from backend import database
+from backend.services.chat_service import execute_queries
+from backend.services.result_renderer import render_results
+from backend.services.sql_engine import prepare
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    database.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(database.Product(id=1, name="Toor Dal", price=120, stock=50))
+    session.commit()
+    yield session
+    session.close()
+
+
+def checkout(qty: int) -> list:
+    return prepare(
+        f"INSERT INTO sales (product_id, quantity, total_amount) VALUES (1, {qty}, {qty * 120}); "
+        f"UPDATE products SET stock = stock - {qty} WHERE id = 1 AND stock >= {qty}; "
+        "SELECT name, stock FROM products WHERE id = 1"
+    )
+
+
+def test_failed_decrement_rolls_back_the_sale(db):
+    result_sets, writes, changes_made = execute_queries(db, checkout(500))
+
+    assert not changes_made
+    assert all(w.rowcount == 0 for w in writes)
+    assert db.query(database.Sale).count() == 0
+    assert db.get(database.Product, 1).stock == 50
+    assert render_results(result_sets, writes) == "Not enough stock of Toor Dal. Only 50 left."
+
+
+def test_checkout_is_committed(db):
+    result_sets, writes, changes_made = execute_queries(db, checkout(2))
+
+    assert changes_made
+    db.expire_all()
+    assert db.query(database.Sale).count() == 1
+    assert db.get(database.Product, 1).stock == 48
+    assert render_results(result_sets, writes) == "Sold 2 Toor Dal. Remaining stock: 48"
@@ -0,0 +1,59 @@
+import pytest
+from backend.services.intent_parser import parse_intent, STOCK_QUERY, PRICE_QUERY, SALE, RESTOCK
+from backend.services.product_index import ProductIndex
+
+PRODUCTS = {1: "Sona Masoori Rice", 2: "Sugar", 3: "Toor Dal", 4: "Amul Milk"}
+
+
+@pytest.fixture(scope="module")
+def index():
+    index = ProductIndex()
+    for product_id, name in PRODUCTS.items():
+        index.upsert(product_id, name)
+    return index
+
+
+@pytest.mark.parametrize("message, kind, product_id, quantity", [
+    ("rice stock", STOCK_QUERY, 1, None),
+    ("how much sugar left", STOCK_QUERY, 2, None),
+    ("how many toor dal available", STOCK_QUERY, 3, None),
+    ("चावल कितना है", STOCK_QUERY, 1, None),
+    ("చక్కెర ఎంత ఉంది", STOCK_QUERY, 2, None),
+    ("price of sugar", PRICE_QUERY, 2, None),
+    ("how much does rice cost", PRICE_QUERY, 1, None),
+    ("चीनी का दाम", PRICE_QUERY, 2, None),
+    ("పాల ధర", PRICE_QUERY, 4, None),
+    ("sold 2 milk", SALE, 4, 2),
+    ("sell three sugar", SALE, 2, 3),
+    ("2 दूध बेचा", SALE, 4, 2),
+    ("రెండు పాలు అమ్మాను", SALE, 4, 2),
+    ("add 10 sugar", RESTOCK, 2, 10),
+    ("received 5 bags toor dal", RESTOCK, 3, 5),
+    ("10 चीनी जोड़ो", RESTOCK, 2, 10),
+])
+def test_counter_intents(index, message, kind, product_id, quantity):
+    intent = parse_intent(message, index)
+    assert intent is not None
+    assert (intent.kind, intent.product_id, intent.quantity) == (kind, product_id, quantity)
+
+
+@pytest.mark.parametrize("message", [
+    "how much is rice",  # stock or price?
+    "how much sugar",
+    "how many sugar sold today",  # analytics, not a sale
+    "how much milk added",
+    "kitna sugar becha",
+    "sold 2 sugar and 3 milk",
+    "price of sugar last week",
+    "sold 0 milk",
+    "stock of ghee",  # unknown product
+    "its price",  # no earlier product
+    "rice stock 5",
+])
+def test_ambiguous_messages_go_to_the_llm(index, message):
+    assert parse_intent(message, index) is None
+
+
+def test_follow_up_uses_last_product(index):
+    intent = parse_intent("and its price?", index, last_product=(3, "Toor Dal"))
+    assert (intent.kind, intent.product_id) == (PRICE_QUERY, 3)
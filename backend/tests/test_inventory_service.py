@@ -0,0 +1,46 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from backend import database, models
+from backend.services.inventory_service import upsert_products
+from backend.services.product_index import product_index
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    database.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(database.Product(name="Toor Dal", category="Grains", price=120, stock=50))
+    session.commit()
+    product_index.rebuild(session)
+    yield session
+    session.close()
+    product_index.invalidate()
+
+
+def items(*names) -> list:
+    return [models.ProductCreate(name=name, category="Grains", price=40, stock=5) for name in names]
+
+
+def test_rolled_back_products_never_reach_the_index(db):
+    upsert_products(db, items("Moong Dal", "Toor Dal"))
+    db.rollback()
+
+    assert len(product_index) == 1
+    product_index.sync(db)
+    assert len(product_index) == 1
+    assert db.get(database.Product, 1).stock == 50
+
+
+def test_committed_products_are_indexed_without_a_rebuild(db):
+    result = upsert_products(db, items("Moong Dal", "Toor Dal"))
+    db.commit()
+
+    moong = next(p for p in result if p.name == "Moong Dal")
+    assert product_index.best_match("moong dal").product_id == moong.id
+    assert {p.stock for p in result} == {5, 55}
+    # advance() kept the index current, so sync() has nothing to rebuild
+    version = product_index._version
+    product_index.sync(db)
+    assert product_index._version == version is not None
@@ -0,0 +1,49 @@
+from datetime import date, timedelta
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from backend import database
+from backend.services import mandi_service
+from backend.services.mandi_service import mandi_prices, store_records
+
+
+@pytest.fixture
+def db(monkeypatch):
+    engine = create_engine("sqlite://")
+    database.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    monkeypatch.setattr(mandi_service, "MANDI_RETENTION_DAYS", 30)
+    yield session
+    session.close()
+
+
+def record(market: str, days_ago: int, commodity: str = "Onion") -> dict:
+    arrival = date.today() - timedelta(days=days_ago)
+    return {"state": "Karnataka", "district": "Bangalore", "market": market, "commodity": commodity,
+            "variety": "Local", "grade": "FAQ", "arrival_date": arrival.strftime("%d/%m/%Y"), "modal_price": "2000"}
+
+
+def stored(db) -> set:
+    return {(row.market, row.commodity, (date.today() - row.arrival_date).days)
+            for row in db.execute(select(mandi_prices))}
+
+
+def test_old_rows_are_pruned(db):
+    store_records(db, [record("Binny Mill", 1), record("Binny Mill", 40), record("Binny Mill", 60)])
+    assert stored(db) == {("Binny Mill", "Onion", 1)}
+
+
+def test_stale_market_keeps_its_latest_snapshot(db):
+    # Upstream stopped updating this market 45 days ago
+    store_records(db, [record("Yeshwanthpur", 45), record("Yeshwanthpur", 45, "Tomato"), record("Yeshwanthpur", 50)])
+    store_records(db, [record("Binny Mill", 1)])
+    assert stored(db) == {("Yeshwanthpur", "Onion", 45), ("Yeshwanthpur", "Tomato", 45), ("Binny Mill", "Onion", 1)}
+
+
+def test_mirror_size_is_counted_once_per_refresh(db, monkeypatch):
+    monkeypatch.setitem(mandi_service.refresh_state, "mirror_rows", None)
+    assert mandi_service.mirror_size(db) == 0
+    store_records(db, [record("Binny Mill", 1)])
+    assert mandi_service.mirror_size(db) == 1  # empty mirrors are re-checked
+    store_records(db, [record("Yeshwanthpur", 1)])
+    assert mandi_service.mirror_size(db) == 1  # cached until the next refresh
@@ -0,0 +1,29 @@
+import pytest
+from backend.services.response_cache import make_key
+
+
+@pytest.mark.parametrize("first, second", [
+    ("Low stock items?", "low  stock items"),
+    ("What is the price of rice", "what is the price of RICE?"),
+    ("चावल कितना है?", "चावल  कितना है"),
+])
+def test_wording_variants_share_a_key(first, second):
+    assert make_key(first, "en", 1) == make_key(second, "en", 1)
+
+
+@pytest.mark.parametrize("first, second", [
+    ("products with price > 50", "products with price < 50"),
+    ("stock >= 10", "stock = 10"),
+    ("sales up 10%", "sales up 10"),
+    ("அரிசி விலை", "பருப்பு விலை"),
+])
+def test_different_questions_get_different_keys(first, second):
+    assert make_key(first, "en", 1) != make_key(second, "en", 1)
+
+
+def test_key_includes_version_language_context_and_mode():
+    base = make_key("low stock", "en", 1)
+    assert base != make_key("low stock", "en", 2)
+    assert base != make_key("low stock", "hi", 1)
+    assert base != make_key("low stock", "en", 1, "conversation")
+    assert base != make_key("low stock", "en", 1, mode="spoken")
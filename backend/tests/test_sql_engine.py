@@ -0,0 +1,105 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from backend import database
+from backend.services import sql_engine
+from backend.services.sql_engine import SqlRejected, prepare
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT name, stock FROM products WHERE name LIKE '%rice%'",
+    "SELECT name, stock FROM products WHERE id IN (1, 2, 3)",
+    "SELECT p.name, SUM(s.quantity) AS sold FROM sales s JOIN products p ON p.id = s.product_id "
+    "GROUP BY p.name ORDER BY sold DESC LIMIT 5",
+    "SELECT SUM(units) units_sold, SUM(revenue) AS revenue FROM sales_daily WHERE day >= date('now', '-7 day')",
+    "WITH recent AS (SELECT product_id, SUM(units) AS units FROM sales_daily GROUP BY product_id) "
+    "SELECT p.name, r.units FROM recent r JOIN products p ON p.id = r.product_id",
+    "SELECT t.name FROM (SELECT name, stock FROM products WHERE stock < 10) t ORDER BY t.stock",
+    "SELECT name, CASE WHEN stock < 10 THEN 'low' ELSE 'ok' END AS level FROM products",
+    "UPDATE products SET stock = stock - 2 WHERE id = 1 AND stock >= 2; "
+    "INSERT INTO sales (product_id, quantity, total_amount) VALUES (1, 2, 84); "
+    "SELECT name, stock FROM products WHERE id = 1",
+    "DELETE FROM sales WHERE id = 7",
+])
+def test_accepted_queries(sql):
+    assert prepare(sql)
+
+
+def test_read_and_write_kinds():
+    read, write = prepare("SELECT name FROM products; UPDATE products SET price = 40 WHERE id = 1")
+    assert read.readonly
+    assert write.kind == "write" and write.table == "products"
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM sqlite_master",
+    "SELECT name FROM app_flags",
+    "SELECT name FROM products JOIN app_flags ON 1 = 1",
+    "SELECT name FROM products, mandi_prices",
+    "SELECT name FROM products WHERE id IN (SELECT rowid FROM sqlite_master)",
+    "UPDATE app_flags SET name = 'x' WHERE name = 'y'",
+    "INSERT INTO sales_daily (product_id, day, units, revenue) VALUES (1, '2024-01-01', 1, 1)",
+])
+def test_other_tables_are_rejected(sql):
+    with pytest.raises(SqlRejected):
+        prepare(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT load_extension('x') FROM products",
+    "SELECT randomblob(1000000000) FROM products",
+    "SELECT sqlite_version()",
+    "PRAGMA table_info(products)",
+    "ATTACH DATABASE 'x.db' AS x",
+    "DROP TABLE products",
+    "SELECT name FROM products WHERE id = ?",
+])
+def test_functions_and_statements_are_rejected(sql):
+    with pytest.raises(SqlRejected):
+        prepare(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    # Output aliases must not make a name readable as a table or callable
+    "SELECT *, 1 sqlite_master FROM sqlite_master",
+    "SELECT *, 1 app_flags FROM app_flags",
+    "SELECT 1 AS sqlite_master, name FROM products JOIN sqlite_master ON 1 = 1",
+    "SELECT 1 load_extension, load_extension('x') FROM products",
+    "SELECT t.name FROM (SELECT name FROM products) t JOIN sqlite_master ON 1 = 1",
+    "SELECT 1 AS m FROM products WHERE m.name = 'x'",
+])
+def test_alias_smuggling_is_rejected(sql):
+    with pytest.raises(SqlRejected):
+        prepare(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "UPDATE products SET stock = 0",
+    "DELETE FROM sales",
+    "DELETE FROM sales; SELECT name FROM products",
+])
+def test_writes_need_where(sql):
+    with pytest.raises(SqlRejected, match="WHERE"):
+        prepare(sql)
+
+
+def test_rejects_whole_batch():
+    with pytest.raises(SqlRejected):
+        prepare("SELECT name FROM products; SELECT * FROM app_flags")
+
+
+def test_write_row_cap(monkeypatch):
+    engine = create_engine("sqlite://")
+    database.Base.metadata.create_all(engine, tables=[database.Product.__table__, database.Sale.__table__])
+    db = sessionmaker(bind=engine)()
+    db.add_all(database.Product(name=f"Item {i}", price=10, stock=5) for i in range(5))
+    db.commit()
+    monkeypatch.setattr(sql_engine, "SQL_MAX_WRITE_ROWS", 3)
+
+    statement, = prepare("UPDATE products SET stock = stock + 1 WHERE id <= 3")
+    assert sql_engine.execute_write(db, statement) == 3
+    statement, = prepare("UPDATE products SET stock = 0 WHERE price > 0")
+    with pytest.raises(SqlRejected, match="limit 3"):
+        sql_engine.execute_write(db, statement)
+    db.rollback()
+    assert {p.stock for p in db.query(database.Product)} == {5}
@@ -86,6 +86,7 @@ const ChatInterface = ({ messages, setMessages }) => {
         setIsLoading(true);
 
         try {
+            // Only sent to seed a new server-side session; later turns send the session id
             const history = newMessages.slice(1).map(msg => ({
                 role: msg.role,
                 content: msg.content
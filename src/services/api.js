@@ -6,14 +6,26 @@ export const api = axios.create({
     baseURL: API_URL,
 });
 
+// Server-side chat session shared by typed and voice turns. The conversation
+// lives on the server, so history is only sent to seed the first request; the
+// id is kept in memory and starts over with the page, like the messages do.
+let chatSessionId = null;
+
 export const chatWithData = async (message, history = [], language = 'en') => {
-    const response = await api.post('/chat/', { message, history, language });
+    const payload = chatSessionId
+        ? { message, language, session_id: chatSessionId }
+        : { message, history, language };
+    const response = await api.post('/chat/', payload);
+    chatSessionId = response.data.session_id || chatSessionId;
     return response.data;
 };
 
 export const sendVoiceMessage = async (audioBlob) => {
     const formData = new FormData();
     formData.append('file', audioBlob, 'voice.webm');
+    if (chatSessionId) {
+        formData.append('session_id', chatSessionId);
+    }
     const response = await api.post('/live/chat', formData, {
         headers: { 'Content-Type': 'multipart/form-data' },
         responseType: 'blob' // Important: Expect binary data
@@ -22,6 +34,7 @@ export const sendVoiceMessage = async (audioBlob) => {
     // Extract text response from headers
     const textResponse = decodeURIComponent(response.headers['x-text-response'] || '');
     const language = response.headers['x-language'] || 'en';
+    chatSessionId = response.headers['x-session-id'] || chatSessionId;
 
     return {
         audioBlob: response.data,